@@ -51,13 +51,19 @@ function AuthSwitcher() {
 
         try {
           // Send heartbeat request to server
-          await fetch(`${import.meta.env.VITE_API_URL}/heartbeat`, {
+          const response = await fetch(`${import.meta.env.VITE_API_URL}/heartbeat`, {
             method: 'POST',
             headers: {
               'Content-Type': 'application/json',
               'Session-ID': sessionId,
             },
           });
+
+          // In signed token mode the server renews the token - keep the new one
+          const data = await response.json();
+          if (data.session_id && localStorage.getItem('session_id') === sessionId) {
+            localStorage.setItem('session_id', data.session_id);
+          }
         } catch (error) {
           // Ignore network errors - they don't affect the user experience
           // The session will be handled by the server's own timeout logic
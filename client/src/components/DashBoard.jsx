@@ -90,6 +90,9 @@ const Dashboard = () => {
         params.append("categories", "All");
       } else if (chartName === 'monthly_comparison' && Array.isArray(categoriesList)) {
         categoriesList.forEach((c) => params.append('categories', c));
+      } else if (chartName === 'combined' && Array.isArray(categoriesList)) {
+        // One comma separated selection for the monthly comparison
+        params.append('compare', categoriesList.join(','));
       }
 
       // Fetch data
@@ -119,28 +122,42 @@ const Dashboard = () => {
     }
   };
 
-  // Fetch data for the category breakdown chart
-  const fetchDashboardData = async () => {
-    await fetchChartData({ chartName: CHART_TYPE }, (data) => {
-      const serverData = data.data || [];
-
-      // Ensure all categories exist (fill missing with 0)
-      const completeData = categories.map(category => {
-        const existing = serverData.find(item => item.category === category);
-        return existing || { category, amount: 0, percentage: 0 };
-      });
+  // Show the category breakdown chart
+  const showDashboardData = (data) => {
+    const serverData = data.data || [];
 
-      setChartData(completeData);
-      setTotal(completeData.reduce((sum, item) => sum + item.amount, 0));
+    // Ensure all categories exist (fill missing with 0)
+    const completeData = categories.map(category => {
+      const existing = serverData.find(item => item.category === category);
+      return existing || { category, amount: 0, percentage: 0 };
     });
+
+    setChartData(completeData);
+    setTotal(completeData.reduce((sum, item) => sum + item.amount, 0));
+  };
+
+  // Show the monthly comparison chart
+  const showMonthlyComparison = (data) => {
+    setMonthlyComparisonData(data);
+    const sumTotal = (data?.data || []).reduce((acc, item) => acc + (item?.amount || 0), 0);
+    setTotal(sumTotal);
+  };
+
+  // Fetch data for the category breakdown chart
+  const fetchDashboardData = async () => {
+    await fetchChartData({ chartName: CHART_TYPE }, showDashboardData);
   };
 
   // Fetch data for monthly comparison chart
   const fetchMonthlyComparison = async (categoryList) => {
-    await fetchChartData({ chartName: 'monthly_comparison', categoriesList: categoryList }, (data) => {
-      setMonthlyComparisonData(data);
-      const sumTotal = (data?.data || []).reduce((acc, item) => acc + (item?.amount || 0), 0);
-      setTotal(sumTotal);
+    await fetchChartData({ chartName: 'monthly_comparison', categoriesList: categoryList }, showMonthlyComparison);
+  };
+
+  // Fetch both charts in one request (same data as the two requests above)
+  const fetchCombinedData = async (categoryList) => {
+    await fetchChartData({ chartName: 'combined', categoriesList: categoryList }, (data) => {
+      showDashboardData(data.category_breakdown?.[selectedCurrency] || {});
+      showMonthlyComparison(data.monthly_comparison?.[selectedCurrency]?.[0] || null);
     });
   };
 
@@ -156,10 +173,11 @@ const Dashboard = () => {
 
     if (currencyChanged || monthsChanged) {
       prevValuesRef.current = { currency: selectedCurrency, months: selectedMonths };
-      fetchDashboardData();
 
       if (activePrimaryButton === 'compare' && previousCompareCategories.size > 0) {
-        fetchMonthlyComparison(Array.from(previousCompareCategories));
+        fetchCombinedData(Array.from(previousCompareCategories));
+      } else {
+        fetchDashboardData();
       }
     }
   }, [selectedCurrency, selectedMonths]);
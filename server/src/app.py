@@ -20,9 +20,15 @@ else:
 import logging
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from services import logicconnection as logic_connection
 from services import logicexpenses as logic_expenses
+from services import logicimport as logic_import
 from db import db as mongo_db
+from db import cache
+from db import indexes
+from utils import metrics
+from utils.jsonprovider import OrjsonProvider
 
 
 # Configure logging at the main entry point
@@ -39,16 +45,52 @@ logger = logging.getLogger(__name__)
 
 # Creates a Flask app - my web server and allows other applications to connect to it (such as my React client)
 app = Flask(__name__)
+# Encode and decode JSON with orjson
+app.json = OrjsonProvider(app)
+
+# Number of proxies in front of the app (the ingress is one) - their X-Forwarded-For entries are trusted
+# for the client IP (login throttle, logs). 0 (default) ignores the header, so clients cannot fake it
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
 
 # Print environment and DB info for diagnostics
 env_val = os.getenv('ENV')
 mongo_name = getattr(mongo_db, 'name', 'unknown')
 logger.info(f"Mongo URI in use | database={mongo_name}")
 
+# Create the missing MongoDB indexes (once, before gunicorn forks the workers)
+indexes.ensure_indexes_on_startup()
+
+# Reject larger request bodies before they are read (the import limit plus room for the multipart headers)
+app.config['MAX_CONTENT_LENGTH'] = logic_import.IMPORT_MAX_FILE_BYTES + 64 * 1024
+
 # Allow CORS for all origins
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
 
+# Answer a request body over MAX_CONTENT_LENGTH with JSON like the other errors
+@app.errorhandler(413)
+def request_too_large(error):
+    logger.warning(f"Request body too large | path={request.path} | content_length={request.content_length} | remote_addr={request.remote_addr}")
+    return jsonify({'message': f'File must be smaller than {logic_import.IMPORT_MAX_FILE_BYTES // (1024 * 1024)} MB'}), 413
+
+
+# Reset the Redis command counter at the start of every request
+@app.before_request
+def reset_redis_call_count():
+    cache.reset_redis_call_count()
+
+
+# Report how many Redis round trips the request made (header + log line for the latency dashboards)
+@app.after_request
+def report_redis_call_count(response):
+    redis_calls = cache.get_redis_call_count()
+    metrics.observe('redis_calls_per_request', redis_calls)
+    response.headers['X-Redis-Calls'] = str(redis_calls)
+    logger.info(f"Request finished | path={request.path} | status_code={response.status_code} | redis_calls={redis_calls}")
+    return response
+
+
 # Root route - check if the backend is running
 @app.route('/')
 def root():
@@ -69,6 +111,7 @@ def health_check():
 
     mongo_ok = False
     redis_ok = False
+    missing_indexes = []
 
     # Check MongoDB connection
     try:
@@ -76,6 +119,16 @@ def health_check():
         mongo_ok = True
     except Exception as e:
         logger.error(f"[Health Check] MongoDB connection failed | error={str(e)}")
+
+    # Check the required indexes exist (without them every expenses query scans the collection)
+    if mongo_ok:
+        try:
+            missing_indexes = indexes.check_required_indexes()
+        except Exception as e:
+            missing_indexes = ['unknown']
+            logger.error(f"[Health Check] Index check failed | error={str(e)}")
+        if missing_indexes:
+            logger.warning(f"[Health Check] Required indexes missing | missing={missing_indexes}")
     
     # Check Redis connection
     try:
@@ -85,16 +138,26 @@ def health_check():
         logger.error(f"[Health Check] Redis connection failed | error={str(e)}")
     
     # Return the result
-    status = 'healthy' if mongo_ok and redis_ok else 'degraded'
+    status = 'healthy' if mongo_ok and redis_ok and not missing_indexes else 'degraded'
 
     return jsonify({
         'status': status,
         'mongo': mongo_ok,
         'redis': redis_ok,
+        'indexes': mongo_ok and not missing_indexes,
+        'missing_indexes': missing_indexes,
         'message': 'FinBrain API health check'
     }), 200
 
 
+# Metrics route - in-process counters and timings of this worker (session refreshes, Redis calls, ...)
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    snapshot = metrics.snapshot()
+    snapshot['redis_pool'] = cache.get_redis_pool_stats()
+    return jsonify(snapshot), 200
+
+
 # Signup route - This is where the user will sign up for an account
 @app.route('/signup', methods=['POST'])
 def signup():
@@ -179,14 +242,61 @@ def add_expense():
     return result
 
 
+# Add expenses route - This is where the user will add many expenses to their account at once
+@app.route('/add_expenses', methods=['POST'])
+def add_expenses():
+    logger.info(f"Add expenses request received | remote_addr={request.remote_addr}")
+
+    # Get the JSON data from the request 
+    try:
+        data = request.get_json()
+        if data is None:
+            logger.warning(f"Add expenses request with invalid JSON | remote_addr={request.remote_addr}")
+            return jsonify({'message': 'Invalid JSON format'}), 400
+    except Exception as e:
+        logger.warning(f"Add expenses request with invalid JSON | remote_addr={request.remote_addr} | error={str(e)}")
+        return jsonify({'message': 'Invalid JSON format'}), 400
+    
+    # Get the session ID from the request headers and handle the request
+    session_id = request.headers.get('Session-ID')
+    result = logic_expenses.handle_add_expenses(data, session_id)
+    logger.info(f"Add expenses request completed | status_code={result[1]} | remote_addr={request.remote_addr}")
+    return result
+
+
+# Import expenses route - This is where the user will upload a bank statement (CSV) to import many expenses
+@app.route('/import_expenses', methods=['POST'])
+def import_expenses():
+    logger.info(f"Import expenses request received | remote_addr={request.remote_addr}")
+    session_id = request.headers.get('Session-ID')
+    result = logic_import.handle_import_expenses(request.files.get('file'), session_id, request.form.get('currency'))
+    logger.info(f"Import expenses request completed | status_code={result[1]} | remote_addr={request.remote_addr}")
+    return result
+
+
+# Import status route - This is where the user will check the progress of an import
+@app.route('/import_status', methods=['GET'])
+def import_status():
+    job_id = request.args.get('job_id', type=str)
+    session_id = request.headers.get('Session-ID')
+    result = logic_import.handle_import_status(job_id, session_id)
+    logger.info(f"Import status request completed | status_code={result[1]} | job_id={job_id} | remote_addr={request.remote_addr}")
+    return result
+
+
 # Get expenses route - This is where the user will get their expenses from their account
 @app.route('/get_expenses', methods=['GET'])
 def get_expenses():
     month = request.args.get('month', type=int)
     year = request.args.get('year', type=int)
+    # Optional paging (limit = page size, after = next_cursor of the previous page)
+    limit = request.args.get('limit', type=int)
+    after = request.args.get('after', type=str)
     session_id = request.headers.get('Session-ID')
-    logger.info(f"Get expenses request received | month={month} | year={year} | remote_addr={request.remote_addr}")
-    result = logic_expenses.handle_get_expenses(month, year, session_id)
+    logger.info(f"Get expenses request received | month={month} | year={year} | limit={limit} | remote_addr={request.remote_addr}")
+    # ETag the client got with this month before (answered with 304 if the month did not change)
+    if_none_match = request.headers.get('If-None-Match')
+    result = logic_expenses.handle_get_expenses(month, year, session_id, limit, after, if_none_match)
     logger.info(f"Get expenses request completed | status_code={result[1]} | month={month} | year={year} | remote_addr={request.remote_addr}")
     return result
 
@@ -199,8 +309,17 @@ def expenses_for_dashboard():
     months = request.args.getlist('months')
     categories = request.args.getlist('categories')
     session_id = request.headers.get('Session-ID')
+    if_none_match = request.headers.get('If-None-Match')
+    if chart == 'combined':
+        # Both charts at once: currency can repeat, every compare value is one comma separated category selection
+        currencies = request.args.getlist('currency')
+        compare_selections = [selection.split(',') for selection in request.args.getlist('compare')]
+        logger.info(f"Get combined dashboard request received | currencies={currencies} | months={months} | selections={len(compare_selections)} | remote_addr={request.remote_addr}")
+        result = logic_expenses.handle_get_combined_dashboard(currencies, months, compare_selections, session_id, if_none_match)
+        logger.info(f"Get combined dashboard request completed | status_code={result[1]} | currencies={currencies} | remote_addr={request.remote_addr}")
+        return result
     logger.info(f"Get expenses for dashboard request received | chart={chart} | currency={currency} | months={months} | categories={categories} | remote_addr={request.remote_addr}")
-    result = logic_expenses.handle_get_expenses_for_dashboard(chart, currency, months, categories, session_id)
+    result = logic_expenses.handle_get_expenses_for_dashboard(chart, currency, months, categories, session_id, if_none_match)
     logger.info(f"Get expenses for dashboard request completed | status_code={result[1]} | chart={chart} | currency={currency} | remote_addr={request.remote_addr}")
     return result
 
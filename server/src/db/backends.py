@@ -0,0 +1,307 @@
+# FinBrain Project - backends.py - MIT License (c) 2025 Nadav Eshed
+
+
+import time
+import fnmatch
+import threading
+import logging
+from redis.exceptions import ResponseError
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """
+    Key-value operations the session and cache code relies on
+    Implemented by db.cache.CountingRedis (Redis) and InMemoryBackend (inside this process)
+    """
+    def ping(self):
+        raise NotImplementedError
+
+    def get(self, name):
+        raise NotImplementedError
+
+    def mget(self, keys):
+        raise NotImplementedError
+
+    def setex(self, name, time, value):
+        raise NotImplementedError
+
+    def delete(self, *names):
+        raise NotImplementedError
+
+    def hget(self, name, key):
+        raise NotImplementedError
+
+    def hgetall(self, name):
+        raise NotImplementedError
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        raise NotImplementedError
+
+    def hsetnx(self, name, key, value):
+        raise NotImplementedError
+
+    def expire(self, name, time):
+        raise NotImplementedError
+
+    def scan_iter(self, match=None, count=None):
+        raise NotImplementedError
+
+    def keys(self, pattern='*'):
+        raise NotImplementedError
+
+    def touch_hash(self, name, field, value, seconds):
+        """
+        Get a hash and, if it exists, set one field and reset its TTL in one atomic step
+        Returns the hash as it was before the update (empty dict if it does not exist)
+        """
+        raise NotImplementedError
+
+    def update_value(self, name, update):
+        """
+        Replace a string value with update(value) in one atomic step, keeping its TTL
+        Returns False if the key does not exist (nothing is written)
+        """
+        raise NotImplementedError
+
+
+class ZSet(dict):
+    """
+    Sorted set value of InMemoryBackend (member -> score)
+    """
+
+
+class UnsupportedScript:
+    """
+    Stand-in for a Redis Lua script on a backend that cannot run Lua
+    """
+    def __init__(self, script):
+        self.script = script
+
+    def __call__(self, keys=None, args=None, client=None):
+        raise NotImplementedError("Lua scripts need the Redis cache backend")
+
+
+class InMemoryBackend(CacheBackend):
+    """
+    Thread-safe cache backend that keeps everything in this process, with TTL support
+    Only for a single worker process (sessions are not shared between processes) and for tests
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = {}
+        self._expires_at = {}
+
+    def _encode(self, value):
+        # Store strings only, like Redis with decode_responses=True
+        if isinstance(value, bytes):
+            return value.decode('utf-8')
+        return str(value)
+
+    def _now(self):
+        return time.monotonic()
+
+    def _exists(self, name):
+        # Drop the key if its TTL has passed (must be called with the lock held)
+        expires_at = self._expires_at.get(name)
+        if expires_at is not None and expires_at <= self._now():
+            self._data.pop(name, None)
+            self._expires_at.pop(name, None)
+        return name in self._data
+
+    def _get_value(self, name, value_type):
+        # Get the value of a key, checking it holds the expected type (must be called with the lock held)
+        if not self._exists(name):
+            return None
+        value = self._data[name]
+        if type(value) is not value_type:
+            raise ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def ping(self):
+        return True
+
+    def get(self, name):
+        with self._lock:
+            return self._get_value(name, str)
+
+    def mget(self, keys):
+        with self._lock:
+            values = []
+            for name in keys:
+                value = self._data[name] if self._exists(name) else None
+                # Like Redis, a key holding another type reads as None
+                values.append(value if type(value) is str else None)
+            return values
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            value = int(self._get_value(name, str) or 0) + amount
+            self._data[name] = str(value)
+            return value
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._data[name] = self._encode(value)
+            self._expires_at.pop(name, None)
+            if ex is not None:
+                self._expires_at[name] = self._now() + int(ex)
+            return True
+
+    def setex(self, name, time, value):
+        return self.set(name, value, ex=time)
+
+    def delete(self, *names):
+        with self._lock:
+            deleted = 0
+            for name in names:
+                if self._exists(name):
+                    del self._data[name]
+                    self._expires_at.pop(name, None)
+                    deleted += 1
+            return deleted
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._exists(name))
+
+    def expire(self, name, time):
+        with self._lock:
+            if not self._exists(name):
+                return False
+            self._expires_at[name] = self._now() + int(time)
+            return True
+
+    def ttl(self, name):
+        with self._lock:
+            if not self._exists(name):
+                return -2
+            expires_at = self._expires_at.get(name)
+            if expires_at is None:
+                return -1
+            return max(0, round(expires_at - self._now()))
+
+    def hget(self, name, key):
+        with self._lock:
+            value = self._get_value(name, dict)
+            return (value or {}).get(key)
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._get_value(name, dict) or {})
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        fields = dict(mapping or {})
+        if key is not None:
+            fields[key] = value
+        with self._lock:
+            hash_value = self._get_value(name, dict)
+            if hash_value is None:
+                hash_value = self._data[name] = {}
+            added = sum(1 for field in fields if field not in hash_value)
+            hash_value.update({field: self._encode(field_value) for field, field_value in fields.items()})
+            return added
+
+    def hsetnx(self, name, key, value):
+        with self._lock:
+            hash_value = self._get_value(name, dict)
+            if hash_value is None:
+                hash_value = self._data[name] = {}
+            if key in hash_value:
+                return False
+            hash_value[key] = self._encode(value)
+            return True
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            hash_value = self._get_value(name, dict) or {}
+            deleted = sum(1 for key in keys if hash_value.pop(key, None) is not None)
+            # Like Redis, a hash without fields does not exist
+            if name in self._data and not hash_value:
+                self.delete(name)
+            return deleted
+
+    def touch_hash(self, name, field, value, seconds):
+        with self._lock:
+            hash_value = self._get_value(name, dict)
+            if not hash_value:
+                return {}
+            previous = dict(hash_value)
+            hash_value[field] = self._encode(value)
+            self._expires_at[name] = self._now() + int(seconds)
+            return previous
+
+    def update_value(self, name, update):
+        with self._lock:
+            value = self._get_value(name, str)
+            if value is None:
+                return False
+            # The TTL in _expires_at is left as it is
+            self._data[name] = self._encode(update(value))
+            return True
+
+    def keys(self, pattern='*'):
+        with self._lock:
+            return [name for name in list(self._data) if self._exists(name) and fnmatch.fnmatchcase(name, pattern)]
+
+    def scan_iter(self, match=None, count=None):
+        # Iterate over a snapshot so the lock is not held while the caller works
+        yield from self.keys(match or '*')
+
+    def zadd(self, name, mapping):
+        with self._lock:
+            zset = self._get_value(name, ZSet)
+            if zset is None:
+                zset = self._data[name] = ZSet()
+            added = sum(1 for member in mapping if member not in zset)
+            zset.update({member: float(score) for member, score in mapping.items()})
+            return added
+
+    def zrem(self, name, *members):
+        with self._lock:
+            zset = self._get_value(name, ZSet) or {}
+            return sum(1 for member in members if zset.pop(member, None) is not None)
+
+    def zscore(self, name, member):
+        with self._lock:
+            return (self._get_value(name, ZSet) or {}).get(member)
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._get_value(name, ZSet) or {})
+
+    def zrangebyscore(self, name, min, max, withscores=False):
+        with self._lock:
+            zset = self._get_value(name, ZSet) or {}
+            entries = sorted(
+                ((member, score) for member, score in zset.items() if float(min) <= score <= float(max)),
+                key=lambda entry: (entry[1], entry[0])
+            )
+        return entries if withscores else [member for member, _ in entries]
+
+    def zremrangebyscore(self, name, min, max):
+        with self._lock:
+            zset = self._get_value(name, ZSet) or {}
+            removed = [member for member, score in zset.items() if float(min) <= score <= float(max)]
+            for member in removed:
+                del zset[member]
+            return len(removed)
+
+    def publish(self, channel, message):
+        # There are no other processes to notify
+        return 0
+
+    def pubsub(self, **kwargs):
+        raise NotImplementedError("Pub/sub needs the Redis cache backend")
+
+    def register_script(self, script):
+        return UnsupportedScript(script)
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+            self._expires_at.clear()
+            return True
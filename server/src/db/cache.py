@@ -7,6 +7,14 @@ import redis
 from dotenv import load_dotenv
 import logging
 import json
+import time
+import contextvars
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+from utils import metrics
+from db.backends import CacheBackend, InMemoryBackend
+from db import cachecodec
+from utils import jsonprovider
 
 
 # Create a logger for this module
@@ -32,6 +40,67 @@ if raw_redis_url and os.path.isfile(raw_redis_url):
 else:
     REDIS_URL = raw_redis_url
 
+# Where sessions and cached data live: 'redis' (default) or 'memory' (inside this process - single worker and tests only)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'redis').lower()
+
+# Connection pool settings - size REDIS_MAX_CONNECTIONS against gunicorn threads per worker
+# (each worker process has its own pool; a request waits up to REDIS_POOL_TIMEOUT_SECONDS for a free connection)
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))
+REDIS_POOL_TIMEOUT_SECONDS = float(os.getenv('REDIS_POOL_TIMEOUT_SECONDS', '5'))
+REDIS_SOCKET_TIMEOUT_SECONDS = float(os.getenv('REDIS_SOCKET_TIMEOUT_SECONDS', '5'))
+REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS = float(os.getenv('REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS', '2'))
+REDIS_HEALTH_CHECK_INTERVAL_SECONDS = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL_SECONDS', '30'))
+# Transient errors (connection reset, timeout) are retried with exponential backoff
+REDIS_RETRY_ATTEMPTS = int(os.getenv('REDIS_RETRY_ATTEMPTS', '3'))
+REDIS_RETRY_BACKOFF_BASE_SECONDS = float(os.getenv('REDIS_RETRY_BACKOFF_BASE_SECONDS', '0.05'))
+REDIS_RETRY_BACKOFF_CAP_SECONDS = float(os.getenv('REDIS_RETRY_BACKOFF_CAP_SECONDS', '1'))
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """
+    Bounded connection pool that records how long callers wait for a connection
+    and can report how many connections are in use and idle
+    """
+    def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except redis.ConnectionError:
+            metrics.increment('redis_pool_errors')
+            raise
+        finally:
+            metrics.observe('redis_pool_wait_seconds', time.perf_counter() - start)
+        return connection
+
+    def get_stats(self):
+        """Get the number of created, in-use and idle connections of this process"""
+        self._checkpid()
+        with self.pool.mutex:
+            idle = sum(1 for connection in self.pool.queue if connection is not None)
+        created = len(self._connections)
+        return {
+            'max_connections': self.max_connections,
+            'created': created,
+            'in_use': created - idle,
+            'idle': idle
+        }
+
+
+def create_connection_pool(redis_url):
+    """Create the Redis connection pool with the configured limits, timeouts and retry policy"""
+    return InstrumentedConnectionPool.from_url(
+        redis_url,
+        decode_responses=True,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT_SECONDS,
+        socket_timeout=REDIS_SOCKET_TIMEOUT_SECONDS,
+        socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+        retry=Retry(ExponentialBackoff(cap=REDIS_RETRY_BACKOFF_CAP_SECONDS, base=REDIS_RETRY_BACKOFF_BASE_SECONDS), REDIS_RETRY_ATTEMPTS)
+    )
+
+
 # Use test-specific key prefix to avoid conflicts with production data
 def get_cache_key_prefix():
     """Get cache key prefix based on environment"""
@@ -40,15 +109,128 @@ def get_cache_key_prefix():
     else:
         return "usd_ils_rate:"
 
-# Connect to Redis (decode_responses=True means we get strings instead of bytes)
-try:
-    r = redis.from_url(REDIS_URL, decode_responses=True)
-    # Test the connection
-    r.ping()
-    logger.info(f"Connected to Redis | redis_url={REDIS_URL}")
-except Exception as e:
-    logger.error(f"Failed to connect to Redis | redis_url={REDIS_URL} | error={str(e)}")
-    raise
+# Number of Redis commands sent during the current request (reset by app.py before every request)
+_redis_call_count = contextvars.ContextVar('redis_call_count', default=0)
+
+
+# How many times update_value retries when another client changes the key between the read and the write
+UPDATE_VALUE_MAX_ATTEMPTS = 3
+
+
+# Lua script that reads a hash and, if it exists, sets one field and resets its TTL in one atomic round trip
+# KEYS[1] = hash key, ARGV[1] = field, ARGV[2] = value, ARGV[3] = TTL in seconds
+# Returns the hash as a flat [field, value, ...] list (empty list if the hash does not exist)
+TOUCH_HASH_LUA = """
+local hash = redis.call('HGETALL', KEYS[1])
+if #hash == 0 then
+    return hash
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return hash
+"""
+
+
+def count_redis_calls(count):
+    """Add count commands to the Redis command counter of the current request"""
+    _redis_call_count.set(_redis_call_count.get() + count)
+
+
+class CountingPipeline(redis.client.Pipeline):
+    """
+    Pipeline of CountingRedis that adds the commands it sends to the same counter
+    Commands sent at once (WATCH and the reads after it) count when they are sent, queued commands when they are executed
+    """
+    def immediate_execute_command(self, *args, **options):
+        count_redis_calls(1)
+        return super().immediate_execute_command(*args, **options)
+
+    def execute(self, raise_on_error=True):
+        if self.command_stack:
+            # A transaction wraps the queued commands in MULTI and EXEC
+            transaction = self.transaction or self.explicit_transaction
+            count_redis_calls(len(self.command_stack) + (2 if transaction else 0))
+        return super().execute(raise_on_error)
+
+
+class CountingRedis(redis.Redis, CacheBackend):
+    """
+    Redis cache backend that counts every command it sends
+    Each command is one network round trip, so the count shows how much Redis work a request did
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._touch_hash_script = self.register_script(TOUCH_HASH_LUA)
+
+    def execute_command(self, *args, **options):
+        count_redis_calls(1)
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+    def touch_hash(self, name, field, value, seconds):
+        flat_hash = self._touch_hash_script(keys=[name], args=[field, value, seconds])
+        # Convert [field, value, field, value, ...] into a dict
+        return dict(zip(flat_hash[::2], flat_hash[1::2]))
+
+    def update_value(self, name, update):
+        # Optimistic check-and-set: WATCH the key, compute the new value, and write it only if nobody changed it meanwhile
+        with self.pipeline() as pipe:
+            for _ in range(UPDATE_VALUE_MAX_ATTEMPTS):
+                try:
+                    pipe.watch(name)
+                    value = pipe.get(name)
+                    if value is None:
+                        pipe.unwatch()
+                        return False
+                    new_value = update(value)
+                    pipe.multi()
+                    pipe.set(name, new_value, keepttl=True)
+                    pipe.execute()
+                    return True
+                except redis.WatchError:
+                    continue
+        raise redis.WatchError(f"Key kept changing during update | key={name}")
+
+
+def reset_redis_call_count():
+    """Reset the Redis command counter (called at the start of every request)"""
+    _redis_call_count.set(0)
+
+
+def get_redis_call_count():
+    """Get the number of Redis commands sent since the last reset"""
+    return _redis_call_count.get()
+
+
+def create_cache_backend():
+    """Create the cache backend selected by CACHE_BACKEND, returning (backend, Redis pool or None)"""
+    if CACHE_BACKEND == 'memory':
+        logger.info("Using in-process cache backend | cache_backend=memory")
+        return InMemoryBackend(), None
+    if CACHE_BACKEND != 'redis':
+        raise RuntimeError(f"Unknown CACHE_BACKEND: {CACHE_BACKEND}. Use 'redis' or 'memory'.")
+
+    # Connect to Redis (decode_responses=True means we get strings instead of bytes)
+    try:
+        redis_pool = create_connection_pool(REDIS_URL)
+        client = CountingRedis(connection_pool=redis_pool)
+        # Test the connection
+        client.ping()
+        logger.info(f"Connected to Redis | redis_url={REDIS_URL} | max_connections={REDIS_MAX_CONNECTIONS}")
+    except Exception as e:
+        logger.error(f"Failed to connect to Redis | redis_url={REDIS_URL} | error={str(e)}")
+        raise
+    return client, redis_pool
+
+
+r, pool = create_cache_backend()
+
+
+def get_redis_pool_stats():
+    """Get the connection pool statistics of this process (exposed by the /metrics route)"""
+    return pool.get_stats() if pool is not None else {}
 
 
 def get_cached_currency_rate(date_str):
@@ -85,58 +267,292 @@ def add_to_cache_currency_rate(date_str, rate):
         logger.error(f"Error adding currency rate to cache | date={date_str} | rate={rate} | error={str(e)}")
 
 
-def get_cached_user_expenses(email, month, year):
+def get_cached_user_expenses_json(email, month, year):
     """
-    Get cached user expenses for a specific month and year
-    Returns the expenses if found in cache, None otherwise
+    Get cached user expenses for a specific month and year as the JSON text kept in the cache (not decoded)
+    Returns the JSON array text if found in cache, None otherwise
     """
     try:
         # Get the cache key with user expenses prefix
         cache_key = f"{get_user_expenses_cache_key_prefix()}user:{str(email).strip().lower()}:month:{year}-{month:02d}"
         
-        # Get the cached expenses if they exist (None if not found)
-        cached_expenses = r.get(cache_key)
-        if cached_expenses:
+        # Get the cached expenses if they exist (None if not found), in JSON whatever format they were stored in
+        cached_expenses = cachecodec.decode_expenses(r.get(cache_key))
+        # The text is sent to the client as it is, so anything but a JSON array counts as a miss
+        if cached_expenses and cached_expenses.startswith('[') and cached_expenses.endswith(']'):
             logger.info(f"User expenses found in cache | email={str(email)} | month={month} | year={year}")
-            return json.loads(cached_expenses)
+            return cached_expenses
         return None
     except Exception as e:
         logger.error(f"Error getting cached user expenses | email={str(email)} | month={month} | year={year} | error={str(e)}")
         return None
 
 
+def get_cached_user_expenses(email, month, year):
+    """
+    Get cached user expenses for a specific month and year
+    Returns the expenses if found in cache, None otherwise
+    """
+    cached_expenses = get_cached_user_expenses_json(email, month, year)
+    if cached_expenses is None:
+        return None
+    try:
+        return json.loads(cached_expenses)
+    except ValueError as e:
+        logger.error(f"Error decoding cached user expenses | email={str(email)} | month={month} | year={year} | error={str(e)}")
+        return None
+
+
 def add_to_cache_user_expenses(email, month, year, expenses):
     """
     Add user expenses for a specific month and year to the cache
     TTL is set to 1 week (604800 seconds)
+    Returns the JSON text of the expenses (what a cache hit sends), None if it could not be built
     """
     try:
         # Get the cache key with user expenses prefix
         cache_key = f"{get_user_expenses_cache_key_prefix()}user:{str(email).strip().lower()}:month:{year}-{month:02d}"
         
-        # Add the expenses to the cache with TTL of 1 week (604800 seconds)
-        r.setex(cache_key, 604800, json.dumps(expenses))
-        logger.info(f"User expenses added to cache | email={str(email)} | month={month} | year={year} | expense_count={len(expenses)}")
+        # Add the expenses to the cache with TTL of 1 week (604800 seconds), in the format of EXPENSES_CACHE_ENCODING
+        expenses_json = jsonprovider.dumps_compact(expenses)
+    except Exception as e:
+        logger.error(f"Error encoding user expenses for the cache | email={str(email)} | month={month} | year={year} | error={str(e)}")
+        return None
+    try:
+        value = cachecodec.encode_expenses(expenses_json)
+        r.setex(cache_key, 604800, value)
+        logger.info(f"User expenses added to cache | email={str(email)} | month={month} | year={year} | expense_count={len(expenses)} | bytes={len(value.encode())} | saved_bytes={len(expenses_json.encode()) - len(value.encode())}")
     except Exception as e:
         logger.error(f"Error adding user expenses to cache | email={str(email)} | month={month} | year={year} | error={str(e)}")
+    return expenses_json
+
+
+def get_user_expenses_pages_key(email, month, year):
+    """
+    Get the key of the hash that holds the cached pages of a month (field = page ID, value = page JSON)
+    Every write to the month deletes the whole hash
+    """
+    return f"{get_user_expenses_cache_key_prefix()}user:{str(email).strip().lower()}:month:{year}-{month:02d}:pages"
+
+
+def get_cached_user_expenses_page_json(email, month, year, page_id):
+    """
+    Get one cached page of a month's expenses as the JSON text kept in the cache (not decoded)
+    Returns the JSON object text of the page if found in cache, None otherwise
+    """
+    try:
+        cached_page = r.hget(get_user_expenses_pages_key(email, month, year), page_id)
+        if cached_page and cached_page.startswith('{') and cached_page.endswith('}'):
+            logger.info(f"User expenses page found in cache | email={str(email)} | month={month} | year={year} | page_id={page_id}")
+            return cached_page
+        return None
+    except Exception as e:
+        logger.error(f"Error getting cached user expenses page | email={str(email)} | month={month} | year={year} | page_id={page_id} | error={str(e)}")
+        return None
+
+
+def add_to_cache_user_expenses_page(email, month, year, page_id, page):
+    """
+    Add one page of a month's expenses to the cache
+    TTL is set to 1 week (604800 seconds), renewed whenever a page of the month is added
+    Returns the JSON text of the page (what a cache hit sends)
+    """
+    page_json = jsonprovider.dumps_compact(page)
+    try:
+        pages_key = get_user_expenses_pages_key(email, month, year)
+        r.hset(pages_key, page_id, page_json)
+        r.expire(pages_key, 604800)
+        logger.info(f"User expenses page added to cache | email={str(email)} | month={month} | year={year} | page_id={page_id} | expense_count={len(page['expenses'])}")
+    except Exception as e:
+        logger.error(f"Error adding user expenses page to cache | email={str(email)} | month={month} | year={year} | page_id={page_id} | error={str(e)}")
+    return page_json
+
+
+# How long a computed dashboard chart is kept (it is also replaced as soon as the user's data changes)
+DASHBOARD_CACHE_TTL_SECONDS = 86400
+# How long the month version stamps of a user are kept after their last change (a lost stamp only costs one full response)
+MONTH_VERSIONS_TTL_SECONDS = 30 * 86400
+
+
+def get_user_data_generation_key(email):
+    """
+    Get the key of the user's data generation (a counter bumped by every write to the user's expenses)
+    """
+    return f"{get_user_expenses_cache_key_prefix()}user:{str(email).strip().lower()}:generation"
+
+
+def bump_user_data_generation(email):
+    """
+    Move the user's data generation forward, so every cached dashboard chart of the user is stale (one INCR)
+    """
+    try:
+        r.incr(get_user_data_generation_key(email))
+    except Exception as e:
+        logger.error(f"Error bumping user data generation | email={str(email)} | error={str(e)}")
+
+
+def get_user_month_versions_key(email):
+    """
+    Get the key of the user's month version stamps (a hash of 'YYYY-MM' -> stamp, used for the ETags of the reads)
+    """
+    return f"{get_user_expenses_cache_key_prefix()}user:{str(email).strip().lower()}:month_versions"
+
+
+def get_user_month_versions(email, months):
+    """
+    Get the version stamp of each month ('YYYY-MM') of the user, creating the stamps that do not exist yet
+    A stamp is random and replaced by every write to the month, so a stamp lost with Redis never comes back
+    Returns {month: stamp}, or None if Redis failed (the read is then served without an ETag)
+    """
+    try:
+        versions_key = get_user_month_versions_key(email)
+        versions = r.hgetall(versions_key)
+        month_versions = {}
+        for month in dict.fromkeys(months):
+            stamp = versions.get(month)
+            if stamp is None:
+                stamp = os.urandom(8).hex()
+                # If another request created the stamp first, this one is never stored and so never matches
+                if r.hsetnx(versions_key, month, stamp):
+                    r.expire(versions_key, MONTH_VERSIONS_TTL_SECONDS)
+            month_versions[month] = stamp
+        return month_versions
+    except Exception as e:
+        logger.error(f"Error getting month versions | email={str(email)} | months={months} | error={str(e)}")
+        return None
+
+
+def bump_user_month_version(email, month, year):
+    """
+    Replace the version stamp of the user's month, so the ETags sent for it no longer match
+    Called after the cached month was changed or deleted
+    """
+    try:
+        versions_key = get_user_month_versions_key(email)
+        r.hset(versions_key, f"{year}-{month:02d}", os.urandom(8).hex())
+        r.expire(versions_key, MONTH_VERSIONS_TTL_SECONDS)
+    except Exception as e:
+        logger.error(f"Error bumping month version | email={str(email)} | month={month} | year={year} | error={str(e)}")
+
+
+def get_dashboard_cache_key(email, chart, currency, months, categories):
+    """
+    Get the key of a cached dashboard chart (months and categories are sorted, so their order does not matter)
+    """
+    return (
+        f"{get_user_expenses_cache_key_prefix()}user:{str(email).strip().lower()}:dashboard:"
+        f"{chart}:{currency}:{','.join(sorted(set(months)))}:{','.join(sorted(set(categories)))}"
+    )
+
+
+def get_cached_dashboard(email, chart, currency, months, categories):
+    """
+    Get a cached dashboard chart together with the user's current data generation (one round trip)
+    Returns (data, generation) - data is None if nothing is cached for the current generation
+    The generation must be read before the chart is computed and passed to add_to_cache_dashboard
+    """
+    try:
+        generation, cached = r.mget([get_user_data_generation_key(email), get_dashboard_cache_key(email, chart, currency, months, categories)])
+        generation = int(generation or 0)
+        if cached:
+            cached = json.loads(cached)
+            if cached.get('generation') == generation:
+                logger.info(f"Dashboard chart found in cache | email={str(email)} | chart={chart} | currency={currency} | generation={generation}")
+                return cached['data'], generation
+        return None, generation
+    except Exception as e:
+        logger.error(f"Error getting cached dashboard chart | email={str(email)} | chart={chart} | error={str(e)}")
+        return None, None
+
+
+def add_to_cache_dashboard(email, chart, currency, months, categories, generation, data):
+    """
+    Cache a computed dashboard chart for the data generation it was computed from
+    """
+    if generation is None:
+        return
+    try:
+        cache_key = get_dashboard_cache_key(email, chart, currency, months, categories)
+        r.setex(cache_key, DASHBOARD_CACHE_TTL_SECONDS, json.dumps({'generation': generation, 'data': data}))
+        logger.info(f"Dashboard chart added to cache | email={str(email)} | chart={chart} | currency={currency} | generation={generation}")
+    except Exception as e:
+        logger.error(f"Error adding dashboard chart to cache | email={str(email)} | chart={chart} | error={str(e)}")
+
+
+def patch_user_expenses_cache(email, month, year, patch, action):
+    """
+    Change the cached expenses of a month in place with patch(expenses) -> expenses, atomically
+    A month that is not cached is left alone (the next read fills it from MongoDB)
+    If the patch fails the month is deleted instead, so the cache never keeps a stale list
+    The cached pages of the month are always deleted (their cursors would shift) and the cached dashboard charts become stale
+    """
+    cache_key = f"{get_user_expenses_cache_key_prefix()}user:{str(email).strip().lower()}:month:{year}-{month:02d}"
+    bump_user_data_generation(email)
+    try:
+        r.delete(get_user_expenses_pages_key(email, month, year))
+        patched = r.update_value(cache_key, lambda cached: cachecodec.encode_expenses(jsonprovider.dumps_compact(patch(json.loads(cachecodec.decode_expenses(cached))))))
+        if patched:
+            metrics.increment('expenses_cache_patched')
+            logger.info(f"User expenses cache patched | action={action} | email={str(email)} | month={month} | year={year}")
+    except Exception as e:
+        metrics.increment('expenses_cache_patch_failed')
+        logger.warning(f"Failed to patch user expenses cache, deleting it | action={action} | email={str(email)} | month={month} | year={year} | error={str(e)}")
+        delete_user_expenses_cache(email, month, year)
+        return
+    bump_user_month_version(email, month, year)
+
+
+def append_to_cached_user_expenses(email, month, year, expenses):
+    """
+    Add new expenses (already in the cached format) to the end of the cached month
+    """
+    patch_user_expenses_cache(email, month, year, lambda cached: cached + list(expenses), 'append')
+
+
+def update_cached_expense_category(email, month, year, serial_number, category):
+    """
+    Set the category of one expense in the cached month
+    """
+    def patch(cached):
+        for expense in cached:
+            if expense.get('serial_number') == serial_number:
+                expense['category'] = category
+                expense.pop('category_pending', None)
+        return cached
+
+    patch_user_expenses_cache(email, month, year, patch, 'update_category')
+
+
+def remove_from_cached_user_expenses(email, month, year, serial_number):
+    """
+    Remove one expense from the cached month
+    """
+    patch_user_expenses_cache(
+        email, month, year,
+        lambda cached: [expense for expense in cached if expense.get('serial_number') != serial_number],
+        'remove'
+    )
 
 
 def delete_user_expenses_cache(email, month, year):
     """
-    Delete cached user expenses for a specific month and year
+    Delete cached user expenses (and the cached pages) for a specific month and year
+    The cached dashboard charts of the user become stale too
     """
+    bump_user_data_generation(email)
     try:
         # Get the cache key with user expenses prefix
         cache_key = f"{get_user_expenses_cache_key_prefix()}user:{str(email).strip().lower()}:month:{year}-{month:02d}"
         
         # Delete the cached expenses
-        result = r.delete(cache_key)
+        result = r.delete(cache_key, get_user_expenses_pages_key(email, month, year))
         if result:
             logger.info(f"User expenses cache invalidated | email={str(email)} | month={month} | year={year}")
         else:
             logger.info(f"No cache found to invalidate | email={str(email)} | month={month} | year={year}")
     except Exception as e:
         logger.error(f"Error invalidating user expenses cache | email={str(email)} | month={month} | year={year} | error={str(e)}")
+    bump_user_month_version(email, month, year)
 
 
 def get_user_expenses_cache_key_prefix():
@@ -172,16 +588,24 @@ def clear_test_cache():
 def delete_all_user_expenses_cache(email):
     """
     Delete all cached user expenses for the given user across all months/years
+    The cached dashboard charts of the user become stale too
     """
+    bump_user_data_generation(email)
     try:
         key_prefix = get_user_expenses_cache_key_prefix()
         # Keys are in format: {prefix}user:{email}:month:YYYY-MM
         pattern = f"{key_prefix}user:{str(email).strip().lower()}:month:*"
-        keys = r.keys(pattern)
+        # SCAN instead of KEYS so a large keyspace does not block Redis
+        keys = list(r.scan_iter(match=pattern, count=500))
         if keys:
             r.delete(*keys)
             logger.info(f"All user expenses cache invalidated | email={str(email)} | keys_cleared={len(keys)}")
         else:
             logger.info(f"No user expenses cache found to invalidate | email={str(email)}")
     except Exception as e:
-        logger.error(f"Error invalidating all user expenses cache | email={str(email)} | error={str(e)}")
\ No newline at end of file
+        logger.error(f"Error invalidating all user expenses cache | email={str(email)} | error={str(e)}")
+    # Every month may have changed: drop all the month version stamps (the next reads create new ones)
+    try:
+        r.delete(get_user_month_versions_key(email))
+    except Exception as e:
+        logger.error(f"Error deleting month versions | email={str(email)} | error={str(e)}")
\ No newline at end of file
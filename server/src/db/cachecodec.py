@@ -0,0 +1,153 @@
+# FinBrain Project - cachecodec.py - MIT License (c) 2025 Nadav Eshed
+
+
+# Format of the cached expense months. EXPENSES_CACHE_ENCODING picks how new entries are written:
+#   json - the JSON text as it is (default, the format every entry had before)
+#   zlib - compressed JSON (standard library)
+#   zstd - compressed JSON with zstandard (needs the zstandard package, zlib is written with a warning at startup without it)
+# A compressed value is one format version character followed by the base64 of the compressed JSON,
+# so it stays a string like every other cached value. Every format is read whatever the setting,
+# so the setting can change while older entries are still cached.
+# Bytes saved by every cached month (from server/src):
+#   python -m db.cachecodec --report
+import os
+import time
+import zlib
+import base64
+import argparse
+import logging
+from utils import metrics
+
+try:
+    import zstandard
+except ImportError:
+    # zstd is optional - without the package EXPENSES_CACHE_ENCODING=zstd writes zlib
+    zstandard = None
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+
+def get_cache_encoding(encoding):
+    """
+    Check the configured encoding of new cached months (logs a warning when it cannot be used as it is)
+    Returns the encoding that is really written: json for an unknown one, zlib for zstd without the zstandard package
+    """
+    encoding = (encoding or 'json').lower()
+    if encoding not in ('json', 'zlib', 'zstd'):
+        logger.warning(f"Unknown EXPENSES_CACHE_ENCODING, using json | encoding={encoding}")
+        return 'json'
+    if encoding == 'zstd' and zstandard is None:
+        logger.warning("EXPENSES_CACHE_ENCODING=zstd needs the zstandard package, which is not installed - using zlib | encoding=zstd")
+        return 'zlib'
+    return encoding
+
+
+# How new cached months are written (json, zlib or zstd)
+EXPENSES_CACHE_ENCODING = get_cache_encoding(os.getenv('EXPENSES_CACHE_ENCODING', 'json'))
+
+# Format version characters of the compressed values (plain JSON starts with '[')
+FORMAT_ZLIB = 1
+FORMAT_ZSTD = 2
+FORMAT_NAMES = {FORMAT_ZLIB: 'zlib', FORMAT_ZSTD: 'zstd'}
+
+# Compression levels (fast levels - the months are written on every cache miss)
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def encode_expenses(expenses_json, encoding=None):
+    """
+    Encode the JSON text of a cached month in the configured format (or the given one)
+    Returns the value to store
+    """
+    encoding = encoding or EXPENSES_CACHE_ENCODING
+    if encoding == 'json':
+        return expenses_json
+
+    start = time.perf_counter()
+    data = expenses_json.encode()
+    if encoding == 'zstd' and zstandard is not None:
+        value = chr(FORMAT_ZSTD) + base64.b64encode(zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)).decode('ascii')
+    else:
+        value = chr(FORMAT_ZLIB) + base64.b64encode(zlib.compress(data, ZLIB_LEVEL)).decode('ascii')
+    metrics.observe('expenses_cache_encode_seconds', time.perf_counter() - start)
+    metrics.observe('expenses_cache_bytes_saved', len(data) - len(value))
+    return value
+
+
+def decode_expenses(value):
+    """
+    Get the JSON text of a cached month from the stored value, whatever its format (plain JSON included)
+    Returns None if there is no value or its format is unknown
+    """
+    if not value:
+        return None
+    if value[0] == '[':
+        return value
+
+    start = time.perf_counter()
+    version = ord(value[0])
+    if version == FORMAT_ZLIB:
+        data = zlib.decompress(base64.b64decode(value[1:]))
+    elif version == FORMAT_ZSTD and zstandard is not None:
+        data = zstandard.ZstdDecompressor().decompress(base64.b64decode(value[1:]))
+    else:
+        logger.warning(f"Unknown cached expenses format | version={version}")
+        return None
+    metrics.observe('expenses_cache_decode_seconds', time.perf_counter() - start)
+    return data.decode()
+
+
+def get_format_name(value):
+    """
+    Get the name of the format of a stored value (json, zlib, zstd or unknown)
+    """
+    if value and value[0] == '[':
+        return 'json'
+    return FORMAT_NAMES.get(ord(value[0]), 'unknown') if value else 'unknown'
+
+
+def report_cached_months(client, pattern):
+    """
+    Measure every cached month whose key matches pattern: its format, its size, the size of its JSON,
+    the bytes saved against plain JSON and the time to decode it
+    Returns a list of {key, format, stored_bytes, json_bytes, saved_bytes, decode_ms}
+    """
+    rows = []
+    for key in client.scan_iter(match=pattern, count=500):
+        value = client.get(key)
+        if not value:
+            continue
+        start = time.perf_counter()
+        expenses_json = decode_expenses(value)
+        decode_ms = (time.perf_counter() - start) * 1000
+        stored_bytes = len(value.encode())
+        json_bytes = len(expenses_json.encode()) if expenses_json is not None else stored_bytes
+        rows.append({
+            'key': key,
+            'format': get_format_name(value),
+            'stored_bytes': stored_bytes,
+            'json_bytes': json_bytes,
+            'saved_bytes': json_bytes - stored_bytes,
+            'decode_ms': round(decode_ms, 3)
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the format and size of the cached expense months")
+    parser.add_argument("--report", action="store_true", help="Print the bytes saved by every cached month")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.report:
+        from db import cache
+        # Month keys only ({prefix}user:{email}:month:YYYY-MM), not the hashes of cached pages
+        rows = report_cached_months(cache.r, f"{cache.get_user_expenses_cache_key_prefix()}user:*:month:????-??")
+        for row in rows:
+            print(f"{row['key']} | format={row['format']} | stored={row['stored_bytes']} | json={row['json_bytes']} | saved={row['saved_bytes']} | decode={row['decode_ms']} ms")
+        print(f"{len(rows)} cached months | saved={sum(row['saved_bytes'] for row in rows)} bytes")
+    else:
+        parser.print_help()
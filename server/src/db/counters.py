@@ -0,0 +1,105 @@
+# FinBrain Project - counters.py - MIT License (c) 2025 Nadav Eshed
+
+
+# Per-user expense serial numbers, handed out atomically from the counters collection
+# One-time backfill of the counters from the existing expenses (from server/src):
+#   python -m db.counters --backfill
+import argparse
+import logging
+from pymongo import ReturnDocument
+from db.db import counters_collection, expenses_collection
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+
+def get_serial_counter_id(user_id):
+    """
+    Get the _id of the counter document that holds the last serial number of a user
+    """
+    return f"expense_serial:{user_id}"
+
+
+def seed_serial_counter(user_id, last_serial_number=None):
+    """
+    Make sure the user's counter is at least the highest serial number already used
+    ($max never moves a counter back, so seeding is safe to repeat and to race with allocations)
+    """
+    if last_serial_number is None:
+        last_expense = expenses_collection.find_one(
+            {"user_id": user_id},
+            {"serial_number": 1},
+            sort=[("serial_number", -1)]
+        )
+        last_serial_number = (last_expense or {}).get("serial_number", 0)
+
+    counters_collection.update_one(
+        {"_id": get_serial_counter_id(user_id)},
+        {"$max": {"value": last_serial_number}, "$setOnInsert": {"user_id": user_id}},
+        upsert=True
+    )
+
+
+def reserve_serial_numbers(user_id, count=1):
+    """
+    Reserve count consecutive serial numbers for the user in one atomic update
+    Returns the first reserved number (the block is first .. first + count - 1)
+    """
+    if count < 1:
+        raise ValueError("count must be at least 1")
+
+    counter_id = get_serial_counter_id(user_id)
+    counter = counters_collection.find_one_and_update(
+        {"_id": counter_id},
+        {"$inc": {"value": count}},
+        return_document=ReturnDocument.AFTER
+    )
+
+    # No counter yet - start it from the user's existing expenses, then allocate
+    if counter is None:
+        seed_serial_counter(user_id)
+        counter = counters_collection.find_one_and_update(
+            {"_id": counter_id},
+            {"$inc": {"value": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    return counter["value"] - count + 1
+
+
+def next_serial_number(user_id):
+    """
+    Get the next serial number for a new expense of the user
+    """
+    return reserve_serial_numbers(user_id, 1)
+
+
+def backfill_serial_counters():
+    """
+    Seed the counter of every user with expenses from their highest existing serial number
+    Returns the number of counters written
+    """
+    # One aggregation finds every user's highest serial number
+    pipeline = [{"$group": {"_id": "$user_id", "last_serial_number": {"$max": "$serial_number"}}}]
+    written = 0
+
+    for row in expenses_collection.aggregate(pipeline):
+        seed_serial_counter(row["_id"], row["last_serial_number"] or 0)
+        written += 1
+
+    logger.info(f"Serial counters backfilled | counters={written}")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the per-user expense serial counters")
+    parser.add_argument("--backfill", action="store_true", help="Seed the counters from the existing expenses")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.backfill:
+        print(f"Seeded {backfill_serial_counters()} serial counters")
+    else:
+        parser.print_help()
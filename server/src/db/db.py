@@ -76,6 +76,10 @@ if env == 'test' or is_ci:
     expenses_collection = db['expenses']
     # Create a mock user_feedback collection
     user_feedback_collection = db['user_feedback']
+    # Create a mock counters collection
+    counters_collection = db['counters']
+    # Create a mock monthly_rollups collection
+    monthly_rollups_collection = db['monthly_rollups']
 
     # Create a unique index on the users collection
     users_collection.create_index('email', unique=True)
@@ -108,6 +112,10 @@ else:
         expenses_collection = db['expenses']
         # Create a real user_feedback collection
         user_feedback_collection = db['user_feedback']
+        # Create a real counters collection
+        counters_collection = db['counters']
+        # Create a real monthly_rollups collection
+        monthly_rollups_collection = db['monthly_rollups']
 
         # Create a unique index on the users collection
         users_collection.create_index('email', unique=True)
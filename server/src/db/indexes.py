@@ -0,0 +1,175 @@
+# FinBrain Project - indexes.py - MIT License (c) 2025 Nadav Eshed
+
+
+# The indexes every query of the app relies on, created at startup (ENSURE_INDEXES_ON_STARTUP) or by hand (from server/src):
+#   python -m db.indexes --apply
+#   python -m db.indexes --check
+import os
+import time
+import argparse
+import logging
+from db.db import db
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Create the indexes when the app starts (off in tests, where fixtures insert duplicate serial numbers)
+ENSURE_INDEXES_ON_STARTUP = os.getenv('ENSURE_INDEXES_ON_STARTUP', 'false' if os.getenv('ENV') == 'test' else 'true').lower() == 'true'
+# How long /health reuses the last index check (seconds)
+INDEX_CHECK_INTERVAL_SECONDS = 60
+
+# Required indexes: collection, name, keys and whether the index is unique
+INDEX_MANIFEST = [
+    # Login and signup look users up by email
+    {'collection': 'users', 'name': 'email_1', 'keys': [('email', 1)], 'unique': True},
+    # Month queries (user_id + date range), sorted by serial_number for the /get_expenses pages
+    {'collection': 'expenses', 'name': 'user_id_1_date_1_serial_number_1', 'keys': [('user_id', 1), ('date', 1), ('serial_number', 1)], 'unique': False},
+    # Dashboard charts (user_id + month_key $in, optionally filtered by category)
+    {'collection': 'expenses', 'name': 'user_id_1_month_key_1_category_1', 'keys': [('user_id', 1), ('month_key', 1), ('category', 1)], 'unique': False},
+    # Update and delete find one expense by its serial number
+    {'collection': 'expenses', 'name': 'user_id_1_serial_number_1', 'keys': [('user_id', 1), ('serial_number', 1)], 'unique': True},
+    # One rollup per user, month and category (the $inc upserts rely on it being unique)
+    {'collection': 'monthly_rollups', 'name': 'user_id_1_month_1_category_1', 'keys': [('user_id', 1), ('month', 1), ('category', 1)], 'unique': True},
+    # Feedback of a user by date (read when the model is retrained from user corrections)
+    {'collection': 'user_feedback', 'name': 'email_1_date_1', 'keys': [('email', 1), ('date', 1)], 'unique': False},
+]
+
+# Result of the last check_required_indexes call: (time.monotonic() of the check, missing index names)
+_last_check = None
+
+
+def get_index_label(spec):
+    """
+    Get the name of an index as used in logs and in /health (collection.name)
+    """
+    return f"{spec['collection']}.{spec['name']}"
+
+
+def find_existing_index(spec):
+    """
+    Get the name of the index of the collection that has the same keys and uniqueness as spec (None if there is none)
+    """
+    for name, info in db[spec['collection']].index_information().items():
+        if [tuple(key) for key in info['key']] == spec['keys'] and bool(info.get('unique')) == spec['unique']:
+            return name
+    return None
+
+
+def apply_indexes():
+    """
+    Create every index of the manifest that does not exist yet (safe to repeat)
+    Returns (created, failed) lists of index names
+    """
+    created = []
+    failed = []
+    for spec in INDEX_MANIFEST:
+        label = get_index_label(spec)
+        try:
+            # An index with the same keys under another name already does the job
+            if find_existing_index(spec):
+                continue
+            db[spec['collection']].create_index(spec['keys'], name=spec['name'], unique=spec['unique'])
+            created.append(label)
+            logger.info(f"Index created | index={label} | unique={spec['unique']}")
+        except Exception as e:
+            # Usually duplicate values under a unique index - the data has to be fixed first
+            failed.append(label)
+            logger.error(f"Failed to create index | index={label} | error={str(e)}")
+    return created, failed
+
+
+def find_missing_indexes():
+    """
+    Get the names of the manifest indexes that do not exist
+    """
+    return [get_index_label(spec) for spec in INDEX_MANIFEST if not find_existing_index(spec)]
+
+
+def find_unused_indexes():
+    """
+    Get the names of the indexes that were never used since the server started ($indexStats),
+    and of the indexes that are not in the manifest
+    Returns (unused, undeclared)
+    """
+    unused = []
+    undeclared = []
+    for collection_name in sorted({spec['collection'] for spec in INDEX_MANIFEST}):
+        declared = {spec['name'] for spec in INDEX_MANIFEST if spec['collection'] == collection_name}
+        for name in db[collection_name].index_information():
+            if name != '_id_' and name not in declared:
+                undeclared.append(f"{collection_name}.{name}")
+        try:
+            for stats in db[collection_name].aggregate([{'$indexStats': {}}]):
+                if stats['name'] != '_id_' and stats['accesses']['ops'] == 0:
+                    unused.append(f"{collection_name}.{stats['name']}")
+        except Exception as e:
+            # Not every server (or mongomock) supports $indexStats
+            logger.debug(f"Index usage not available | collection={collection_name} | error={str(e)}")
+    return unused, undeclared
+
+
+def check_indexes():
+    """
+    Log the missing, unused and undeclared indexes
+    Returns the missing index names
+    """
+    missing = find_missing_indexes()
+    for label in missing:
+        logger.warning(f"Required index is missing | index={label}")
+    unused, undeclared = find_unused_indexes()
+    for label in unused:
+        logger.warning(f"Index has not been used since the server started | index={label}")
+    for label in undeclared:
+        logger.warning(f"Index is not in the manifest | index={label}")
+    logger.info(f"Index check finished | required={len(INDEX_MANIFEST)} | missing={len(missing)} | unused={len(unused)} | undeclared={len(undeclared)}")
+    return missing
+
+
+def check_required_indexes():
+    """
+    Get the missing index names for /health, checking MongoDB at most once every INDEX_CHECK_INTERVAL_SECONDS
+    """
+    global _last_check
+    now = time.monotonic()
+    if _last_check is None or now - _last_check[0] >= INDEX_CHECK_INTERVAL_SECONDS:
+        _last_check = (now, find_missing_indexes())
+    return _last_check[1]
+
+
+def reset_index_check():
+    """
+    Forget the last /health index check (the next call checks MongoDB again)
+    """
+    global _last_check
+    _last_check = None
+
+
+def ensure_indexes_on_startup():
+    """
+    Create the missing indexes and log the index check when the app starts (never stops the app from starting)
+    """
+    if not ENSURE_INDEXES_ON_STARTUP:
+        return
+    try:
+        apply_indexes()
+        check_indexes()
+    except Exception as e:
+        logger.error(f"Failed to ensure indexes on startup | error={str(e)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the MongoDB indexes of the app")
+    parser.add_argument("--apply", action="store_true", help="Create the missing indexes of the manifest")
+    parser.add_argument("--check", action="store_true", help="Report missing, unused and undeclared indexes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.apply:
+        created, failed = apply_indexes()
+        print(f"Created {len(created)} indexes, {len(failed)} failed")
+    if args.check:
+        missing = check_indexes()
+        print(f"Missing indexes: {', '.join(missing) if missing else 'none'}")
+    if not args.apply and not args.check:
+        parser.print_help()
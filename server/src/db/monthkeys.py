@@ -0,0 +1,75 @@
+# FinBrain Project - monthkeys.py - MIT License (c) 2025 Nadav Eshed
+
+
+# Integer month of every expense (month_key = YYYYMM), so month queries are exact index lookups instead of date regexes
+# One-time backfill of the expenses written before month_key existed (from server/src):
+#   python -m db.monthkeys --backfill
+# Once it has run, set MONTH_KEY_FALLBACK_ENABLED=false so month queries stop matching old expenses by date
+import os
+import argparse
+import logging
+from db.db import expenses_collection
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Expenses read and updated together by the backfill
+MONTH_KEY_BACKFILL_BATCH_SIZE = 1000
+# Also match expenses without month_key by a date regex (needed until the backfill has run)
+MONTH_KEY_FALLBACK_ENABLED = os.getenv('MONTH_KEY_FALLBACK_ENABLED', 'true').lower() == 'true'
+
+
+def get_month_key(value):
+    """
+    Get the month_key of a date, an ISO date string ('2025-09-10') or a month string ('2025-09')
+    Returns an int like 202509
+    """
+    if hasattr(value, 'year') and hasattr(value, 'month'):
+        return value.year * 100 + value.month
+    return int(value[:4]) * 100 + int(value[5:7])
+
+
+def backfill_month_keys(batch_size=MONTH_KEY_BACKFILL_BATCH_SIZE):
+    """
+    Set month_key on every expense that does not have one yet, batch_size expenses at a time (safe to repeat)
+    Expenses with a date that cannot be read get month_key null (the dashboard still finds them by date)
+    Returns the number of expenses updated
+    """
+    updated = 0
+    while True:
+        batch = list(expenses_collection.find({'month_key': {'$exists': False}}, {'date': 1}).limit(batch_size))
+        if not batch:
+            break
+
+        # One update_many per distinct month of the batch
+        ids_by_month_key = {}
+        for expense in batch:
+            try:
+                month_key = get_month_key(expense.get('date'))
+            except (TypeError, ValueError):
+                month_key = None
+            ids_by_month_key.setdefault(month_key, []).append(expense['_id'])
+        for month_key, ids in ids_by_month_key.items():
+            expenses_collection.update_many({'_id': {'$in': ids}}, {'$set': {'month_key': month_key}})
+
+        updated += len(batch)
+        logger.info(f"Month keys backfilled | batch={len(batch)} | months={len(ids_by_month_key)} | total={updated}")
+
+    logger.info(f"Month key backfill finished | updated={updated}")
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the month_key field of the expenses")
+    parser.add_argument("--backfill", action="store_true", help="Set month_key on the expenses that do not have it")
+    parser.add_argument("--batch-size", type=int, default=MONTH_KEY_BACKFILL_BATCH_SIZE, help="Expenses updated per batch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.backfill:
+        print(f"Set month_key on {backfill_month_keys(args.batch_size)} expenses")
+        if MONTH_KEY_FALLBACK_ENABLED:
+            print("Every expense has month_key now - set MONTH_KEY_FALLBACK_ENABLED=false to drop the date fallback")
+    else:
+        parser.print_help()
@@ -0,0 +1,166 @@
+# FinBrain Project - ratelimit.py - MIT License (c) 2025 Nadav Eshed
+
+
+import os
+import math
+import time
+import uuid
+import logging
+import threading
+from db.cache import r
+from db.backends import InMemoryBackend
+from utils import metrics
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Login throttling - checked before the user lookup and the (expensive) argon2 verification
+# Each email and each IP has a token bucket: CAPACITY attempts at once, refilled at REFILL_PER_MINUTE
+LOGIN_THROTTLE_ENABLED = os.getenv('LOGIN_THROTTLE_ENABLED', 'false').lower() == 'true'
+LOGIN_EMAIL_BUCKET_CAPACITY = float(os.getenv('LOGIN_EMAIL_BUCKET_CAPACITY', '5'))
+LOGIN_EMAIL_REFILL_PER_MINUTE = float(os.getenv('LOGIN_EMAIL_REFILL_PER_MINUTE', '5'))
+LOGIN_IP_BUCKET_CAPACITY = float(os.getenv('LOGIN_IP_BUCKET_CAPACITY', '20'))
+LOGIN_IP_REFILL_PER_MINUTE = float(os.getenv('LOGIN_IP_REFILL_PER_MINUTE', '20'))
+# Global cap on password verifications in flight across all workers (a slot is a lease that expires
+# after LOGIN_VERIFICATION_LEASE_SECONDS, so a crashed worker cannot leak it)
+LOGIN_MAX_INFLIGHT_VERIFICATIONS = int(os.getenv('LOGIN_MAX_INFLIGHT_VERIFICATIONS', '16'))
+LOGIN_VERIFICATION_LEASE_SECONDS = int(os.getenv('LOGIN_VERIFICATION_LEASE_SECONDS', '30'))
+
+# Redis keys
+LOGIN_INFLIGHT_KEY = 'login_throttle:inflight'
+
+# Lua script that checks both buckets and the in-flight cap, and only consumes anything if all of them allow it
+# KEYS[1] = email bucket, KEYS[2] = IP bucket, KEYS[3] = in-flight sorted set (slot_id -> start time)
+# ARGV = now, email capacity, email rate/s, IP capacity, IP rate/s, max in-flight, lease seconds, slot_id
+# Returns {status, retry_after_seconds} with status 'ok', 'throttled' or 'busy'
+LOGIN_THROTTLE_LUA = """
+local now = tonumber(ARGV[1])
+local lease = tonumber(ARGV[7])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now - lease)
+if redis.call('ZCARD', KEYS[3]) >= tonumber(ARGV[6]) then
+    return {'busy', '1'}
+end
+
+local function available_tokens(key, capacity, rate)
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    return math.min(capacity, tokens + math.max(0, now - ts) * rate)
+end
+
+local email_capacity, email_rate = tonumber(ARGV[2]), tonumber(ARGV[3])
+local ip_capacity, ip_rate = tonumber(ARGV[4]), tonumber(ARGV[5])
+local email_tokens = available_tokens(KEYS[1], email_capacity, email_rate)
+local ip_tokens = available_tokens(KEYS[2], ip_capacity, ip_rate)
+
+if email_tokens < 1 or ip_tokens < 1 then
+    local wait = 0
+    if email_tokens < 1 then wait = math.max(wait, (1 - email_tokens) / email_rate) end
+    if ip_tokens < 1 then wait = math.max(wait, (1 - ip_tokens) / ip_rate) end
+    return {'throttled', tostring(math.ceil(wait))}
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(email_tokens - 1), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(email_capacity / email_rate) + 1)
+redis.call('HSET', KEYS[2], 'tokens', tostring(ip_tokens - 1), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[2], math.ceil(ip_capacity / ip_rate) + 1)
+redis.call('ZADD', KEYS[3], now, ARGV[8])
+redis.call('EXPIRE', KEYS[3], lease)
+return {'ok', '0'}
+"""
+login_throttle_script = r.register_script(LOGIN_THROTTLE_LUA)
+
+# The in-memory backend cannot run Lua - it runs the same steps in Python under this lock (one process only)
+_in_process_throttle_lock = threading.Lock()
+
+
+def run_login_throttle_in_process(keys, now, slot_id):
+    """
+    Same checks as LOGIN_THROTTLE_LUA for the in-memory cache backend
+    Returns (status, retry_after_seconds) with status 'ok', 'throttled' or 'busy'
+    """
+    email_key, ip_key, inflight_key = keys
+    email_rate = LOGIN_EMAIL_REFILL_PER_MINUTE / 60
+    ip_rate = LOGIN_IP_REFILL_PER_MINUTE / 60
+
+    def available_tokens(key, capacity, rate):
+        bucket = r.hgetall(key)
+        tokens = float(bucket.get('tokens', capacity))
+        ts = float(bucket.get('ts', now))
+        return min(capacity, tokens + max(0, now - ts) * rate)
+
+    with _in_process_throttle_lock:
+        r.zremrangebyscore(inflight_key, '-inf', now - LOGIN_VERIFICATION_LEASE_SECONDS)
+        if r.zcard(inflight_key) >= LOGIN_MAX_INFLIGHT_VERIFICATIONS:
+            return 'busy', 1
+
+        email_tokens = available_tokens(email_key, LOGIN_EMAIL_BUCKET_CAPACITY, email_rate)
+        ip_tokens = available_tokens(ip_key, LOGIN_IP_BUCKET_CAPACITY, ip_rate)
+        if email_tokens < 1 or ip_tokens < 1:
+            wait = 0
+            if email_tokens < 1:
+                wait = max(wait, (1 - email_tokens) / email_rate)
+            if ip_tokens < 1:
+                wait = max(wait, (1 - ip_tokens) / ip_rate)
+            return 'throttled', math.ceil(wait)
+
+        r.hset(email_key, mapping={'tokens': email_tokens - 1, 'ts': now})
+        r.expire(email_key, math.ceil(LOGIN_EMAIL_BUCKET_CAPACITY / email_rate) + 1)
+        r.hset(ip_key, mapping={'tokens': ip_tokens - 1, 'ts': now})
+        r.expire(ip_key, math.ceil(LOGIN_IP_BUCKET_CAPACITY / ip_rate) + 1)
+        r.zadd(inflight_key, {slot_id: now})
+        r.expire(inflight_key, LOGIN_VERIFICATION_LEASE_SECONDS)
+        return 'ok', 0
+
+
+def acquire_login_attempt(email, ip):
+    """
+    Check (and consume) the login buckets of the email and IP and take a global verification slot
+    Returns (allowed, slot_id, retry_after_seconds) - slot_id must be passed to release_login_attempt
+    """
+    if not LOGIN_THROTTLE_ENABLED:
+        return True, None, 0
+
+    slot_id = uuid.uuid4().hex
+    keys = [f"login_throttle:email:{email}", f"login_throttle:ip:{ip}", LOGIN_INFLIGHT_KEY]
+    now = time.time()
+    try:
+        if isinstance(r, InMemoryBackend):
+            status, retry_after = run_login_throttle_in_process(keys, now, slot_id)
+        else:
+            status, retry_after = login_throttle_script(
+                keys=keys,
+                args=[
+                    now,
+                    LOGIN_EMAIL_BUCKET_CAPACITY, LOGIN_EMAIL_REFILL_PER_MINUTE / 60,
+                    LOGIN_IP_BUCKET_CAPACITY, LOGIN_IP_REFILL_PER_MINUTE / 60,
+                    LOGIN_MAX_INFLIGHT_VERIFICATIONS, LOGIN_VERIFICATION_LEASE_SECONDS,
+                    slot_id
+                ]
+            )
+    except Exception as e:
+        # Fail open - the password hashing pool still protects the CPU
+        logger.error(f"Login throttle check failed | email={email} | ip={ip} | error={str(e)}")
+        return True, None, 0
+
+    if status == 'ok':
+        return True, slot_id, 0
+
+    metrics.increment(f"login_{status}")
+    logger.warning(f"Login attempt rejected | reason={status} | email={email} | ip={ip} | retry_after={retry_after}")
+    return False, None, max(1, int(retry_after))
+
+
+def release_login_attempt(slot_id):
+    """
+    Give back the global verification slot taken by acquire_login_attempt
+    """
+    if not slot_id:
+        return
+    try:
+        r.zrem(LOGIN_INFLIGHT_KEY, slot_id)
+    except Exception as e:
+        # The slot lease expires by itself
+        logger.error(f"Failed to release login slot | slot_id={slot_id} | error={str(e)}")
@@ -0,0 +1,161 @@
+# FinBrain Project - rollups.py - MIT License (c) 2025 Nadav Eshed
+
+
+# Per-user monthly totals by category (monthly_rollups), kept up to date with $inc on every expense write,
+# so the dashboard reads at most 12 months x 7 categories small documents instead of every expense.
+# Rebuild / check the rollups against the expenses (from server/src):
+#   python -m db.rollups --reconcile [--dry-run]
+import os
+import argparse
+import logging
+from db.db import expenses_collection, monthly_rollups_collection
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Read the dashboard charts from the rollups (turn on after the first reconcile has filled them)
+DASHBOARD_ROLLUPS_ENABLED = os.getenv('DASHBOARD_ROLLUPS_ENABLED', 'false').lower() == 'true'
+# Differences smaller than this are float rounding, not a wrong rollup
+ROLLUP_AMOUNT_TOLERANCE = 0.005
+
+
+def get_month(date_value):
+    """
+    Get the 'YYYY-MM' month of a date or an ISO date string
+    """
+    if hasattr(date_value, 'year') and hasattr(date_value, 'month'):
+        return f"{date_value.year}-{date_value.month:02d}"
+    return date_value[:7]
+
+
+def increment_rollup(user_id, month, category, amount_ils, amount_usd, count):
+    """
+    Add the amounts and count to one rollup (created on first use)
+    A rollup whose count drops to 0 is deleted
+    """
+    key = {'user_id': user_id, 'month': month, 'category': category}
+    monthly_rollups_collection.update_one(
+        key,
+        {'$inc': {'amount_ils': amount_ils, 'amount_usd': amount_usd, 'count': count}},
+        upsert=True
+    )
+    if count < 0:
+        # Conditional, so an expense added meanwhile keeps the rollup
+        monthly_rollups_collection.delete_one({**key, 'count': {'$lte': 0}})
+
+
+def add_expenses_to_rollups(expenses, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) expenses from the rollups, with one update per user, month and category
+    Failures are logged only - the reconcile job repairs the rollups
+    """
+    totals = {}
+    for expense in expenses:
+        key = (expense['user_id'], get_month(expense['date']), expense.get('category'))
+        amount_ils, amount_usd, count = totals.get(key, (0, 0, 0))
+        totals[key] = (amount_ils + expense.get('amount_ils', 0), amount_usd + expense.get('amount_usd', 0), count + 1)
+
+    for (user_id, month, category), (amount_ils, amount_usd, count) in totals.items():
+        try:
+            increment_rollup(user_id, month, category, sign * amount_ils, sign * amount_usd, sign * count)
+        except Exception as e:
+            logger.error(f"Failed to update monthly rollup | user_id={user_id} | month={month} | category={category} | error={str(e)}")
+
+
+def move_expense_category(expense, new_category):
+    """
+    Move an expense from its current category rollup to the new category
+    expense is the document before the category change
+    """
+    add_expenses_to_rollups([expense], sign=-1)
+    add_expenses_to_rollups([{**expense, 'category': new_category}])
+
+
+def get_rollups(user_id, months, categories=None):
+    """
+    Get the rollups of the user for the given months ('YYYY-MM'), optionally only some categories
+    At most len(months) x 7 documents
+    """
+    query = {'user_id': user_id, 'month': {'$in': list(months)}, 'count': {'$gt': 0}}
+    if categories is not None:
+        query['category'] = {'$in': list(categories)}
+    return list(monthly_rollups_collection.find(query, {'_id': 0, 'month': 1, 'category': 1, 'amount_ils': 1, 'amount_usd': 1}))
+
+
+def compute_rollups_from_expenses(user_id=None):
+    """
+    Sum the expenses per user, month and category in MongoDB (what the rollups should hold)
+    Returns {(user_id, month, category): {amount_ils, amount_usd, count}}
+    """
+    pipeline = [{'$group': {
+        '_id': {'user_id': '$user_id', 'month': {'$substr': ['$date', 0, 7]}, 'category': '$category'},
+        'amount_ils': {'$sum': '$amount_ils'},
+        'amount_usd': {'$sum': '$amount_usd'},
+        'count': {'$sum': 1}
+    }}]
+    if user_id is not None:
+        pipeline.insert(0, {'$match': {'user_id': user_id}})
+    return {
+        (row['_id']['user_id'], row['_id']['month'], row['_id'].get('category')): {
+            'amount_ils': row['amount_ils'], 'amount_usd': row['amount_usd'], 'count': row['count']
+        }
+        for row in expenses_collection.aggregate(pipeline)
+    }
+
+
+def is_same_rollup(rollup, expected):
+    """
+    Check a stored rollup holds the expected count and amounts (up to float rounding)
+    """
+    return (
+        rollup.get('count') == expected['count']
+        and abs(rollup.get('amount_ils', 0) - expected['amount_ils']) < ROLLUP_AMOUNT_TOLERANCE
+        and abs(rollup.get('amount_usd', 0) - expected['amount_usd']) < ROLLUP_AMOUNT_TOLERANCE
+    )
+
+
+def reconcile_rollups(user_id=None, fix=True):
+    """
+    Compare the rollups with the expenses (of one user, or of everyone) and, unless fix is False, repair them
+    Returns the counts of checked, missing, extra and mismatched rollups
+    """
+    expected = compute_rollups_from_expenses(user_id)
+    stored_query = {} if user_id is None else {'user_id': user_id}
+    stored = {
+        (rollup['user_id'], rollup['month'], rollup.get('category')): rollup
+        for rollup in monthly_rollups_collection.find(stored_query)
+    }
+
+    missing = [key for key in expected if key not in stored]
+    extra = [key for key, rollup in stored.items() if key not in expected]
+    mismatched = [key for key in expected if key in stored and not is_same_rollup(stored[key], expected[key])]
+
+    if fix:
+        for key in missing + mismatched:
+            rollup_user_id, month, category = key
+            monthly_rollups_collection.replace_one(
+                {'user_id': rollup_user_id, 'month': month, 'category': category},
+                {'user_id': rollup_user_id, 'month': month, 'category': category, **expected[key]},
+                upsert=True
+            )
+        for key in extra:
+            monthly_rollups_collection.delete_one({'_id': stored[key]['_id']})
+
+    summary = {'checked': len(expected), 'missing': len(missing), 'extra': len(extra), 'mismatched': len(mismatched)}
+    logger.info(f"Monthly rollups reconciled | user_id={user_id} | fix={fix} | checked={summary['checked']} | missing={summary['missing']} | extra={summary['extra']} | mismatched={summary['mismatched']}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and rebuild the monthly rollups from the expenses")
+    parser.add_argument("--reconcile", action="store_true", help="Compare the rollups with the expenses and repair them")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the differences")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.reconcile:
+        summary = reconcile_rollups(fix=not args.dry_run)
+        print(f"Checked {summary['checked']} rollups | missing={summary['missing']} | extra={summary['extra']} | mismatched={summary['mismatched']}")
+    else:
+        parser.print_help()
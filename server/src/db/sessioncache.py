@@ -0,0 +1,306 @@
+# FinBrain Project - sessioncache.py - MIT License (c) 2025 Nadav Eshed
+
+
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from db.cache import r
+from utils import metrics
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# In-process (L1) session cache settings
+# The L1 TTL must stay far below SESSION_TTL_SECONDS: unless the refresh policy below is enabled, a cache hit
+# skips the Redis TTL refresh, so an active session reaches Redis (and slides its TTL) at least once every L1 TTL
+SESSION_L1_CACHE_ENABLED = os.getenv('SESSION_L1_CACHE_ENABLED', 'false').lower() == 'true'
+SESSION_L1_CACHE_TTL_SECONDS = float(os.getenv('SESSION_L1_CACHE_TTL_SECONDS', '5'))
+SESSION_L1_CACHE_MAX_ENTRIES = int(os.getenv('SESSION_L1_CACHE_MAX_ENTRIES', '10000'))
+
+# Write-behind sliding expiry: only slide a session's Redis TTL once this fraction of the TTL has passed
+# since this worker last refreshed it (e.g. 0.25 of 90s = at most one refresh every 22.5s per session)
+SESSION_REFRESH_POLICY_ENABLED = os.getenv('SESSION_REFRESH_POLICY_ENABLED', 'false').lower() == 'true'
+SESSION_REFRESH_FRACTION = float(os.getenv('SESSION_REFRESH_FRACTION', '0.25'))
+
+# Redis pub/sub channel used to tell every worker that a session was removed (logout)
+SESSION_INVALIDATION_CHANNEL = 'session_invalidations'
+
+# Revoked signed session tokens: Redis sorted set of token IDs scored by their expiry time,
+# copied into every worker (pub/sub on logout + full re-sync every SESSION_REVOCATION_SYNC_SECONDS)
+REVOKED_TOKENS_KEY = 'revoked_session_tokens'
+TOKEN_REVOCATION_CHANNEL = 'session_token_revocations'
+SESSION_REVOCATION_SYNC_SECONDS = float(os.getenv('SESSION_REVOCATION_SYNC_SECONDS', '30'))
+
+
+class SessionCache:
+    """
+    Bounded, thread-safe LRU cache of session_id -> session principal (email, user_id)
+    Every entry expires after ttl_seconds, the least recently used entry is dropped when full
+    """
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Get the cached principal for a session (None if missing or expired)"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at <= time.monotonic():
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return principal
+
+    def put(self, session_id, principal):
+        """Cache the principal of a session"""
+        with self._lock:
+            self._entries[session_id] = (time.monotonic() + self.ttl_seconds, principal)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_id):
+        """Remove a session from the cache"""
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        """Remove all sessions from the cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SessionRefreshTracker:
+    """
+    Remembers when this worker last slid each session's TTL in Redis
+    Concurrent refreshes of the same session are coalesced: only the first caller refreshes
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._last_refresh = OrderedDict()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def claim(self, session_id, refresh_after_seconds):
+        """
+        Return True if the caller should refresh the session now (and must call finish afterwards)
+        """
+        now = time.monotonic()
+        with self._lock:
+            last_refresh = self._last_refresh.get(session_id)
+            if last_refresh is not None and now - last_refresh < refresh_after_seconds:
+                return False
+            if session_id in self._in_flight:
+                return False
+            self._in_flight.add(session_id)
+            return True
+
+    def finish(self, session_id, refreshed):
+        """
+        Release a claimed refresh, remembering the time if the refresh succeeded
+        """
+        with self._lock:
+            self._in_flight.discard(session_id)
+            if refreshed:
+                self._record(session_id)
+            else:
+                self._last_refresh.pop(session_id, None)
+
+    def mark_refreshed(self, session_id):
+        """
+        Remember that the session TTL was just set (e.g. at login)
+        """
+        with self._lock:
+            self._record(session_id)
+
+    def _record(self, session_id):
+        self._last_refresh[session_id] = time.monotonic()
+        self._last_refresh.move_to_end(session_id)
+        while len(self._last_refresh) > self.max_entries:
+            self._last_refresh.popitem(last=False)
+
+    def clear(self):
+        """Forget all sessions"""
+        with self._lock:
+            self._last_refresh.clear()
+            self._in_flight.clear()
+
+
+# One cache and one refresh tracker per worker process
+session_cache = SessionCache(SESSION_L1_CACHE_MAX_ENTRIES, SESSION_L1_CACHE_TTL_SECONDS)
+refresh_tracker = SessionRefreshTracker(SESSION_L1_CACHE_MAX_ENTRIES)
+
+# Local copy of the revoked token set (token ID -> expiry timestamp)
+_revoked_tokens = {}
+_revoked_tokens_lock = threading.Lock()
+_revoked_tokens_synced_at = None
+
+# The listener thread has to be started inside each worker (threads do not survive gunicorn's --preload fork)
+_listener_lock = threading.Lock()
+_listener_pid = None
+_listener_thread = None
+
+
+def _handle_invalidation_message(message):
+    """Evict the session named in a pub/sub invalidation message"""
+    session_cache.invalidate(message.get('data'))
+
+
+def _handle_token_revocation_message(message):
+    """Add the token named in a pub/sub revocation message (format: "token_id:expires_at") to the local set"""
+    token_id, _, expires_at = str(message.get('data')).partition(':')
+    with _revoked_tokens_lock:
+        _revoked_tokens[token_id] = float(expires_at or 0)
+
+
+def ensure_invalidation_listener():
+    """
+    Start (once per worker process) a background thread that listens for session invalidations and token revocations
+    """
+    global _listener_pid, _listener_thread
+    if _listener_pid == os.getpid():
+        return
+
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        try:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{
+                SESSION_INVALIDATION_CHANNEL: _handle_invalidation_message,
+                TOKEN_REVOCATION_CHANNEL: _handle_token_revocation_message
+            })
+            _listener_thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            logger.info(f"Session invalidation listener started | pid={os.getpid()} | channel={SESSION_INVALIDATION_CHANNEL}")
+        except Exception as e:
+            # Without the listener a logged out session can live on other workers for at most the L1 TTL
+            logger.error(f"Failed to start session invalidation listener | error={str(e)}")
+        _listener_pid = os.getpid()
+
+
+def get_cached_session(session_id):
+    """
+    Get the cached principal for a session (None if the L1 cache is disabled or has no entry)
+    """
+    if not SESSION_L1_CACHE_ENABLED:
+        return None
+    ensure_invalidation_listener()
+    return session_cache.get(session_id)
+
+
+def add_to_cache_session(session_id, principal):
+    """
+    Cache the principal for a session (no-op if the L1 cache is disabled)
+    """
+    if not SESSION_L1_CACHE_ENABLED:
+        return
+    ensure_invalidation_listener()
+    session_cache.put(session_id, principal)
+
+
+def invalidate_session(session_id):
+    """
+    Remove a session from this worker's cache and tell every other worker to do the same
+    """
+    session_cache.invalidate(session_id)
+    if not SESSION_L1_CACHE_ENABLED:
+        return
+    try:
+        r.publish(SESSION_INVALIDATION_CHANNEL, session_id)
+    except Exception as e:
+        logger.error(f"Failed to publish session invalidation | session_id={session_id} | error={str(e)}")
+
+
+def claim_session_refresh(session_id, session_ttl_seconds):
+    """
+    Decide whether this request should slide the session TTL in Redis
+    Always True when the refresh policy is disabled (every request refreshes)
+    """
+    if not SESSION_REFRESH_POLICY_ENABLED:
+        return True
+    if refresh_tracker.claim(session_id, session_ttl_seconds * SESSION_REFRESH_FRACTION):
+        metrics.increment('session_refreshes_performed')
+        return True
+    metrics.increment('session_refreshes_skipped')
+    return False
+
+
+def finish_session_refresh(session_id, refreshed):
+    """
+    Release a refresh claimed with claim_session_refresh
+    """
+    if SESSION_REFRESH_POLICY_ENABLED:
+        refresh_tracker.finish(session_id, refreshed)
+
+
+def mark_session_refreshed(session_id):
+    """
+    Remember that the session TTL was just set (so the next request does not refresh it again)
+    """
+    if SESSION_REFRESH_POLICY_ENABLED:
+        refresh_tracker.mark_refreshed(session_id)
+
+
+def revoke_session_token(token_id, expires_at):
+    """
+    Revoke a signed session token (logout) in Redis, in this worker and in every other worker
+    The entry is kept until the token would have expired anyway, so the set stays small
+    """
+    with _revoked_tokens_lock:
+        _revoked_tokens[token_id] = float(expires_at)
+    try:
+        r.zadd(REVOKED_TOKENS_KEY, {token_id: expires_at})
+        r.zremrangebyscore(REVOKED_TOKENS_KEY, '-inf', time.time())
+        r.publish(TOKEN_REVOCATION_CHANNEL, f"{token_id}:{expires_at}")
+    except Exception as e:
+        logger.error(f"Failed to revoke session token | token_id={token_id} | error={str(e)}")
+
+
+def sync_revoked_tokens():
+    """
+    Replace the local revoked token set with the (unexpired) entries from Redis
+    """
+    global _revoked_tokens_synced_at
+    now = time.time()
+    entries = r.zrangebyscore(REVOKED_TOKENS_KEY, now, '+inf', withscores=True)
+    with _revoked_tokens_lock:
+        _revoked_tokens.clear()
+        _revoked_tokens.update({token_id: expires_at for token_id, expires_at in entries})
+        _revoked_tokens_synced_at = time.monotonic()
+
+
+def is_session_token_revoked(token_id):
+    """
+    Check if a signed session token was revoked, using the local copy of the revoked set
+    Redis is only read once every SESSION_REVOCATION_SYNC_SECONDS per worker
+    """
+    global _revoked_tokens_synced_at
+    ensure_invalidation_listener()
+    if _revoked_tokens_synced_at is None or time.monotonic() - _revoked_tokens_synced_at >= SESSION_REVOCATION_SYNC_SECONDS:
+        try:
+            sync_revoked_tokens()
+        except Exception as e:
+            # Keep using the local copy (pub/sub still delivers new revocations) and retry after the sync interval
+            logger.error(f"Failed to sync revoked session tokens | error={str(e)}")
+            _revoked_tokens_synced_at = time.monotonic()
+    with _revoked_tokens_lock:
+        return token_id in _revoked_tokens
+
+
+def is_session_token_revoked_in_redis(token_id):
+    """
+    Check the revoked token set in Redis directly (used on renewal, where being exact matters more than speed)
+    """
+    return r.zscore(REVOKED_TOKENS_KEY, token_id) is not None
@@ -0,0 +1,160 @@
+# FinBrain Project - classificationworker.py - MIT License (c) 2025 Nadav Eshed
+
+
+# Background classification of new expenses (used when DEFERRED_CLASSIFICATION_ENABLED=true)
+# handle_add_expense inserts the expense with a provisional category and adds it to a Redis Stream,
+# this worker reads the stream in batches, classifies them with one model call and writes the categories back.
+# Run it next to the backend (from server/src):
+#   python -m services.classificationworker
+import os
+import time
+import socket
+import logging
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from redis.exceptions import ResponseError
+from db import expenses_collection
+from db import cache
+from db import rollups
+from db.cache import r
+from utils import metrics
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Insert new expenses right away and classify them in the background
+DEFERRED_CLASSIFICATION_ENABLED = os.getenv('DEFERRED_CLASSIFICATION_ENABLED', 'false').lower() == 'true'
+# Category shown until the worker classifies the expense
+PROVISIONAL_CATEGORY = 'Other'
+
+# Redis Stream of expenses waiting for classification, and the consumer group of the workers
+CLASSIFICATION_STREAM_KEY = 'expense_classification'
+CLASSIFICATION_GROUP = 'classifiers'
+# Stream entries kept at most (approximate trimming)
+CLASSIFICATION_STREAM_MAX_LEN = 100000
+# Expenses classified together in one model call
+CLASSIFICATION_BATCH_SIZE = int(os.getenv('CLASSIFICATION_BATCH_SIZE', '100'))
+# How long the worker waits for new entries before checking again (milliseconds)
+# Must stay well below the Redis socket timeout, or an idle XREADGROUP times out on the client side and is retried as an error
+CLASSIFICATION_BLOCK_MS = min(2000, int(cache.REDIS_SOCKET_TIMEOUT_SECONDS * 1000 / 2))
+# Entries delivered to a worker that did not acknowledge them within this time are taken over (milliseconds)
+CLASSIFICATION_CLAIM_IDLE_MS = 60000
+
+
+def enqueue_expense_classification(expense_id, email, title, date):
+    """
+    Add a new expense to the classification stream
+    Returns False if it could not be added (the caller should classify it right away)
+    """
+    try:
+        r.xadd(
+            CLASSIFICATION_STREAM_KEY,
+            {'expense_id': str(expense_id), 'email': email, 'title': title, 'date': date},
+            maxlen=CLASSIFICATION_STREAM_MAX_LEN,
+            approximate=True
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Failed to enqueue expense classification | expense_id={expense_id} | email={email} | error={str(e)}")
+        return False
+
+
+def ensure_consumer_group():
+    """
+    Create the stream and the consumer group if they do not exist yet
+    """
+    try:
+        r.xgroup_create(CLASSIFICATION_STREAM_KEY, CLASSIFICATION_GROUP, id='0', mkstream=True)
+        logger.info(f"Classification consumer group created | stream={CLASSIFICATION_STREAM_KEY} | group={CLASSIFICATION_GROUP}")
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def read_classification_batch(consumer_name, batch_size, block_ms):
+    """
+    Get up to batch_size entries for this worker: first entries abandoned by other workers, then new ones
+    Returns a list of (entry_id, fields)
+    """
+    claimed = r.xautoclaim(
+        CLASSIFICATION_STREAM_KEY, CLASSIFICATION_GROUP, consumer_name,
+        min_idle_time=CLASSIFICATION_CLAIM_IDLE_MS, start_id='0-0', count=batch_size
+    )
+    entries = [entry for entry in claimed[1] if entry[1]]
+    if entries:
+        return entries
+
+    response = r.xreadgroup(
+        CLASSIFICATION_GROUP, consumer_name, {CLASSIFICATION_STREAM_KEY: '>'},
+        count=batch_size, block=block_ms
+    )
+    return response[0][1] if response else []
+
+
+def classify_pending_expenses(consumer_name, batch_size=CLASSIFICATION_BATCH_SIZE, block_ms=CLASSIFICATION_BLOCK_MS):
+    """
+    Classify one batch of pending expenses, write the categories back and delete the affected month caches
+    Returns the number of stream entries handled
+    """
+    # Imported here so only the worker pays for loading the model
+    from services.logicexpenses import classify_expenses
+
+    entries = read_classification_batch(consumer_name, batch_size, block_ms)
+    if not entries:
+        return 0
+
+    # Classify the whole batch in one model call
+    predicted_categories = classify_expenses([fields.get('title') for _, fields in entries])
+
+    touched_months = set()
+    for (entry_id, fields), category in zip(entries, predicted_categories):
+        try:
+            expense_id = ObjectId(fields.get('expense_id'))
+        except (InvalidId, TypeError):
+            logger.warning(f"Invalid classification entry | entry_id={entry_id} | expense_id={fields.get('expense_id')}")
+            continue
+        # Only expenses still pending are updated (a category the user chose meanwhile is kept)
+        previous = expenses_collection.find_one_and_update(
+            {'_id': expense_id, 'category_pending': True},
+            {'$set': {'category': category}, '$unset': {'category_pending': ''}},
+            projection={'user_id': 1, 'date': 1, 'category': 1, 'amount_ils': 1, 'amount_usd': 1}
+        )
+        if previous:
+            rollups.move_expense_category(previous, category)
+            expense_date = datetime.strptime(fields['date'], '%Y-%m-%d').date()
+            touched_months.add((fields['email'], expense_date.year, expense_date.month))
+
+    # Delete the cache of each affected month once
+    for email, year, month in sorted(touched_months):
+        try:
+            cache.delete_user_expenses_cache(email, month, year)
+        except Exception as cache_error:
+            logger.warning(f"Failed to delete cache after classification | month={month} | year={year} | email={email} | error={str(cache_error)}")
+
+    r.xack(CLASSIFICATION_STREAM_KEY, CLASSIFICATION_GROUP, *[entry_id for entry_id, _ in entries])
+    metrics.increment('expenses_classified_in_background', len(entries))
+    logger.info(f"Pending expenses classified | count={len(entries)} | months={len(touched_months)} | consumer={consumer_name}")
+    return len(entries)
+
+
+def run_worker(consumer_name=None):
+    """
+    Classify pending expenses until the process is stopped
+    """
+    consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+    ensure_consumer_group()
+    logger.info(f"Classification worker started | consumer={consumer_name} | batch_size={CLASSIFICATION_BATCH_SIZE}")
+    while True:
+        try:
+            classify_pending_expenses(consumer_name)
+        except Exception as e:
+            # Unacknowledged entries are retried (by this or another worker) after CLASSIFICATION_CLAIM_IDLE_MS
+            logger.exception(f"Classification batch failed | consumer={consumer_name} | error={str(e)}")
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s - %(message)s")
+    run_worker()
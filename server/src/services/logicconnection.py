@@ -3,20 +3,32 @@
 
 import logging
 from db import users_collection, expenses_collection
-from flask import jsonify
+from flask import jsonify, request, has_request_context
 from datetime import datetime, timezone
 import re
 import uuid
+import threading
 from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from bson.errors import InvalidId
 from db.cache import r
 from db import cache
-from utils.password_hashing import hash_password, verify_password
+from db import sessioncache
+from db import ratelimit
+from db import counters
+from db import monthkeys
+from db import rollups
+from utils.password_hashing import hash_password, verify_password, needs_rehash, PasswordHasherBusy, PASSWORD_HASH_RETRY_AFTER_SECONDS
+from utils import session_tokens
 from dateutil.relativedelta import relativedelta
 
 
 # Session expiry in seconds (1.5 minutes of inactivity)
 SESSION_TTL_SECONDS = 90
 
+# Session fields that identify the user (cached in-process by db.sessioncache)
+SESSION_PRINCIPAL_FIELDS = ('email', 'user_id', 'first_name')
+
 # Create a logger for this module
 logger = logging.getLogger(__name__)
 
@@ -49,6 +61,101 @@ def is_session_expired(session_id):
         return True 
 
 
+def touch_session(session_id):
+    """
+    Get the session data and refresh its last_seen + TTL in a single Redis round trip
+    Returns the session data as a dict (empty dict if the session does not exist)
+    """
+    return r.touch_hash(f"session:{session_id}", 'last_seen', get_now_utc().isoformat(), SESSION_TTL_SECONDS)
+
+
+def refresh_claimed_session(session_id):
+    """
+    Touch a session whose refresh was claimed with sessioncache.claim_session_refresh, then release the claim
+    """
+    session_data = {}
+    try:
+        session_data = touch_session(session_id)
+    finally:
+        sessioncache.finish_session_refresh(session_id, bool(session_data))
+    return session_data
+
+
+def load_session(session_id):
+    """
+    Get the session data from Redis, sliding the TTL only when the refresh policy says it is due
+    Returns the session data as a dict (empty dict if the session does not exist)
+    """
+    # Refresh not due (or already being done by a concurrent request) - just read the session
+    if not sessioncache.claim_session_refresh(session_id, SESSION_TTL_SECONDS):
+        return r.hgetall(f"session:{session_id}")
+    return refresh_claimed_session(session_id)
+
+
+def get_token_principal(token):
+    """
+    Get the user identity (email, user_id) of a signed session token
+    Verified on the CPU, Redis is only read for the periodic revocation set sync
+    Returns None if the token is invalid, expired or revoked
+    """
+    payload = session_tokens.verify_session_token(token)
+    if not payload:
+        return None
+    if sessioncache.is_session_token_revoked(payload.get('jti')):
+        logger.info(f"Revoked session token used | token_id={payload.get('jti')}")
+        return None
+    return {'email': payload.get('email'), 'user_id': payload.get('uid'), 'first_name': payload.get('name')}
+
+
+def get_session_principal(session_id):
+    """
+    Get the user identity (email, user_id) of a session
+    Served from the in-process session cache when possible, otherwise from Redis
+    Returns None if the session does not exist
+    """
+    # Signed tokens carry the identity themselves
+    if session_tokens.is_signed_token(session_id):
+        return get_token_principal(session_id)
+
+    principal = sessioncache.get_cached_session(session_id)
+    if principal is not None:
+        # With the refresh policy on, a cached session still slides its Redis TTL when it is due
+        if sessioncache.SESSION_REFRESH_POLICY_ENABLED and sessioncache.claim_session_refresh(session_id, SESSION_TTL_SECONDS):
+            if not refresh_claimed_session(session_id):
+                sessioncache.invalidate_session(session_id)
+                return None
+        return principal
+
+    session_data = load_session(session_id)
+    if not session_data:
+        return None
+
+    principal = {field: session_data[field] for field in SESSION_PRINCIPAL_FIELDS if field in session_data}
+    sessioncache.add_to_cache_session(session_id, principal)
+    return principal
+
+
+def server_busy_response():
+    """
+    Response for requests rejected because the password hashing pool is full (client should retry shortly)
+    """
+    return jsonify({'message': 'Server is busy, please try again'}), 503, {'Retry-After': str(PASSWORD_HASH_RETRY_AFTER_SECONDS)}
+
+
+def too_many_attempts_response(retry_after):
+    """
+    Response for login attempts rejected by the login throttle (client should wait retry_after seconds)
+    """
+    return jsonify({'message': 'Too many login attempts, please try again later'}), 429, {'Retry-After': str(retry_after)}
+
+
+def get_client_ip():
+    """
+    Get the IP address of the client of the current request (None outside a request)
+    """
+    return request.remote_addr if has_request_context() else None
+
+
 def handle_signup(data):
     """
     Process user signup with validation and database storage
@@ -106,6 +213,9 @@ def handle_signup(data):
         })
     except DuplicateKeyError:
         return jsonify({'message': 'Email already in use'}), 409
+    except PasswordHasherBusy:
+        logger.warning(f"Signup rejected - password hashing pool is full | email={email}")
+        return server_busy_response()
     except Exception:
         logger.exception(f"Signup failed unexpectedly | email={email}")
         return jsonify({'message': 'Signup failed'}), 500
@@ -136,11 +246,19 @@ def handle_login(data):
         if len(email) > 254 or not email_regex.match(email):
             logger.warning(f"Invalid login credentials | email={email}")
             return jsonify({'message': 'Invalid credentials'}), 401
+
+        # Throttle per email and per IP before touching the database or running argon2
+        allowed, login_slot, retry_after = ratelimit.acquire_login_attempt(email, get_client_ip())
+        if not allowed:
+            return too_many_attempts_response(retry_after)
+    else:
+        login_slot = None
     
     # Authenticate user
     try:
         user = users_collection.find_one({'email': email})
     except Exception:
+        ratelimit.release_login_attempt(login_slot)
         logger.exception(f"Login DB error | email={email}")
         return jsonify({'message': 'Login failed'}), 500
 
@@ -150,6 +268,9 @@ def handle_login(data):
             if not user:
                 user = create_demo_user()
             update_demo_user_expenses_months(user)
+        except PasswordHasherBusy:
+            logger.warning(f"Demo login rejected - password hashing pool is full | email={email}")
+            return server_busy_response()
         except Exception:
             logger.exception(f"Demo user failed | email={email}")
             return jsonify({'message': 'Login failed'}), 500
@@ -157,27 +278,71 @@ def handle_login(data):
     # Check password
     stored_password = (user or {}).get('password')
     if not is_demo_user:
-        if not stored_password or not verify_password(password, stored_password):
+        try:
+            password_ok = bool(stored_password) and verify_password(password, stored_password)
+        except PasswordHasherBusy:
+            logger.warning(f"Login rejected - password hashing pool is full | email={email}")
+            return server_busy_response()
+        finally:
+            # The password check is done - free the global verification slot
+            ratelimit.release_login_attempt(login_slot)
+        if not password_ok:
             logger.warning(f"Invalid login credentials | email={email}")
             return jsonify({'message': 'Invalid credentials'}), 401
+
+        # Upgrade the stored hash if it was made with older hashing settings
+        if needs_rehash(stored_password):
+            schedule_password_rehash(email, password, stored_password)
     
-    # Create session
+    # Create a signed session token (no Redis state needed)
+    if session_tokens.signed_tokens_enabled():
+        first_name = (user or {}).get('firstName') or ''
+        session_id = session_tokens.issue_session_token(email, (user or {}).get('_id'), SESSION_TTL_SECONDS, first_name=first_name)
+        logger.info(f"Login successful | email={email} | session_mode=signed | first_name={first_name}")
+        return jsonify({'message': 'Login successful', 'session_id': session_id, 'name': first_name}), 200
+
+    # Extract user name for response
+    first_name = (user or {}).get('firstName') or ''
+
+    # Create session (user_id and first name are stored so requests do not need to look up the user again)
     session_id = str(uuid.uuid4())
     try:
         r.hset(f"session:{session_id}", mapping={"email": email, 
+        "user_id": str((user or {}).get('_id') or ''),
+        "first_name": first_name,
         "last_seen": get_now_utc().isoformat()})
         r.expire(f"session:{session_id}", SESSION_TTL_SECONDS)
+        sessioncache.mark_session_refreshed(session_id)
     except Exception:
         logger.exception(f"Redis error during login | email={email} | session_id={session_id}")
         return jsonify({'message': 'Login failed'}), 500
 
-    # Extract user name for response
-    first_name = (user or {}).get('firstName') or ''
-
     logger.info(f"Login successful | email={email} | session_id={session_id} | first_name={first_name}")
     return jsonify({'message': 'Login successful', 'session_id': session_id, 'name': first_name}), 200
 
 
+def schedule_password_rehash(email, password, old_hashed_password):
+    """
+    Re-hash the password with the current settings in a background thread and store the new hash
+    The stored hash is only replaced if it did not change in the meantime
+    """
+    def rehash():
+        try:
+            new_hashed_password = hash_password(password)
+            result = users_collection.update_one(
+                {'email': email, 'password': old_hashed_password},
+                {'$set': {'password': new_hashed_password}}
+            )
+            logger.info(f"Password rehashed with current settings | email={email} | updated={result.modified_count}")
+        except Exception:
+            # Not critical - the hash will be upgraded on the next login
+            logger.exception(f"Password rehash failed | email={email}")
+
+    thread = threading.Thread(target=rehash, daemon=True)
+    thread.start()
+    return thread
+
+
 def create_demo_user():
     """
     Create a demo user in the database
@@ -225,14 +390,15 @@ def create_demo_user():
             {"title": "Medicine", "date": "2025-07-20", "amount_usd": 44.67,  "amount_ils": 150.00, "category": "Health & Essentials"}
         ]
 
-        # Create the demo expenses
-        serial_number = 1
+        # Create the demo expenses (reserve all their serial numbers at once)
+        serial_number = counters.reserve_serial_numbers(user["_id"], len(demo_expenses))
         docs = []
         for exp in demo_expenses:
             docs.append({
                 "user_id": user["_id"],
                 "title": exp["title"],
                 "date": exp["date"],
+                "month_key": monthkeys.get_month_key(exp["date"]),
                 "amount_usd": exp["amount_usd"],
                 "amount_ils": exp["amount_ils"],
                 "category": exp["category"],
@@ -243,6 +409,7 @@ def create_demo_user():
         # Insert the demo expenses into the database
         if docs:
             expenses_collection.insert_many(docs)
+            rollups.add_expenses_to_rollups(docs)
             logger.info(f"Seeded demo expenses | count={len(docs)}")
     except Exception as e:
         logger.warning(f"Failed to seed demo expenses | error={str(e)}")
@@ -281,8 +448,11 @@ def update_demo_user_expenses_months(demo_user):
     for expense in all_expenses:
         old_date = datetime.strptime(expense["date"], "%Y-%m-%d")
         new_date = old_date + relativedelta(months=delta_months)
-        expenses_collection.update_one({"_id": expense["_id"]}, {"$set": {"date": new_date.strftime("%Y-%m-%d")}})
+        expenses_collection.update_one({"_id": expense["_id"]}, {"$set": {"date": new_date.strftime("%Y-%m-%d"), "month_key": monthkeys.get_month_key(new_date)}})
     
+    # Rebuild the monthly totals of the demo user (every expense moved to another month)
+    rollups.reconcile_rollups(demo_user["_id"])
+
     # Delete all the caches for the demo user
     cache.delete_all_user_expenses_cache("demo")
     
@@ -300,25 +470,61 @@ def get_email_from_session_id(session_id):
         return None
     
     try:
-        # Get session data
-        session_data = r.hgetall(f"session:{validated_session_id}")
-        if not session_data:
+        # Get session data (in-process cache first, then Redis which also updates the session timestamp)
+        session_principal = get_session_principal(validated_session_id)
+        if not session_principal:
             return None
 
         # Get the email from the session data
-        email = session_data.get("email")
+        email = session_principal.get("email")
         if not email:
             return None
-
-        # Update session timestamp
-        r.hset(f"session:{validated_session_id}", "last_seen", get_now_utc().isoformat())
-        r.expire(f"session:{validated_session_id}", SESSION_TTL_SECONDS)
         return email
     except Exception:
         logger.exception(f"Redis error in get_email_from_session_id | session_id={validated_session_id}")
         return None
 
 
+def get_user_from_session_id(session_id):
+    """
+    Retrieve the session user (email, user_id, first_name) from the session ID and update session timestamp
+    user_id comes from the session itself, so no users lookup is needed
+    (older sessions without a user_id fall back to a single _id-only lookup by email)
+    Returns None if the session does not exist or its user is not found
+    """
+    validated_session_id = validate_session_id(session_id)
+    if not validated_session_id:
+        logger.debug(f"Session ID not found | session_id={session_id}")
+        return None
+
+    try:
+        session_principal = get_session_principal(validated_session_id)
+    except Exception:
+        logger.exception(f"Redis error in get_user_from_session_id | session_id={validated_session_id}")
+        return None
+    if not session_principal or not session_principal.get("email"):
+        return None
+
+    # Use the user_id stored in the session
+    email = session_principal["email"]
+    user_id = None
+    if session_principal.get("user_id"):
+        try:
+            user_id = ObjectId(session_principal["user_id"])
+        except (InvalidId, TypeError):
+            logger.warning(f"Invalid user_id in session | email={email}")
+
+    # Fall back to the users collection (only the _id field)
+    if user_id is None:
+        user = users_collection.find_one({'email': email}, {'_id': 1})
+        if not user:
+            logger.warning(f"User not found for session | email={email}")
+            return None
+        user_id = user['_id']
+
+    return {'email': email, 'user_id': user_id, 'first_name': session_principal.get("first_name")}
+
+
 def handle_logout(session_id):
     """
     Process user logout by removing session from Redis
@@ -326,6 +532,14 @@ def handle_logout(session_id):
     validated_session_id = validate_session_id(session_id)
     if not validated_session_id:
         return jsonify({'message': 'Missing session_id'}), 400
+
+    # Revoke signed tokens (they cannot be deleted, so they are added to the revoked set until they expire)
+    if session_tokens.is_signed_token(validated_session_id):
+        payload = session_tokens.verify_session_token(validated_session_id, allow_expired=True)
+        if payload:
+            sessioncache.revoke_session_token(payload.get('jti'), payload.get('exp'))
+            logger.info(f"Logout | token_id={payload.get('jti')}")
+        return jsonify({'message': 'Logout successful'}), 200
     
     # Remove session from Redis
     try:
@@ -333,6 +547,9 @@ def handle_logout(session_id):
     except Exception:
         logger.exception(f"Redis error during logout | session_id={validated_session_id}")
 
+    # Remove session from the in-process cache of every worker
+    sessioncache.invalidate_session(validated_session_id)
+
     logger.info(f"Logout | session_id={validated_session_id}")
     return jsonify({'message': 'Logout successful'}), 200
 
@@ -345,20 +562,43 @@ def handle_heartbeat(session_id):
     if not validated_session_id:
         logger.info(f"Heartbeat for unknown session | session_id={session_id}")
         return jsonify({'message': 'Missing session_id'}), 400
+
+    # Signed tokens are renewed: the client gets a new token with a fresh expiry
+    if session_tokens.is_signed_token(validated_session_id):
+        return handle_token_heartbeat(validated_session_id)
     
-    # Get session data from Redis
+    # Get session data from Redis and update session timestamp when due (one round trip)
     try:
-        session_data = r.hgetall(f"session:{validated_session_id}")
+        session_data = load_session(validated_session_id)
         if not session_data:
             logger.info(f"Heartbeat for non-existent session | session_id={validated_session_id}")
             return jsonify({'message': 'No such session', 'active': False}), 200
 
-        # Update session timestamp
-        r.hset(f"session:{validated_session_id}", "last_seen", get_now_utc().isoformat())
-        r.expire(f"session:{validated_session_id}", SESSION_TTL_SECONDS)
-
         logger.debug(f"Heartbeat ok | session_id={validated_session_id}")
         return jsonify({'message': 'Heartbeat ok', 'active': True, 'ttl_seconds': SESSION_TTL_SECONDS}), 200
     except Exception:
         logger.exception(f"Redis error during heartbeat | session_id={validated_session_id}")
         return jsonify({'message': 'Heartbeat failed', 'active': False}), 500
+
+
+def handle_token_heartbeat(token):
+    """
+    Renew a signed session token (same token ID, new expiry) if it is still valid and not revoked
+    """
+    payload = session_tokens.verify_session_token(token)
+    if not payload:
+        logger.info("Heartbeat for invalid or expired session token")
+        return jsonify({'message': 'No such session', 'active': False}), 200
+
+    # Renewal checks Redis directly so a revoked token can never be extended
+    try:
+        if sessioncache.is_session_token_revoked_in_redis(payload.get('jti')):
+            logger.info(f"Heartbeat for revoked session token | token_id={payload.get('jti')}")
+            return jsonify({'message': 'No such session', 'active': False}), 200
+    except Exception:
+        logger.exception(f"Redis error during heartbeat | token_id={payload.get('jti')}")
+        return jsonify({'message': 'Heartbeat failed', 'active': False}), 500
+
+    renewed_token = session_tokens.issue_session_token(payload.get('email'), payload.get('uid'), SESSION_TTL_SECONDS, token_id=payload.get('jti'), first_name=payload.get('name'))
+    logger.debug(f"Heartbeat ok | token_id={payload.get('jti')}")
+    return jsonify({'message': 'Heartbeat ok', 'active': True, 'ttl_seconds': SESSION_TTL_SECONDS, 'session_id': renewed_token}), 200
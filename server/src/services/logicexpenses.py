@@ -1,20 +1,38 @@
 # FinBrain Project - logicexpenses.py - MIT License (c) 2025 Nadav Eshed
 
 
-from flask import jsonify
-from db import users_collection, expenses_collection, user_feedback_collection
-from services.logicconnection import get_email_from_session_id
+from flask import jsonify, current_app
+from db import expenses_collection, user_feedback_collection
+from services.logicconnection import get_user_from_session_id, get_now_utc
 from datetime import datetime
 import requests
 import re
+import json
+import base64
+import hashlib
 import logging
 from db import cache
+from db import counters
+from db import monthkeys
+from db import rollups
+from services import classificationworker
+from utils import jsonprovider
 
 
 
 # Create a logger for this module
 logger = logging.getLogger(__name__)
 
+# Most expenses accepted by one /add_expenses request
+MAX_EXPENSES_PER_BATCH = 500
+
+# Page size of /get_expenses when a cursor is given without a limit, and the largest allowed limit
+GET_EXPENSES_DEFAULT_PAGE_SIZE = 100
+GET_EXPENSES_MAX_PAGE_SIZE = 500
+
+# Most category selections one combined dashboard request can compare
+DASHBOARD_MAX_COMPARE_SELECTIONS = 8
+
 # List of categories
 categories = [
     'Food & Drinks',
@@ -54,6 +72,28 @@ def classify_expense(text):
         return "Other"
 
 
+def classify_expenses(texts):
+    """
+    Classify many expense titles at once (one vectorizer and one model call for the whole list)
+    Returns the categories in the same order, with 'Other' for empty titles
+    """
+    predicted = ["Other"] * len(texts)
+    indexes = [i for i, text in enumerate(texts) if text and isinstance(text, str) and text.strip()]
+    if not indexes:
+        return predicted
+
+    try:
+        # Import model and vectorizer
+        from models.predictmodelloader import model, vectorizer
+        # Turn all titles into one sparse matrix and predict every row in one call
+        predictions = model.predict(vectorizer.transform([texts[i] for i in indexes]))
+        for i, prediction in zip(indexes, predictions):
+            predicted[i] = str(prediction)
+    except Exception as e:
+        logger.error(f"Error during batch expense classification | count={len(indexes)} | error={str(e)}")
+    return predicted
+
+
 def get_usd_to_ils_rate(date_str):
     """ 
     Get the USD to ILS rate for a given date
@@ -90,139 +130,308 @@ def get_usd_to_ils_rate(date_str):
     return None
 
 
-def handle_add_expense(data, session_id):
+def validate_expense_fields(data):
     """
-    This function is called when the user wants to add an expense to their account
-    It checks if the required fields are present and if the title is valid
-    It then checks if the amount is valid and if the date is valid
-    It then checks if the currency is valid and if the expense is valid
-    It then adds the expense to the database
+    Check the fields of one expense (title, date, amount and currency)
+    Returns (expense, None) with the parsed values, or (None, error message)
     """
-    # Check if session ID is valid (handle common "null" strings)
-    if not session_id or str(session_id).strip().lower() in {"", "none", "null", "undefined"}:
-        return jsonify({'message': 'Session ID is required'}), 400
-
-    # Get the email from the session ID
-    email = get_email_from_session_id(session_id)
-    if not email:
-        logger.warning(f"Unauthorized access attempt | session_id={session_id}")
-        return jsonify({'message': 'Unauthorized'}), 401
-    
-    # Check if the user is a demo user
-    if email == 'demo':
-        return jsonify({'message': 'Demo user cannot add expenses'}), 400
-    
     # Get the required fields
     title = data.get('title')
     date = data.get('date')
     amount = data.get('amount')
     currency = data.get('currency')
     if not title or not date or not amount or not currency:
-        return jsonify({'message': 'Missing required fields'}), 400
+        return None, 'Missing required fields'
     
     # Check if the title is valid
     title_regex = re.compile(r'^[A-Za-z0-9\s]*$')
-    if not title_regex.match(title):
-        return jsonify({'message': 'Invalid title'}), 400
+    if not isinstance(title, str) or not title_regex.match(title):
+        return None, 'Invalid title'
     
     # Check if the title is <= 60 characters
     if len(title) > 60:
-        return jsonify({'message': 'Title must be less than 60 characters'}), 400
+        return None, 'Title must be less than 60 characters'
     
     # Check valid amount
     try:
         amount = float(amount)
         if amount < 0:
-            return jsonify({'message': 'Amount must be greater than 0'}), 400
-    except ValueError:
-        return jsonify({'message': 'Amount must be a number'}), 400
+            return None, 'Amount must be greater than 0'
+    except (TypeError, ValueError):
+        return None, 'Amount must be a number'
     
     # Check if the amount is <= 10 digits
     if len(str(amount)) > 10:
-        return jsonify({'message': 'Amount must be less than 10 digits'}), 400
+        return None, 'Amount must be less than 10 digits'
     
     # Check valid date
     try:
         date = datetime.strptime(date, '%Y-%m-%d').date()
         if date > datetime.now().date() or date < datetime(2015, 1, 1).date():
-            return jsonify({'message': 'Date cannot be in the future or before 2015'}), 400
-    except ValueError:
-        return jsonify({'message': 'Invalid date format'}), 400
+            return None, 'Date cannot be in the future or before 2015'
+    except (TypeError, ValueError):
+        return None, 'Invalid date format'
     
-    # Check valid currencies and convert
-    usd_to_ils_rate = get_usd_to_ils_rate(date)
-    if usd_to_ils_rate is None:
-        return jsonify({'message': 'Failed to get exchange rate'}), 500
+    # Check valid currency
+    if currency not in ('USD', 'ILS'):
+        return None, 'Invalid currency'
+
+    return {'title': title, 'date': date, 'amount': amount, 'currency': currency}, None
+
+
+def convert_amount(amount, currency, usd_to_ils_rate):
+    """
+    Get the amount in both currencies, returning (amount_usd, amount_ils)
+    """
     if currency == 'USD':
-        amount_usd = amount
-        amount_ils = amount * usd_to_ils_rate
-    elif currency == 'ILS':
-        amount_ils = amount
-        amount_usd = amount / usd_to_ils_rate
+        return amount, amount * usd_to_ils_rate
+    return amount / usd_to_ils_rate, amount
+
+
+def to_cached_expense(expense):
+    """
+    Convert an expense document to the format returned by get_expenses (and kept in the cache)
+    """
+    expense = dict(expense)
+    expense["_id"] = str(expense["_id"])
+    expense.pop("user_id", None)
+    return expense
+
+
+def get_month_date_range(month, year):
+    """
+    Get the first day of the month and the first day of the next month as ISO date strings
+    """
+    start_date = datetime(year, month, 1)
+    if month == 12:
+        end_date = datetime(year + 1, 1, 1)
     else:
-        return jsonify({'message': 'Invalid currency'}), 400
+        end_date = datetime(year, month + 1, 1)
+    return start_date.date().isoformat(), end_date.date().isoformat()
+
+
+def encode_expenses_cursor(expense):
+    """
+    Make the cursor that points right after this expense in (date, serial_number) order
+    """
+    position = json.dumps([expense['date'], expense['serial_number']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def decode_expenses_cursor(cursor):
+    """
+    Read a cursor made by encode_expenses_cursor
+    Returns (date, serial_number), or None if the cursor is not valid
+    """
+    try:
+        date, serial_number = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(date, str) or not isinstance(serial_number, int):
+        return None
+    return date, serial_number
+
+
+def handle_add_expense(data, session_id):
+    """
+    This function is called when the user wants to add an expense to their account
+    It checks if the required fields are present and if the title is valid
+    It then checks if the amount is valid and if the date is valid
+    It then checks if the currency is valid and if the expense is valid
+    It then adds the expense to the database
+    """
+    # Check if session ID is valid (handle common "null" strings)
+    if not session_id or str(session_id).strip().lower() in {"", "none", "null", "undefined"}:
+        return jsonify({'message': 'Session ID is required'}), 400
+
+    # Get the user (email and user_id) from the session ID
+    session_user = get_user_from_session_id(session_id)
+    if not session_user:
+        logger.warning(f"Unauthorized access attempt | session_id={session_id}")
+        return jsonify({'message': 'Unauthorized'}), 401
+    email = session_user['email']
     
-    user = users_collection.find_one({'email': email})
-    if not user:
-        logger.warning(f"User not found during expense addition | email={email}")
-        return jsonify({'message': 'User not found'}), 404
+    # Check if the user is a demo user
+    if email == 'demo':
+        return jsonify({'message': 'Demo user cannot add expenses'}), 400
     
-    # Classify the expense
-    category = classify_expense(title)
+    # Check the expense fields
+    expense, error = validate_expense_fields(data)
+    if error:
+        return jsonify({'message': error}), 400
+    title, date, amount, currency = expense['title'], expense['date'], expense['amount'], expense['currency']
     
-    # Get the last expense number
-    last_expense = expenses_collection.find_one(
-        {"user_id": user["_id"]},
-        sort=[("serial_number", -1)]
-    )
-    # If there is a last expense, add 1 to the serial number
-    if last_expense:
-        serial_number = last_expense.get("serial_number", 0) + 1
-    else:
-        serial_number = 1
+    # Convert the amount to both currencies
+    usd_to_ils_rate = get_usd_to_ils_rate(date)
+    if usd_to_ils_rate is None:
+        return jsonify({'message': 'Failed to get exchange rate'}), 500
+    amount_usd, amount_ils = convert_amount(amount, currency, usd_to_ils_rate)
     
-    # Create the expense item
+    # Classify the expense (or insert it with a provisional category and let the background worker classify it)
+    deferred = classificationworker.DEFERRED_CLASSIFICATION_ENABLED
+    category = classificationworker.PROVISIONAL_CATEGORY if deferred else classify_expense(title)
+    
+    # Create the expense item with the next serial number of the user (atomic, so concurrent adds never share one)
     try:
-        expenses_collection.insert_one({
-            "user_id": user['_id'],
+        serial_number = counters.next_serial_number(session_user['user_id'])
+        expense = {
+            "user_id": session_user['user_id'],
             "title": title,
             "date": date.isoformat(),
+            "month_key": monthkeys.get_month_key(date),
             "amount_usd": amount_usd,
             "amount_ils": amount_ils,
             "category": category,
             "serial_number": serial_number
-        })
+        }
+        if deferred:
+            expense["category_pending"] = True
+        expense_id = expenses_collection.insert_one(expense).inserted_id
     except Exception as e:
         logger.error(f"Failed to insert expense | title={title} | email={email} | error={str(e)}")
         return jsonify({'message': 'Failed to add expense'}), 500
 
-    # delete cache for this month and year for the user
+    # Add the expense to the monthly totals of the dashboard
+    rollups.add_expenses_to_rollups([expense])
+
+    # Hand the expense to the classification worker (classify it now if the stream is not available)
+    if deferred and not classificationworker.enqueue_expense_classification(expense_id, email, title, date.isoformat()):
+        category = classify_expense(title)
+        try:
+            expenses_collection.update_one({'_id': expense_id}, {'$set': {'category': category}, '$unset': {'category_pending': ''}})
+            rollups.move_expense_category(expense, category)
+            expense['category'] = category
+            expense.pop('category_pending', None)
+        except Exception as e:
+            logger.error(f"Failed to save expense category | serial_number={serial_number} | email={email} | error={str(e)}")
+
+    # Add the expense to the cached month (so the next get_expenses is still a cache hit)
     try:
-        cache.delete_user_expenses_cache(email, date.month, date.year)
+        cache.append_to_cached_user_expenses(email, date.month, date.year, [to_cached_expense(expense)])
     except Exception as cache_error:
-        logger.warning(f"Failed to delete cache after adding expense | month={date.month} | year={date.year} | email={email} | error={str(cache_error)}")
+        logger.warning(f"Failed to update cache after adding expense | month={date.month} | year={date.year} | email={email} | error={str(cache_error)}")
 
     logger.info(f"Expense added | title={title} | date={date} | amount={amount} | currency={currency} | category={category} | serial_number={serial_number}")
     return jsonify({'message': 'Expense added'}), 200
 
 
-def handle_get_expenses(month, year, session_id):
+def handle_add_expenses(data, session_id):
+    """
+    This function is called when the user wants to add many expenses at once
+    Every row is checked like in handle_add_expense, then the exchange rate of each date is fetched once,
+    all titles are classified together and the valid rows are inserted with one insert_many
+    It returns a result for every row (added with its serial number, or the error)
+    """
+    # Check if session ID is valid (handle common "null" strings)
+    if not session_id or str(session_id).strip().lower() in {"", "none", "null", "undefined"}:
+        return jsonify({'message': 'Session ID is required'}), 400
+
+    # Get the user (email and user_id) from the session ID
+    session_user = get_user_from_session_id(session_id)
+    if not session_user:
+        logger.warning(f"Unauthorized access attempt | session_id={session_id}")
+        return jsonify({'message': 'Unauthorized'}), 401
+    email = session_user['email']
+
+    # Check if the user is a demo user
+    if email == 'demo':
+        return jsonify({'message': 'Demo user cannot add expenses'}), 400
+
+    # Get the rows (either {"expenses": [...]} or the list itself)
+    rows = data.get('expenses') if isinstance(data, dict) else data
+    if not isinstance(rows, list) or not rows:
+        return jsonify({'message': 'Expenses must be a non-empty list'}), 400
+    if len(rows) > MAX_EXPENSES_PER_BATCH:
+        return jsonify({'message': f'Cannot add more than {MAX_EXPENSES_PER_BATCH} expenses at once'}), 400
+
+    # Check every row
+    results = [None] * len(rows)
+    valid_rows = []
+    for index, row in enumerate(rows):
+        expense, error = validate_expense_fields(row) if isinstance(row, dict) else (None, 'Invalid expense')
+        if error:
+            results[index] = {'index': index, 'status': 'error', 'message': error}
+        else:
+            valid_rows.append((index, expense))
+    if not valid_rows:
+        return jsonify({'message': 'No valid expenses', 'results': results}), 400
+
+    # Get the exchange rate of each distinct date once
+    rates = {date: get_usd_to_ils_rate(date) for date in {expense['date'] for _, expense in valid_rows}}
+    ready_rows = []
+    for index, expense in valid_rows:
+        if rates[expense['date']] is None:
+            results[index] = {'index': index, 'status': 'error', 'message': 'Failed to get exchange rate'}
+        else:
+            ready_rows.append((index, expense))
+    if not ready_rows:
+        return jsonify({'message': 'Failed to get exchange rate', 'results': results}), 500
+
+    # Classify all titles in one call
+    row_categories = classify_expenses([expense['title'] for _, expense in ready_rows])
+
+    # Reserve one block of serial numbers and insert all rows at once
+    try:
+        first_serial_number = counters.reserve_serial_numbers(session_user['user_id'], len(ready_rows))
+        docs = []
+        for offset, ((index, expense), category) in enumerate(zip(ready_rows, row_categories)):
+            amount_usd, amount_ils = convert_amount(expense['amount'], expense['currency'], rates[expense['date']])
+            docs.append({
+                "user_id": session_user['user_id'],
+                "title": expense['title'],
+                "date": expense['date'].isoformat(),
+                "month_key": monthkeys.get_month_key(expense['date']),
+                "amount_usd": amount_usd,
+                "amount_ils": amount_ils,
+                "category": category,
+                "serial_number": first_serial_number + offset
+            })
+        expenses_collection.insert_many(docs)
+    except Exception as e:
+        logger.error(f"Failed to insert expenses | count={len(ready_rows)} | email={email} | error={str(e)}")
+        return jsonify({'message': 'Failed to add expenses'}), 500
+
+    # Add the expenses to the monthly totals of the dashboard (one update per month and category)
+    rollups.add_expenses_to_rollups(docs)
+
+    # Add the new expenses to each affected cached month with one update per month
+    docs_by_month = {}
+    for doc in docs:
+        doc_date = datetime.strptime(doc['date'], '%Y-%m-%d').date()
+        docs_by_month.setdefault((doc_date.year, doc_date.month), []).append(to_cached_expense(doc))
+    for (year, month), month_docs in sorted(docs_by_month.items()):
+        try:
+            cache.append_to_cached_user_expenses(email, month, year, month_docs)
+        except Exception as cache_error:
+            logger.warning(f"Failed to update cache after adding expenses | month={month} | year={year} | email={email} | error={str(cache_error)}")
+
+    for (index, _), doc in zip(ready_rows, docs):
+        results[index] = {'index': index, 'status': 'added', 'serial_number': doc['serial_number'], 'category': doc['category']}
+
+    failed = len(rows) - len(docs)
+    logger.info(f"Expenses added | email={email} | added={len(docs)} | failed={failed} | dates={len(rates)}")
+    return jsonify({'message': f'{len(docs)} expenses added', 'added': len(docs), 'failed': failed, 'results': results}), 200
+
+
+def handle_get_expenses(month, year, session_id, limit=None, after=None, if_none_match=None):
     """    
     This function is called when the user wants to get their expenses from their account
     It gets the user from the session ID, checks if the month and year are valid,
+    answers 304 if the client already has the current version of the month (If-None-Match),
     calculates the start and end dates for the month, gets the expenses for the month,
     converts the ObjectId to a string and removes the user_id field, and returns the expenses
+    With limit and/or after it returns one page instead (see get_expenses_page)
     """
     # Check if session ID is valid (handle common "null" strings)
     if not session_id or str(session_id).strip().lower() in {"", "none", "null", "undefined"}:
         return jsonify({'message': 'Session ID is required'}), 400
 
     # Get the user from the session ID
-    email = get_email_from_session_id(session_id)
-    user = users_collection.find_one({'email': email})
-    if not user:
-        logger.warning(f"User not found during get expenses | email={email}")
+    session_user = get_user_from_session_id(session_id)
+    if not session_user:
+        logger.warning(f"User not found during get expenses | session_id={session_id}")
         return jsonify({'message': 'User not found'}), 404
+    email = session_user['email']
 
     # Check if the month and year are valid (None or not int)
     if month is None or year is None:
@@ -231,52 +440,156 @@ def handle_get_expenses(month, year, session_id):
     # Check if the month and year are valid
     if month < 1 or month > 12 or year < 2015 or year > 2027:
         return jsonify({"message": "Invalid month or year"}), 400
+
+    # Check the version of the month before reading the cache or MongoDB
+    read_headers = get_read_headers(email, [f"{year}-{month:02d}"], 'get_expenses', month, year, limit, after)
+    if read_headers and is_etag_matched(if_none_match, read_headers['ETag']):
+        logger.info(f"Get expenses not modified | month={month} | year={year} | email={email}")
+        return '', 304, read_headers
+
+    # Return one page if the client asked for pages
+    if limit is not None or after is not None:
+        return add_read_headers(get_expenses_page(session_user, month, year, GET_EXPENSES_DEFAULT_PAGE_SIZE if limit is None else limit, after), read_headers)
     
-    # Check cache first
-    cached_expenses = cache.get_cached_user_expenses(email, month, year)
+    # Check cache first (the cached JSON is sent inside the response as it is, without decoding it)
+    cached_expenses = cache.get_cached_user_expenses_json(email, month, year)
     if cached_expenses is not None:
-        logger.info(f"Get expenses from cache successful | month={month} | year={year} | expense_count={len(cached_expenses)} | email={email}")
-        return jsonify({"expenses": cached_expenses}), 200
+        logger.info(f"Get expenses from cache successful | month={month} | year={year} | bytes={len(cached_expenses)} | email={email}")
+        return add_read_headers((get_json_text_response(f'{{"expenses":{cached_expenses}}}'), 200), read_headers)
     
     # Calculate the start and end dates for the month
     try:
-        start_date = datetime(year, month, 1)
-        if month == 12:
-            end_date = datetime(year + 1, 1, 1)
-        else:
-            end_date = datetime(year, month + 1, 1)
+        start_date, end_date = get_month_date_range(month, year)
     except ValueError:
         return jsonify({"message": "Invalid month or year"}), 400
     
-    # Get the expenses for the month
+    # Get the expenses for the month (without the user_id field)
     expenses = list(expenses_collection.find({
-        "user_id": user["_id"],
+        "user_id": session_user["user_id"],
         "date": {
-            "$gte": start_date.date().isoformat(),
-            "$lt": end_date.date().isoformat()
-    }}))
+            "$gte": start_date,
+            "$lt": end_date
+    }}, {"user_id": 0}))
 
-    # Convert the ObjectId to a string and remove the user_id field
-    for expense in expenses:
-        expense["_id"] = str(expense["_id"])
-        if "user_id" in expense:
-            expense["user_id"] = str(expense["user_id"])
+    # Convert the ObjectId to a string
+    expenses = [to_cached_expense(expense) for expense in expenses]
 
     # Cache the expenses for future use (don't fail if caching fails)
+    expenses_json = None
     try:
-        cache.add_to_cache_user_expenses(email, month, year, expenses)
+        expenses_json = cache.add_to_cache_user_expenses(email, month, year, expenses)
     except Exception as cache_error:
         logger.warning(f"Failed to cache user expenses | month={month} | year={year} | email={email} | error={str(cache_error)}")
+    if expenses_json is None:
+        expenses_json = jsonprovider.dumps_compact(expenses)
 
+    # Send the same text a cache hit sends, so one ETag always means the same bytes
     logger.info(f"Get expenses successful | month={month} | year={year} | expense_count={len(expenses)} | email={email}")
-    return jsonify({"expenses": expenses}), 200
+    return add_read_headers((get_json_text_response(f'{{"expenses":{expenses_json}}}'), 200), read_headers)
 
 
-def handle_get_expenses_for_dashboard(chart, currency, months, categories, session_id):
+def get_json_text_response(json_text):
+    """
+    Get a JSON response whose body is already JSON text (a cache hit), without decoding and encoding it again
+    """
+    return current_app.response_class(json_text.encode() + b'\n', mimetype='application/json')
+
+
+def get_read_headers(email, months, *request_parts):
+    """
+    Get the ETag and caching headers of a read of the user's months ('YYYY-MM')
+    The strong ETag is a hash of the user, the version stamps of the months and the request parameters,
+    so it changes with every write to one of the months (checked without reading MongoDB)
+    Returns None if the month versions could not be read (the read is then served without an ETag)
+    """
+    month_versions = cache.get_user_month_versions(email, months)
+    if month_versions is None:
+        return None
+    stamp = '|'.join([str(email).strip().lower(), *[f"{month}={version}" for month, version in sorted(month_versions.items())], *[repr(part) for part in request_parts]])
+    # Months before the current one rarely change: the browser may keep them (private - never a shared cache)
+    current_month = get_now_utc().strftime('%Y-%m')
+    closed = bool(months) and all(month < current_month for month in months)
+    return {
+        'ETag': f'"{hashlib.sha256(stamp.encode()).hexdigest()[:32]}"',
+        'Cache-Control': 'private, no-cache' if closed else 'no-cache',
+        'Vary': 'Session-ID'
+    }
+
+
+def is_etag_matched(if_none_match, etag):
+    """
+    Check if the If-None-Match header of the request lists the ETag (or is *)
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    # If-None-Match uses the weak comparison, so W/"x" matches "x"
+    return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
+
+
+def add_read_headers(result, read_headers):
+    """
+    Add the ETag and caching headers to a successful (response, status) result
+    """
+    if not read_headers or result[1] != 200:
+        return result
+    return result[0], result[1], read_headers
+
+
+def get_expenses_page(session_user, month, year, limit, after):
+    """
+    Get one page of a month's expenses in (date, serial_number) order
+    after is the next_cursor of the previous page (None for the first page)
+    Returns {"expenses": [...], "next_cursor": cursor or None when this is the last page}
+    """
+    email = session_user['email']
+
+    # Check the limit and the cursor
+    if limit < 1 or limit > GET_EXPENSES_MAX_PAGE_SIZE:
+        return jsonify({"message": f"Limit must be between 1 and {GET_EXPENSES_MAX_PAGE_SIZE}"}), 400
+    position = decode_expenses_cursor(after) if after else None
+    if after and position is None:
+        return jsonify({"message": "Invalid cursor"}), 400
+
+    # Check cache first
+    page_id = f"{limit}:{after or ''}"
+    cached_page = cache.get_cached_user_expenses_page_json(email, month, year, page_id)
+    if cached_page is not None:
+        logger.info(f"Get expenses page from cache successful | month={month} | year={year} | bytes={len(cached_page)} | email={email}")
+        return get_json_text_response(cached_page), 200
+
+    # Keyset query: only expenses after the cursor, read one extra to know if there is a next page
+    start_date, end_date = get_month_date_range(month, year)
+    query = {"user_id": session_user["user_id"], "date": {"$gte": start_date, "$lt": end_date}}
+    if position:
+        last_date, last_serial_number = position
+        query["$or"] = [
+            {"date": {"$gt": last_date}},
+            {"date": last_date, "serial_number": {"$gt": last_serial_number}}
+        ]
+    expenses = list(
+        expenses_collection.find(query, {"user_id": 0})
+        .sort([("date", 1), ("serial_number", 1)])
+        .limit(limit + 1)
+    )
+
+    has_more = len(expenses) > limit
+    expenses = [to_cached_expense(expense) for expense in expenses[:limit]]
+    page = {"expenses": expenses, "next_cursor": encode_expenses_cursor(expenses[-1]) if has_more else None}
+
+    # Cache the page for future use (the response is the cached text, like a cache hit)
+    page_json = cache.add_to_cache_user_expenses_page(email, month, year, page_id, page)
+
+    logger.info(f"Get expenses page successful | month={month} | year={year} | limit={limit} | expense_count={len(expenses)} | has_more={has_more} | email={email}")
+    return get_json_text_response(page_json), 200
+
+
+def handle_get_expenses_for_dashboard(chart, currency, months, categories, session_id, if_none_match=None):
     """
     This function is called when the user wants to get the expenses for the dashboard
     It gets the user from the session ID, checks if the chart and currency are valid,
-    checks if the months are valid, gets the user ID, gets the month regexes,
+    checks if the months are valid, answers 304 if none of the months changed since the client got the chart (If-None-Match),
+    gets the user ID, gets the month regexes,
     gets the expenses for the months, initializes the categories totals, sets the amount key,
     sums the expenses for the categories, calculates the total amount, calculates the percentage for each category,
     and returns the result
@@ -286,77 +599,244 @@ def handle_get_expenses_for_dashboard(chart, currency, months, categories, sessi
         return jsonify({'message': 'Session ID is required'}), 400
 
     # Get the user from the session ID
-    email = get_email_from_session_id(session_id)
-    user = users_collection.find_one({'email': email})
-    if not user:
-        logger.warning(f"User not found during dashboard request | email={email}")
+    session_user = get_user_from_session_id(session_id)
+    if not session_user:
+        logger.warning(f"User not found during dashboard request | session_id={session_id}")
         return jsonify({'message': 'User not found'}), 404
+    email = session_user['email']
     
     # Check if the chart is valid
     if chart not in ['category_breakdown', 'monthly_comparison']:
         return jsonify({'message': 'Invalid chart'}), 400
+
+    # Check the currency, months and categories
+    error = get_dashboard_request_error([currency], months, [categories])
+    if error:
+        return error
+
+    # Check the versions of the months before reading the cache or MongoDB
+    read_headers = get_read_headers(email, months, 'expenses_for_dashboard', chart, currency, months, categories)
+    if read_headers and is_etag_matched(if_none_match, read_headers['ETag']):
+        logger.info(f"Get expenses for dashboard not modified | chart={chart} | currency={currency} | months={months} | email={email}")
+        return '', 304, read_headers
     
-    # Check if the currency is valid
-    if currency not in ['ILS', 'USD']:
-        return jsonify({'message': 'Invalid currency'}), 400
+    # Get the user ID
+    user_id = session_user['user_id']
+    # Get the filter of the selected months
+    months_filter = get_months_filter(months)
+
+    # Check cache first (valid only if none of the user's expenses changed since it was computed)
+    result, generation = cache.get_cached_dashboard(email, chart, currency, months, categories)
+
+    # Handle the category breakdown chart
+    if result is None and chart == 'category_breakdown':
+        result = handle_category_breakdown(months_filter, user_id, currency, months)
+        cache.add_to_cache_dashboard(email, chart, currency, months, categories, generation, result)
+
+    # Handle the monthly comparison chart
+    elif result is None and chart == 'monthly_comparison':
+        result = handle_monthly_comparison(months_filter, user_id, currency, categories, months)
+        cache.add_to_cache_dashboard(email, chart, currency, months, categories, generation, result)
+
+    # The cache key uses the sorted months - put the months back in the requested order
+    elif chart == 'monthly_comparison':
+        rows = {row['month']: row for row in result}
+        result = [rows[month] for month in dict.fromkeys(months)]
     
+    logger.info(f"Get expenses for dashboard successful | chart={chart} | currency={currency} | months={months} | categories={categories} | email={email}")
+    return add_read_headers((jsonify(get_dashboard_chart_response(chart, currency, months, result)), 200), read_headers)
+
+
+def handle_get_combined_dashboard(currencies, months, compare_selections, session_id, if_none_match=None):
+    """
+    This function is called when the dashboard wants both charts at once (chart=combined)
+    It gets the user from the session ID, checks the currencies, months and category selections,
+    sums the expenses of the months per month and category once (one aggregation, or the cached sums),
+    and builds the category breakdown of every currency and the monthly comparison of every currency and selection
+    Every chart is exactly the response of its own /expenses_for_dashboard request
+    """
+    # Check if session ID is valid (handle common "null" strings)
+    if not session_id or str(session_id).strip().lower() in {"", "none", "null", "undefined"}:
+        return jsonify({'message': 'Session ID is required'}), 400
+
+    # Get the user from the session ID
+    session_user = get_user_from_session_id(session_id)
+    if not session_user:
+        logger.warning(f"User not found during combined dashboard request | session_id={session_id}")
+        return jsonify({'message': 'User not found'}), 404
+    email = session_user['email']
+
+    # Limit the number of category selections
+    if len(compare_selections) > DASHBOARD_MAX_COMPARE_SELECTIONS:
+        return jsonify({'message': f'Too many category selections. Maximum is {DASHBOARD_MAX_COMPARE_SELECTIONS}.'}), 400
+
+    # Check the currencies, months and category selections
+    error = get_dashboard_request_error(currencies, months, compare_selections)
+    if error:
+        return error
+
+    # Check the versions of the months before reading the cache or MongoDB
+    read_headers = get_read_headers(email, months, 'expenses_for_dashboard', 'combined', currencies, months, compare_selections)
+    if read_headers and is_etag_matched(if_none_match, read_headers['ETag']):
+        logger.info(f"Get combined dashboard not modified | currencies={currencies} | months={months} | email={email}")
+        return '', 304, read_headers
+
+    # Sum the expenses of the months per month and category (cached until the user's expenses change)
+    totals, generation = cache.get_cached_dashboard(email, 'totals', 'all', months, [])
+    if totals is None:
+        totals = get_dashboard_totals(get_months_filter(months), session_user['user_id'], months)
+        cache.add_to_cache_dashboard(email, 'totals', 'all', months, [], generation, totals)
+
+    # Build every chart from the same sums
+    category_breakdown = {}
+    monthly_comparison = {}
+    for currency in dict.fromkeys(currencies):
+        category_breakdown[currency] = get_dashboard_chart_response(
+            'category_breakdown', currency, months, build_category_breakdown(totals, currency))
+        monthly_comparison[currency] = [
+            get_dashboard_chart_response('monthly_comparison', currency, months, build_monthly_comparison(totals, currency, selection, months))
+            for selection in compare_selections
+        ]
+
+    logger.info(f"Get combined dashboard successful | currencies={currencies} | months={months} | selections={len(compare_selections)} | email={email}")
+    return add_read_headers((jsonify({
+        'chart': 'combined',
+        'months': months,
+        'category_breakdown': category_breakdown,
+        'monthly_comparison': monthly_comparison
+    }), 200), read_headers)
+
+
+def get_dashboard_request_error(currencies, months, category_lists):
+    """
+    Check the currencies, months and category lists of a dashboard request
+    Returns the error response, or None if the request is valid
+    """
+    # Check if the currencies are valid
+    if not currencies:
+        return jsonify({'message': 'Invalid currency'}), 400
+    for currency in currencies:
+        if currency not in ['ILS', 'USD']:
+            return jsonify({'message': 'Invalid currency'}), 400
+
     # Check if the months are valid [year-month]
     for month in months:
         if not re.match(r'^\d{4}-\d{2}$', month):
             return jsonify({'message': 'Invalid month'}), 400
-            
+
     # Limit selection to at most 12 months
     if len(months) > 12:
         return jsonify({'message': 'Too many months selected. Maximum is 12.'}), 400
-    
-    # Check if the categories are not empty
-    if categories is None:
-        return jsonify({'message': 'Categories are required'}), 400
-    
+
     # Check if the categories are valid
-    valid_categories = ['Food & Drinks', 'Housing & Bills', 'Transportation', 'Education & Personal Growth', 'Health & Essentials', 'Leisure & Gifts', 'Other'] + ['All']
-    if len(categories) == 1:
-        if categories[0] not in valid_categories:
-            return jsonify({'message': 'Invalid category'}), 400
-    else:
-        for category in categories:
+    valid_categories = categories + ['All']
+    for category_list in category_lists:
+        # Check if the categories are not empty
+        if category_list is None:
+            return jsonify({'message': 'Categories are required'}), 400
+        for category in category_list:
             if category not in valid_categories:
                 return jsonify({'message': 'Invalid category'}), 400
-    
-    # Get the user ID
-    user_id = user['_id']
-    # Get the month regexes
-    month_regexes = [re.compile(f'^{month}') for month in months]
+    return None
 
-    # Handle the category breakdown chart
-    if chart == 'category_breakdown':
-        result = handle_category_breakdown(month_regexes, user_id, currency)
 
-    # Handle the monthly comparison chart
-    elif chart == 'monthly_comparison':
-        result = handle_monthly_comparison(month_regexes, user_id, currency, categories, months)
-    
-    logger.info(f"Get expenses for dashboard successful | chart={chart} | currency={currency} | months={months} | categories={categories} | email={email}")
-    return jsonify({
+def get_dashboard_chart_response(chart, currency, months, data):
+    """
+    Get the response body of one dashboard chart
+    """
+    return {
         'currency': currency,
         'chart': chart,
         'months': months,
-        'data': result
-    }), 200
+        'data': data
+    }
+
+
+def get_months_filter(months):
+    """
+    Get the query filter of the expenses in the given months ('YYYY-MM' strings)
+    Expenses with month_key are matched exactly (user_id, month_key, category index),
+    expenses written before month_key existed (month_key missing or null) are still matched by their date
+    until the backfill has run and MONTH_KEY_FALLBACK_ENABLED is turned off
+    """
+    month_keys_filter = {'month_key': {'$in': [monthkeys.get_month_key(month) for month in months]}}
+    if not monthkeys.MONTH_KEY_FALLBACK_ENABLED:
+        return month_keys_filter
+    return {'$or': [
+        month_keys_filter,
+        {'month_key': None, 'date': {'$in': [re.compile(f'^{month}') for month in months]}}
+    ]}
+
+
+def get_dashboard_totals(months_filter, user_id, months):
+    """
+    Sum the expenses of the months per month and category in MongoDB (at most 12 x 7 rows),
+    or read the monthly rollups of the months when DASHBOARD_ROLLUPS_ENABLED
+    The combined mode builds every chart from these sums (the single-chart requests group only by what their chart needs)
+    Returns a list of {month, category, amount_ils, amount_usd} sorted by month and category
+    """
+    if rollups.DASHBOARD_ROLLUPS_ENABLED:
+        # One small document per month and category
+        totals = rollups.get_rollups(user_id, months)
+    else:
+        # Group by the month of the date (e.g., "2025-09-10" -> "2025-09") and the category
+        rows = expenses_collection.aggregate([
+            {'$match': {'user_id': user_id, **months_filter}},
+            {'$group': {
+                '_id': {'month': {'$substr': ['$date', 0, 7]}, 'category': '$category'},
+                'amount_ils': {'$sum': '$amount_ils'},
+                'amount_usd': {'$sum': '$amount_usd'}
+            }}
+        ])
+        totals = [{
+            'month': row['_id']['month'],
+            'category': row['_id'].get('category'),
+            'amount_ils': row['amount_ils'],
+            'amount_usd': row['amount_usd']
+        } for row in rows]
+
+    # A fixed order, so the sums below always add the amounts in the same order
+    return sorted(totals, key=lambda total: (total['month'], str(total.get('category') or '')))
 
 
-def handle_category_breakdown(month_regexes, user_id, currency):
+def handle_category_breakdown(months_filter, user_id, currency, months):
     """
     This function is called when the user wants to get the category breakdown for the dashboard
-    It gets the expenses for the months, initializes the categories totals, sets the amount key,
-    sums the expenses for the categories, calculates the total amount, calculates the percentage for each category,
-    and returns the result
+    It sums the expenses of the months per category in MongoDB (one row per category, at most 7),
+    or reads the monthly rollups of the months when DASHBOARD_ROLLUPS_ENABLED, and builds the chart from the sums
+    (chart=combined groups by month and category instead, to build every chart from one aggregation)
     """
-    # Get the expenses for the months
-    expenses_cursor = expenses_collection.find({
-        'user_id': user_id,
-        'date': {'$in': month_regexes}
-    })
+    # Set the amount key
+    amount_key = 'amount_ils'
+    if currency == 'USD':
+        amount_key = 'amount_usd'
+
+    if rollups.DASHBOARD_ROLLUPS_ENABLED:
+        # One small document per month and category
+        totals = rollups.get_rollups(user_id, months)
+    else:
+        # Sum the expenses of the months per category in MongoDB
+        rows = expenses_collection.aggregate([
+            {'$match': {'user_id': user_id, **months_filter}},
+            {'$group': {'_id': '$category', 'amount': {'$sum': f'${amount_key}'}}}
+        ])
+        totals = [{'category': row['_id'], amount_key: row['amount']} for row in rows]
+
+    # A fixed order, so the amounts are always added in the same order
+    totals = sorted(totals, key=lambda total: (total.get('month', ''), str(total.get('category') or '')))
+    return build_category_breakdown(totals, currency)
+
+
+def build_category_breakdown(totals, currency):
+    """
+    Build the category breakdown from the month and category sums of get_dashboard_totals
+    It initializes the categories totals, adds the sums to them, calculates the total amount,
+    calculates the percentage for each category, and returns the result
+    """
+    # Set the amount key
+    amount_key = 'amount_ils'
+    if currency == 'USD':
+        amount_key = 'amount_usd'
 
     # Initialize the categories totals
     categories_totals = {
@@ -369,17 +849,12 @@ def handle_category_breakdown(month_regexes, user_id, currency):
         "Other": 0
     }
 
-    # Set the amount key
-    amount_key = 'amount_ils'
-    if currency == 'USD':
-        amount_key = 'amount_usd'
-    
-    # Sum the expenses for the categories
-    for expense in expenses_cursor:
-        category = expense.get('category', 'Other')
+    # Add the sums to the categories (unknown or missing categories count as Other)
+    for total in totals:
+        category = total.get('category')
         if category not in categories_totals:
             category = 'Other'
-        categories_totals[category] += expense.get(amount_key, 0)
+        categories_totals[category] += total.get(amount_key, 0)
     
     # Calculate the total amount
     total_amount = sum(categories_totals.values())
@@ -402,42 +877,64 @@ def handle_category_breakdown(month_regexes, user_id, currency):
     return result
 
 
-def handle_monthly_comparison(month_regexes, user_id, currency, categories, months):
+def handle_monthly_comparison(months_filter, user_id, currency, categories, months):
     """
     This function is called when the user wants to get the monthly comparison for the dashboard
-    It gets the expenses for the months and categories, initializes monthly comparison dictionary,
-    sums the expenses for each month, calculates percentages, and returns the result
+    It sums the expenses of the months and categories per month in MongoDB (one row per month, at most 12),
+    or reads the monthly rollups of the months and categories when DASHBOARD_ROLLUPS_ENABLED, and builds the chart from the sums
+    (chart=combined groups by month and category instead, to build every chart from one aggregation)
     """
-    # Get the expenses for the months and categories
+    # Set the amount key
+    amount_key = 'amount_ils'
+    if currency == 'USD':
+        amount_key = 'amount_usd'
+
     # If "All" is in categories, don't filter by category
-    if 'All' in categories:
-        expenses_cursor = expenses_collection.find({
-            'user_id': user_id,
-            'date': {'$in': month_regexes}
-        })
+    if rollups.DASHBOARD_ROLLUPS_ENABLED:
+        # One small document per month and category
+        totals = rollups.get_rollups(user_id, months, None if 'All' in categories else categories)
     else:
-        expenses_cursor = expenses_collection.find({
-            'user_id': user_id,
-            'date': {'$in': month_regexes},
-            'category': {'$in': categories} 
-        })
+        # Get the expenses for the months and categories
+        match = {'user_id': user_id, **months_filter}
+        if 'All' not in categories:
+            match['category'] = {'$in': categories}
 
-    # Initialize dictionary for monthly comparison
-    monthly_comparison = {}
-    for month in months:
-        monthly_comparison[month] = 0
+        # Sum the expenses per month in MongoDB
+        # Group by the month of the date (e.g., "2025-09-10" -> "2025-09")
+        rows = expenses_collection.aggregate([
+            {'$match': match},
+            {'$group': {'_id': {'$substr': ['$date', 0, 7]}, 'amount': {'$sum': f'${amount_key}'}}}
+        ])
+        totals = [{'month': row['_id'], amount_key: row['amount']} for row in rows]
+
+    # A fixed order, so the amounts are always added in the same order
+    totals = sorted(totals, key=lambda total: (total['month'], str(total.get('category') or '')))
+    # The sums are already of the selected categories
+    return build_monthly_comparison(totals, currency, ['All'], months)
 
+
+def build_monthly_comparison(totals, currency, categories, months):
+    """
+    Build the monthly comparison of the categories from the month and category sums of get_dashboard_totals
+    It initializes monthly comparison dictionary, adds the sums of the categories to it, calculates percentages, and returns the result
+    """
     # Set the amount key
     amount_key = 'amount_ils'
     if currency == 'USD':
         amount_key = 'amount_usd'
 
-    # Sum the expenses for each month
-    for expense in expenses_cursor:
-        expense_date = expense['date']
-        # Extract month from full date (e.g., "2025-09-10" -> "2025-09")
-        expense_month = expense_date[:7]  # Take first 7 characters (YYYY-MM)
-        monthly_comparison[expense_month] += expense[amount_key]
+    # Initialize dictionary for monthly comparison
+    monthly_comparison = {}
+    for month in months:
+        monthly_comparison[month] = 0
+
+    # Add the sums to the months
+    # If "All" is in categories, don't filter by category
+    for total in totals:
+        if 'All' not in categories and total.get('category') not in categories:
+            continue
+        if total['month'] in monthly_comparison:
+            monthly_comparison[total['month']] += total.get(amount_key, 0)
     
     # Get the value of the month with the max amount
     max_amount = max(monthly_comparison.values()) if monthly_comparison else 0
@@ -468,18 +965,19 @@ def handle_update_expense_category(data, session_id):
     if not session_id or str(session_id).strip().lower() in {"", "none", "null", "undefined"}:
         return jsonify({'message': 'Session ID is required'}), 400
     
-    # Get the email from the session ID
-    email = get_email_from_session_id(session_id)
+    # Get the user from the session ID
+    session_user = get_user_from_session_id(session_id)
+    email = session_user['email'] if session_user else None
 
     # Check if the user is a demo user
     if email == 'demo':
         return jsonify({'message': 'Demo user cannot update expenses'}), 400
     
-    # Get the user from the email
-    user = users_collection.find_one({'email': email})
-    if not user:
-        logger.warning(f"User not found during category update | email={email}")
+    # Check if the user was found
+    if not session_user:
+        logger.warning(f"User not found during category update | session_id={session_id}")
         return jsonify({'message': 'User not found'}), 404
+    user_id = session_user['user_id']
     
     # Check if data is None (missing JSON)
     if data is None:
@@ -502,7 +1000,7 @@ def handle_update_expense_category(data, session_id):
     
     # Get the current category of the expense
     existing_expense = expenses_collection.find_one({
-        'user_id': user['_id'],
+        'user_id': user_id,
         'serial_number': serial_number
     })
 
@@ -517,23 +1015,32 @@ def handle_update_expense_category(data, session_id):
     if new_category not in categories or new_category == existing_expense.get('category'):
         return jsonify({'message': 'Invalid category'}), 400
 
-    # Update the category of the expense
+    # Update the category of the expense (only if it still has the category the client saw)
+    # The returned document is the expense before the update, so the rollups move it from the category it really had
     try:
-        result = expenses_collection.update_one({
-            'user_id': user['_id'],
-            'serial_number': serial_number
+        existing_expense = expenses_collection.find_one_and_update({
+            'user_id': user_id,
+            'serial_number': serial_number,
+            'category': current_category_client
         }, {
             '$set': {
                 'category': new_category
+            },
+            # A category chosen by the user is final (the background classifier will not overwrite it)
+            '$unset': {
+                'category_pending': ''
             }
-        })
+        }, projection={'user_id': 1, 'date': 1, 'category': 1, 'amount_ils': 1, 'amount_usd': 1, 'title': 1, 'serial_number': 1})
     except Exception as e:
         logger.error(f"Failed to update expense category | serial_number={serial_number} | email={email} | error={str(e)}")
         return jsonify({'message': 'Failed to update category'}), 500
 
-    # Check if the expense was found
-    if result.matched_count == 0:
-        return jsonify({'message': 'Expense not found'}), 404
+    # Check if the expense changed (or was deleted) since it was read
+    if not existing_expense:
+        return jsonify({'message': 'Category is already updated'}), 400
+
+    # Move the expense to the new category in the monthly totals of the dashboard
+    rollups.move_expense_category(existing_expense, new_category)
     
     # Get the title of the expense
     expense_title = existing_expense.get('title')
@@ -551,12 +1058,12 @@ def handle_update_expense_category(data, session_id):
     except Exception as e:
         logger.error(f"Failed to insert feedback to MongoDB | expense_title={expense_title} | new_category={new_category} | error={str(e)}")
 
-    # delete cache for the month and year of this expense
+    # Update the category in the cached month of this expense
     try:
         expense_date = datetime.strptime(existing_expense.get('date'), '%Y-%m-%d').date()
-        cache.delete_user_expenses_cache(email, expense_date.month, expense_date.year)
+        cache.update_cached_expense_category(email, expense_date.month, expense_date.year, existing_expense.get('serial_number'), new_category)
     except Exception as cache_error:
-        logger.warning(f"Failed to delete cache after updating expense category | serial_number={serial_number} | email={email} | error={str(cache_error)}")
+        logger.warning(f"Failed to update cache after updating expense category | serial_number={serial_number} | email={email} | error={str(cache_error)}")
 
     logger.info(f"Expense category updated | serial_number={serial_number} | old_category={existing_expense.get('category')} | new_category={new_category} | email={email}")
     return jsonify({'message': 'Category updated', 'new_category': new_category}), 200
@@ -572,18 +1079,19 @@ def handle_delete_expense(data, session_id):
     if not session_id or str(session_id).strip().lower() in {"", "none", "null", "undefined"}:
         return jsonify({'message': 'Session ID is required'}), 400
     
-    # Get the email from the session ID
-    email = get_email_from_session_id(session_id)
+    # Get the user from the session ID
+    session_user = get_user_from_session_id(session_id)
+    email = session_user['email'] if session_user else None
 
     # Check if the user is a demo user
     if email == 'demo':
         return jsonify({'message': 'Demo user cannot delete expenses'}), 400
     
-    # Get the user from the email
-    user = users_collection.find_one({'email': email})
-    if not user:
-        logger.warning(f"User not found during expense deletion | email={email}")
+    # Check if the user was found
+    if not session_user:
+        logger.warning(f"User not found during expense deletion | session_id={session_id}")
         return jsonify({'message': 'User not found'}), 404
+    user_id = session_user['user_id']
     
     # Check if data is None (missing JSON)
     if data is None:
@@ -594,35 +1102,30 @@ def handle_delete_expense(data, session_id):
     if serial_number is None or serial_number == '':
         return jsonify({'message': 'Serial number is required'}), 400
     
-    # Check if the expense exists for this user first
-    existing_expense = expenses_collection.find_one({
-        'user_id': user['_id'],
-        'serial_number': serial_number
-    })
-    
-    if not existing_expense:
-        return jsonify({'message': 'Expense not found'}), 404
-    
     # Delete the expense
+    # The returned document is the expense as it was deleted, so the rollups remove it from the category it really had
     try:
-        result = expenses_collection.delete_one({
-            'user_id': user['_id'],
+        existing_expense = expenses_collection.find_one_and_delete({
+            'user_id': user_id,
             'serial_number': serial_number
-        })
+        }, projection={'user_id': 1, 'date': 1, 'category': 1, 'amount_ils': 1, 'amount_usd': 1, 'serial_number': 1})
     except Exception as e:
         logger.error(f"Failed to delete expense | serial_number={serial_number} | email={email} | error={str(e)}")
         return jsonify({'message': 'Failed to delete expense'}), 500
     
     # Check if the expense was found
-    if result.deleted_count == 0:
+    if not existing_expense:
         return jsonify({'message': 'Expense not found'}), 404
+
+    # Remove the expense from the monthly totals of the dashboard
+    rollups.add_expenses_to_rollups([existing_expense], sign=-1)
     
-    # delete cache for the month and year of this expense
+    # Remove the expense from the cached month of this expense
     try:
         expense_date = datetime.strptime(existing_expense.get('date'), '%Y-%m-%d').date()
-        cache.delete_user_expenses_cache(email, expense_date.month, expense_date.year)
+        cache.remove_from_cached_user_expenses(email, expense_date.month, expense_date.year, existing_expense.get('serial_number'))
     except Exception as cache_error:
-        logger.warning(f"Failed to delete cache after deleting expense | serial_number={serial_number} | email={email} | error={str(cache_error)}")
+        logger.warning(f"Failed to update cache after deleting expense | serial_number={serial_number} | email={email} | error={str(cache_error)}")
 
     logger.info(f"Expense deleted | serial_number={serial_number} | email={email}")
     return jsonify({'message': 'Expense deleted', 'serial_number': serial_number}), 200
\ No newline at end of file
@@ -0,0 +1,333 @@
+# FinBrain Project - logicimport.py - MIT License (c) 2025 Nadav Eshed
+
+
+import os
+import csv
+import json
+import time
+import uuid
+import logging
+import tempfile
+import threading
+from itertools import islice
+from flask import jsonify
+from pymongo.errors import BulkWriteError
+from db import expenses_collection
+from db import cache
+from db import counters
+from db import monthkeys
+from db import rollups
+from db.cache import r
+from services.logicconnection import get_user_from_session_id, get_now_utc
+import services.logicexpenses as logic_expenses
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Rows validated, classified and inserted together (memory use depends on this, not on the file size)
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '500'))
+# Largest accepted upload (bytes)
+IMPORT_MAX_FILE_BYTES = int(os.getenv('IMPORT_MAX_FILE_BYTES', str(20 * 1024 * 1024)))
+# Only the first row errors are kept in the job status (all of them are counted)
+IMPORT_MAX_REPORTED_ERRORS = 50
+# How long the job status is kept after the last update (seconds)
+IMPORT_JOB_TTL_SECONDS = 86400
+# A running job writes heartbeat_at this often (seconds), also while a slow chunk is being imported
+IMPORT_HEARTBEAT_SECONDS = 15
+# A running job without a heartbeat for this long died with its worker (restart, crash) and is reported as failed
+IMPORT_HEARTBEAT_TIMEOUT_SECONDS = 60
+# Retry-After of an import status that cannot be read right now (seconds)
+IMPORT_STATUS_RETRY_AFTER_SECONDS = 5
+# Column names of the CSV file (currency is optional, the form field is used when it is missing)
+IMPORT_COLUMNS = ('title', 'date', 'amount', 'currency')
+
+
+def get_import_job_key(job_id):
+    """
+    Get the key of the import job status hash
+    """
+    return f"import_job:{job_id}"
+
+
+def save_import_progress(job_id, **fields):
+    """
+    Update the status hash of an import job (a failure only loses progress reporting, not the import)
+    """
+    try:
+        r.hset(get_import_job_key(job_id), mapping={key: str(value) for key, value in fields.items()})
+        r.expire(get_import_job_key(job_id), IMPORT_JOB_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Failed to save import progress | job_id={job_id} | error={str(e)}")
+
+
+def run_import_heartbeat(job_id, stop_event):
+    """
+    Write the heartbeat of a running job every IMPORT_HEARTBEAT_SECONDS until stop_event is set
+    """
+    while not stop_event.wait(IMPORT_HEARTBEAT_SECONDS):
+        save_import_progress(job_id, heartbeat_at=time.time())
+
+
+def read_chunks(path, default_currency):
+    """
+    Read the CSV file lazily and yield lists of at most IMPORT_CHUNK_SIZE (line_number, row) pairs
+    Column names are matched case-insensitively
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [column.strip().lower() for column in next(reader, [])]
+        missing = [column for column in IMPORT_COLUMNS[:3] if column not in header]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        positions = {column: header.index(column) for column in IMPORT_COLUMNS if column in header}
+
+        def parse(values):
+            row = {column: (values[position].strip() if position < len(values) else '') for column, position in positions.items()}
+            row.setdefault('currency', default_currency)
+            row['currency'] = (row['currency'] or default_currency).upper()
+            return reader.line_num, row
+
+        # Blank lines are skipped, rows are only read when the next chunk is needed
+        rows = (parse(values) for values in reader if any(values))
+        while True:
+            chunk = list(islice(rows, IMPORT_CHUNK_SIZE))
+            if not chunk:
+                return
+            yield chunk
+
+
+def import_chunk(chunk, user_id, rates, touched_months):
+    """
+    Validate, convert, classify and insert one chunk of rows
+    Returns (added, errors) where errors is a list of {line, message}
+    """
+    errors = []
+    ready_rows = []
+    for line, row in chunk:
+        expense, error = logic_expenses.validate_expense_fields(row)
+        if error:
+            errors.append({'line': line, 'message': error})
+            continue
+        # Each date's rate is fetched once per import
+        if expense['date'] not in rates:
+            rates[expense['date']] = logic_expenses.get_usd_to_ils_rate(expense['date'])
+        if rates[expense['date']] is None:
+            errors.append({'line': line, 'message': 'Failed to get exchange rate'})
+            continue
+        ready_rows.append((line, expense))
+
+    if not ready_rows:
+        return 0, errors
+
+    # Classify the whole chunk with one model call and insert it with one unordered bulk insert
+    chunk_categories = logic_expenses.classify_expenses([expense['title'] for _, expense in ready_rows])
+    first_serial_number = counters.reserve_serial_numbers(user_id, len(ready_rows))
+    docs = []
+    for offset, ((_, expense), category) in enumerate(zip(ready_rows, chunk_categories)):
+        amount_usd, amount_ils = logic_expenses.convert_amount(expense['amount'], expense['currency'], rates[expense['date']])
+        docs.append({
+            "user_id": user_id,
+            "title": expense['title'],
+            "date": expense['date'].isoformat(),
+            "month_key": monthkeys.get_month_key(expense['date']),
+            "amount_usd": amount_usd,
+            "amount_ils": amount_ils,
+            "category": category,
+            "serial_number": first_serial_number + offset
+        })
+        touched_months.add((expense['date'].year, expense['date'].month))
+    try:
+        expenses_collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # Unordered - every row except the failed ones was still inserted
+        write_errors = e.details.get('writeErrors', [])
+        failed_indexes = {write_error['index'] for write_error in write_errors}
+        for write_error in write_errors:
+            errors.append({'line': ready_rows[write_error['index']][0], 'message': 'Failed to add expense'})
+        rollups.add_expenses_to_rollups([doc for index, doc in enumerate(docs) if index not in failed_indexes])
+        return len(docs) - len(write_errors), errors
+    # Add the chunk to the monthly totals of the dashboard
+    rollups.add_expenses_to_rollups(docs)
+    return len(docs), errors
+
+
+def delete_imported_months_cache(email, months):
+    """
+    Delete the cache of each month that got new expenses (this also bumps the data generation and the month ETags)
+    The set is emptied, so it can collect the months of the next chunk
+    """
+    for year, month in sorted(months):
+        try:
+            cache.delete_user_expenses_cache(email, month, year)
+        except Exception as cache_error:
+            logger.warning(f"Failed to delete cache after import | month={month} | year={year} | email={email} | error={str(cache_error)}")
+    months.clear()
+
+
+def run_import_job(job_id, path, session_user, default_currency='ILS'):
+    """
+    Import the CSV file chunk by chunk, saving progress after every chunk and a summary at the end
+    The file is deleted when the job ends
+    """
+    email = session_user['email']
+    rows_read = added = failed = 0
+    reported_errors = []
+    # Both stay small: one entry per distinct date / month (of the file, of the chunk)
+    rates = {}
+    chunk_months = set()
+
+    # Show the job is alive while it runs (a job whose worker dies stops beating and is reported as failed)
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=run_import_heartbeat, args=(job_id, stop_heartbeat), daemon=True).start()
+
+    try:
+        for chunk in read_chunks(path, default_currency):
+            chunk_added, chunk_errors = import_chunk(chunk, session_user['user_id'], rates, chunk_months)
+            # The chunk is committed - reads of its months must not keep serving the cached month (or its ETag)
+            delete_imported_months_cache(email, chunk_months)
+            rows_read += len(chunk)
+            added += chunk_added
+            failed += len(chunk) - chunk_added
+            reported_errors.extend(chunk_errors[:IMPORT_MAX_REPORTED_ERRORS - len(reported_errors)])
+            save_import_progress(job_id, status='running', rows_read=rows_read, added=added, failed=failed, heartbeat_at=time.time())
+        status = 'done'
+    except (ValueError, csv.Error) as e:
+        # Bad file (missing columns or not a CSV)
+        logger.warning(f"Import rejected | job_id={job_id} | email={email} | error={str(e)}")
+        reported_errors.append({'line': 1, 'message': str(e)})
+        status = 'failed'
+    except Exception as e:
+        logger.exception(f"Import failed | job_id={job_id} | email={email} | error={str(e)}")
+        status = 'failed'
+    finally:
+        stop_heartbeat.set()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # A chunk that failed part way may still have inserted some of its rows
+    delete_imported_months_cache(email, chunk_months)
+
+    save_import_progress(
+        job_id, status=status, rows_read=rows_read, added=added, failed=failed,
+        errors=json.dumps(reported_errors), finished_at=get_now_utc().isoformat()
+    )
+    logger.info(f"Import finished | job_id={job_id} | email={email} | status={status} | rows_read={rows_read} | added={added} | failed={failed}")
+
+
+def save_upload(file_storage):
+    """
+    Copy the uploaded file to a temporary file in fixed-size blocks
+    Returns the path, or None if the file is larger than IMPORT_MAX_FILE_BYTES
+    """
+    fd, path = tempfile.mkstemp(prefix='finbrain_import_', suffix='.csv')
+    size = 0
+    with os.fdopen(fd, 'wb') as f:
+        while True:
+            block = file_storage.stream.read(64 * 1024)
+            if not block:
+                return path
+            size += len(block)
+            if size > IMPORT_MAX_FILE_BYTES:
+                break
+            f.write(block)
+    os.remove(path)
+    return None
+
+
+def handle_import_expenses(file_storage, session_id, default_currency='ILS'):
+    """
+    This function is called when the user uploads a bank statement (CSV with title, date, amount and currency columns)
+    It saves the file and imports it in a background thread, returning the job ID to poll with handle_import_status
+    """
+    # Check if session ID is valid (handle common "null" strings)
+    if not session_id or str(session_id).strip().lower() in {"", "none", "null", "undefined"}:
+        return jsonify({'message': 'Session ID is required'}), 400
+
+    # Get the user (email and user_id) from the session ID
+    session_user = get_user_from_session_id(session_id)
+    if not session_user:
+        logger.warning(f"Unauthorized access attempt | session_id={session_id}")
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    # Check if the user is a demo user
+    if session_user['email'] == 'demo':
+        return jsonify({'message': 'Demo user cannot add expenses'}), 400
+
+    # Check the file and the default currency
+    if file_storage is None or not file_storage.filename:
+        return jsonify({'message': 'File is required'}), 400
+    default_currency = (default_currency or 'ILS').upper()
+    if default_currency not in ('USD', 'ILS'):
+        return jsonify({'message': 'Invalid currency'}), 400
+
+    path = save_upload(file_storage)
+    if path is None:
+        return jsonify({'message': f'File must be smaller than {IMPORT_MAX_FILE_BYTES // (1024 * 1024)} MB'}), 413
+
+    # Start the job
+    job_id = uuid.uuid4().hex
+    save_import_progress(
+        job_id, status='running', email=session_user['email'], rows_read=0, added=0, failed=0,
+        started_at=get_now_utc().isoformat(), heartbeat_at=time.time()
+    )
+    threading.Thread(target=run_import_job, args=(job_id, path, session_user, default_currency), daemon=True).start()
+
+    logger.info(f"Import started | job_id={job_id} | email={session_user['email']} | filename={file_storage.filename}")
+    return jsonify({'message': 'Import started', 'job_id': job_id}), 202
+
+
+def is_import_heartbeat_stale(job):
+    """
+    Check if a job status hash has no heartbeat newer than IMPORT_HEARTBEAT_TIMEOUT_SECONDS
+    """
+    try:
+        heartbeat_at = float(job.get('heartbeat_at', 0))
+    except ValueError:
+        heartbeat_at = 0
+    return time.time() - heartbeat_at > IMPORT_HEARTBEAT_TIMEOUT_SECONDS
+
+
+def handle_import_status(job_id, session_id):
+    """
+    This function is called when the user wants to know the progress of an import
+    It returns the counts so far, and the errors once the job has finished
+    """
+    # Check if session ID is valid (handle common "null" strings)
+    if not session_id or str(session_id).strip().lower() in {"", "none", "null", "undefined"}:
+        return jsonify({'message': 'Session ID is required'}), 400
+
+    # Get the user (email and user_id) from the session ID
+    session_user = get_user_from_session_id(session_id)
+    if not session_user:
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    # Only the user who started the job can see it
+    try:
+        job = r.hgetall(get_import_job_key(job_id)) if job_id else {}
+    except Exception as e:
+        logger.error(f"Failed to read import status | job_id={job_id} | email={session_user['email']} | error={str(e)}")
+        return jsonify({'message': 'Import status is unavailable, please try again'}), 503, {'Retry-After': str(IMPORT_STATUS_RETRY_AFTER_SECONDS)}
+    if not job or job.get('email') != session_user['email']:
+        return jsonify({'message': 'Import not found'}), 404
+
+    # A running job that stopped beating died with its worker - it will never finish
+    status = job.get('status')
+    errors = json.loads(job.get('errors', '[]'))
+    if status == 'running' and is_import_heartbeat_stale(job):
+        logger.warning(f"Import job stopped without finishing | job_id={job_id} | email={session_user['email']} | heartbeat_at={job.get('heartbeat_at')}")
+        status = 'failed'
+        errors.append({'line': None, 'message': 'Import stopped before it finished, please upload the file again'})
+
+    return jsonify({
+        'job_id': job_id,
+        'status': status,
+        'rows_read': int(job.get('rows_read', 0)),
+        'added': int(job.get('added', 0)),
+        'failed': int(job.get('failed', 0)),
+        'errors': errors,
+        'started_at': job.get('started_at'),
+        'finished_at': job.get('finished_at')
+    }), 200
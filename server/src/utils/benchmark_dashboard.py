@@ -0,0 +1,154 @@
+# FinBrain Project - benchmark_dashboard.py - MIT License (c) 2025 Nadav Eshed
+
+
+# Compare the dashboard charts computed in MongoDB ($match/$group) with the previous Python loop over every expense.
+# Seeds a throwaway user with many expenses in the configured database, checks both paths return the same JSON,
+# prints the median time of each and removes the expenses again. Usage (from server/src):
+#   python -m utils.benchmark_dashboard --expenses 100000
+# Run it against a real MongoDB (mongomock runs aggregations in Python, so its timings mean nothing).
+import argparse
+import json
+import logging
+import random
+import statistics
+import time
+from bson import ObjectId
+from db import expenses_collection
+from db import monthkeys
+import services.logicexpenses as logic_expenses
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Expenses inserted per insert_many while seeding
+SEED_BATCH_SIZE = 5000
+
+
+def category_breakdown_in_python(months_filter, user_id, currency):
+    """
+    The category breakdown as it was computed before the aggregation (every expense summed in Python)
+    """
+    categories_totals = {category: 0 for category in logic_expenses.categories}
+    amount_key = 'amount_usd' if currency == 'USD' else 'amount_ils'
+    for expense in expenses_collection.find({'user_id': user_id, **months_filter}):
+        category = expense.get('category', 'Other')
+        if category not in categories_totals:
+            category = 'Other'
+        categories_totals[category] += expense.get(amount_key, 0)
+    total_amount = sum(categories_totals.values())
+    return [{
+        'category': category,
+        'amount': round(amount, 2),
+        'percentage': round((amount / total_amount) * 100 if total_amount > 0 else 0, 2)
+    } for category, amount in categories_totals.items()]
+
+
+def monthly_comparison_in_python(months_filter, user_id, currency, categories, months):
+    """
+    The monthly comparison as it was computed before the aggregation (every expense summed in Python)
+    """
+    query = {'user_id': user_id, **months_filter}
+    if 'All' not in categories:
+        query['category'] = {'$in': categories}
+    monthly_comparison = {month: 0 for month in months}
+    amount_key = 'amount_usd' if currency == 'USD' else 'amount_ils'
+    for expense in expenses_collection.find(query):
+        monthly_comparison[expense['date'][:7]] += expense[amount_key]
+    max_amount = max(monthly_comparison.values()) if monthly_comparison else 0
+    return [{
+        'month': month,
+        'amount': round(amount, 2),
+        'percentage': round((amount / max_amount) * 100 if max_amount > 0 else 0, 2)
+    } for month, amount in monthly_comparison.items()]
+
+
+def seed_expenses(user_id, count, months, seed=42):
+    """
+    Insert count random expenses for user_id, spread over the given months and all categories
+    """
+    rng = random.Random(seed)
+    docs = []
+    for serial_number in range(1, count + 1):
+        month = rng.choice(months)
+        amount_ils = round(rng.uniform(5, 2000), 2)
+        date = f"{month}-{rng.randint(1, 28):02d}"
+        docs.append({
+            'user_id': user_id,
+            'title': f"Benchmark {serial_number}",
+            'date': date,
+            'month_key': monthkeys.get_month_key(date),
+            'amount_ils': amount_ils,
+            'amount_usd': round(amount_ils / 3.7, 2),
+            'category': rng.choice(logic_expenses.categories),
+            'serial_number': serial_number
+        })
+        if len(docs) == SEED_BATCH_SIZE:
+            expenses_collection.insert_many(docs)
+            docs = []
+    if docs:
+        expenses_collection.insert_many(docs)
+
+
+def measure_ms(function, rounds):
+    """
+    Run function rounds times and return (median milliseconds, last result)
+    """
+    timings = []
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def benchmark_dashboard(expense_count=100000, rounds=5):
+    """
+    Seed a throwaway user, time both paths of both charts and check their JSON is identical
+    Returns a list of {chart, python_ms, aggregation_ms, identical}
+    """
+    user_id = ObjectId()
+    months = [f"2025-{month:02d}" for month in range(1, 13)]
+    months_filter = logic_expenses.get_months_filter(months)
+    categories = ['Food & Drinks', 'Transportation', 'Leisure & Gifts']
+    cases = [
+        ('category_breakdown',
+         lambda: category_breakdown_in_python(months_filter, user_id, 'ILS'),
+         lambda: logic_expenses.handle_category_breakdown(months_filter, user_id, 'ILS', months)),
+        ('monthly_comparison (All)',
+         lambda: monthly_comparison_in_python(months_filter, user_id, 'USD', ['All'], months),
+         lambda: logic_expenses.handle_monthly_comparison(months_filter, user_id, 'USD', ['All'], months)),
+        ('monthly_comparison (3 categories)',
+         lambda: monthly_comparison_in_python(months_filter, user_id, 'ILS', categories, months),
+         lambda: logic_expenses.handle_monthly_comparison(months_filter, user_id, 'ILS', categories, months)),
+    ]
+
+    logger.info(f"Seeding benchmark expenses | user_id={user_id} | count={expense_count}")
+    seed_expenses(user_id, expense_count, months)
+    results = []
+    try:
+        for chart, python_path, aggregation_path in cases:
+            python_ms, python_result = measure_ms(python_path, rounds)
+            aggregation_ms, aggregation_result = measure_ms(aggregation_path, rounds)
+            results.append({
+                'chart': chart,
+                'python_ms': round(python_ms, 1),
+                'aggregation_ms': round(aggregation_ms, 1),
+                # Same JSON text means the same response body
+                'identical': json.dumps(python_result) == json.dumps(aggregation_result)
+            })
+    finally:
+        expenses_collection.delete_many({'user_id': user_id})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the dashboard aggregation with the previous Python loop")
+    parser.add_argument("--expenses", type=int, default=100000, help="Expenses of the benchmark user (default 100000)")
+    parser.add_argument("--rounds", type=int, default=5, help="Runs of each path, the median is reported (default 5)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    for row in benchmark_dashboard(args.expenses, args.rounds):
+        print(f"{row['chart']:<36} python={row['python_ms']:>9.1f} ms | aggregation={row['aggregation_ms']:>9.1f} ms | identical={row['identical']}")
@@ -0,0 +1,119 @@
+# FinBrain Project - benchmark_json.py - MIT License (c) 2025 Nadav Eshed
+
+
+# Compare the three ways a cached month of expenses can become the /get_expenses response body:
+# json.loads + Flask's default provider (before), orjson.loads + OrjsonProvider, and the cached JSON spliced in as it is.
+# With --encodings it measures the cache encodings instead (size, bytes saved, encode and decode time of each).
+# Runs in memory only (no MongoDB or Redis). Usage (from server/src):
+#   python -m utils.benchmark_json --sizes 50 500 5000
+#   python -m utils.benchmark_json --encodings
+import argparse
+import json
+import random
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from utils import jsonprovider
+from utils.jsonprovider import OrjsonProvider
+from utils.benchmark_dashboard import measure_ms
+from db import cachecodec
+import services.logicexpenses as logic_expenses
+
+
+# Month sizes measured by default (expenses per cached month)
+DEFAULT_SIZES = [50, 500, 5000]
+
+
+def make_cached_month(size, seed=42):
+    """
+    Get the cached JSON text of a month with size random expenses (the format add_to_cache_user_expenses writes)
+    """
+    rng = random.Random(seed)
+    titles = ['Coffee', 'Groceries', 'Bus ticket', 'Rent', 'קפה', 'Books', 'Gift']
+    expenses = []
+    for serial_number in range(1, size + 1):
+        amount_ils = round(rng.uniform(5, 2000), 2)
+        expenses.append({
+            '_id': str(ObjectId()),
+            'title': rng.choice(titles),
+            'date': f"2025-01-{rng.randint(1, 28):02d}",
+            'month_key': 202501,
+            'amount_ils': amount_ils,
+            'amount_usd': round(amount_ils / 3.7, 2),
+            'category': rng.choice(logic_expenses.categories),
+            'serial_number': serial_number
+        })
+    return jsonprovider.dumps_compact(expenses)
+
+
+def benchmark_json(sizes=DEFAULT_SIZES, rounds=50):
+    """
+    Time the three ways to build the response of each month size and check they return the same JSON
+    Returns a list of {size, bytes, stdlib_ms, orjson_ms, raw_ms, identical}
+    """
+    app = Flask(__name__)
+    default_provider = DefaultJSONProvider(app)
+    orjson_provider = OrjsonProvider(app)
+
+    results = []
+    with app.app_context():
+        for size in sizes:
+            cached = make_cached_month(size)
+            stdlib_ms, stdlib_response = measure_ms(lambda: default_provider.response({'expenses': json.loads(cached)}), rounds)
+            orjson_ms, orjson_response = measure_ms(lambda: orjson_provider.response({'expenses': orjson_provider.loads(cached)}), rounds)
+            raw_ms, raw_response = measure_ms(lambda: logic_expenses.get_json_text_response(f'{{"expenses":{cached}}}'), rounds)
+            bodies = [json.loads(response.get_data()) for response in (stdlib_response, orjson_response, raw_response)]
+            results.append({
+                'size': size,
+                'bytes': len(cached.encode()),
+                'stdlib_ms': round(stdlib_ms, 3),
+                'orjson_ms': round(orjson_ms, 3),
+                'raw_ms': round(raw_ms, 3),
+                # Same decoded body means the client sees the same expenses
+                'identical': bodies[0] == bodies[1] == bodies[2]
+            })
+    return results
+
+
+def benchmark_cache_encodings(sizes=DEFAULT_SIZES, rounds=50, encodings=('json', 'zlib', 'zstd')):
+    """
+    Encode and decode a cached month of each size in every encoding and check the JSON comes back the same
+    zstd is skipped when the zstandard package is not installed
+    Returns a list of {size, encoding, json_bytes, stored_bytes, saved_bytes, encode_ms, decode_ms, identical}
+    """
+    results = []
+    for size in sizes:
+        cached = make_cached_month(size)
+        json_bytes = len(cached.encode())
+        for encoding in encodings:
+            if encoding == 'zstd' and cachecodec.zstandard is None:
+                continue
+            encode_ms, value = measure_ms(lambda: cachecodec.encode_expenses(cached, encoding), rounds)
+            decode_ms, decoded = measure_ms(lambda: cachecodec.decode_expenses(value), rounds)
+            stored_bytes = len(value.encode())
+            results.append({
+                'size': size,
+                'encoding': encoding,
+                'json_bytes': json_bytes,
+                'stored_bytes': stored_bytes,
+                'saved_bytes': json_bytes - stored_bytes,
+                'encode_ms': round(encode_ms, 3),
+                'decode_ms': round(decode_ms, 3),
+                'identical': decoded == cached
+            })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the ways a cached month becomes the /get_expenses response")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Expenses per month (default 50 500 5000)")
+    parser.add_argument("--rounds", type=int, default=50, help="Runs of each way, the median is reported (default 50)")
+    parser.add_argument("--encodings", action="store_true", help="Compare the cache encodings (json, zlib, zstd) instead")
+    args = parser.parse_args()
+
+    if args.encodings:
+        for row in benchmark_cache_encodings(args.sizes, args.rounds):
+            print(f"{row['size']:>6} expenses | {row['encoding']:<4} | stored={row['stored_bytes']:>8} bytes | saved={row['saved_bytes']:>8} bytes | encode={row['encode_ms']:>8.3f} ms | decode={row['decode_ms']:>8.3f} ms | identical={row['identical']}")
+    else:
+        for row in benchmark_json(args.sizes, args.rounds):
+            print(f"{row['size']:>6} expenses ({row['bytes']:>8} bytes) | stdlib={row['stdlib_ms']:>8.3f} ms | orjson={row['orjson_ms']:>8.3f} ms | raw={row['raw_ms']:>8.3f} ms | identical={row['identical']}")
@@ -0,0 +1,83 @@
+# FinBrain Project - calibrate_argon2.py - MIT License (c) 2025 Nadav Eshed
+
+
+# Benchmark argon2 on this machine and pick the strongest settings that still verify a password
+# within the target time. Usage (from server/src):
+#   python -m utils.calibrate_argon2 --target-ms 250
+# The printed ARGON2_* values go into the environment of the backend.
+import argparse
+import logging
+import statistics
+import time
+from argon2 import PasswordHasher
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Memory costs to try (KiB) - 19MB is the OWASP minimum for argon2id, 256MB the most we would give one login
+MEMORY_COST_CANDIDATES = [19456, 32768, 65536, 131072, 262144]
+# Highest time cost to try
+MAX_TIME_COST = 10
+
+
+def measure_verify_seconds(time_cost, memory_cost, parallelism, rounds=3):
+    """
+    Measure the median time (seconds) it takes to verify a password with the given settings
+    """
+    hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    hashed = hasher.hash("calibration-password")
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        hasher.verify(hashed, "calibration-password")
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate_argon2(target_ms=250, parallelism=4, memory_costs=None, max_time_cost=MAX_TIME_COST, rounds=3):
+    """
+    Find the settings with the most work (memory_cost * time_cost) whose verify time stays within target_ms
+    Returns a dict with time_cost, memory_cost, parallelism and the measured verify_ms
+    """
+    target_seconds = target_ms / 1000
+    best = None
+
+    for memory_cost in memory_costs or MEMORY_COST_CANDIDATES:
+        # Raise the time cost until verification gets slower than the target
+        for time_cost in range(1, max_time_cost + 1):
+            seconds = measure_verify_seconds(time_cost, memory_cost, parallelism, rounds)
+            logger.info(f"Argon2 benchmark | time_cost={time_cost} | memory_cost={memory_cost} | verify_ms={seconds * 1000:.1f}")
+            if seconds > target_seconds:
+                break
+            if best is None or memory_cost * time_cost >= best['memory_cost'] * best['time_cost']:
+                best = {
+                    'time_cost': time_cost,
+                    'memory_cost': memory_cost,
+                    'parallelism': parallelism,
+                    'verify_ms': round(seconds * 1000, 1)
+                }
+
+    # Even the cheapest settings are too slow - use them anyway (never go below the minimum)
+    if best is None:
+        memory_cost = min(memory_costs or MEMORY_COST_CANDIDATES)
+        seconds = measure_verify_seconds(1, memory_cost, parallelism, rounds)
+        logger.warning(f"No argon2 settings meet the target | target_ms={target_ms} | fastest_verify_ms={seconds * 1000:.1f}")
+        best = {'time_cost': 1, 'memory_cost': memory_cost, 'parallelism': parallelism, 'verify_ms': round(seconds * 1000, 1)}
+
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick argon2 settings for a target password verify time on this machine")
+    parser.add_argument("--target-ms", type=float, default=250, help="Target verify time in milliseconds (default 250)")
+    parser.add_argument("--parallelism", type=int, default=4, help="Number of lanes/threads per hash (default 4)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    result = calibrate_argon2(target_ms=args.target_ms, parallelism=args.parallelism)
+
+    print(f"# Measured verify time: {result['verify_ms']} ms (target {args.target_ms} ms)")
+    print(f"ARGON2_TIME_COST={result['time_cost']}")
+    print(f"ARGON2_MEMORY_COST={result['memory_cost']}")
+    print(f"ARGON2_PARALLELISM={result['parallelism']}")
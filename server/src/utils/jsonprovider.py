@@ -0,0 +1,55 @@
+# FinBrain Project - jsonprovider.py - MIT License (c) 2025 Nadav Eshed
+
+
+# Flask JSON provider backed by orjson (used by jsonify, request.get_json and the test client)
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+# orjson options of the compact output of the provider (sorted keys, no indent)
+COMPACT_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+
+
+def dumps_compact(obj):
+    """
+    Get the JSON text of obj exactly as the provider writes it in a compact response
+    Cached JSON that is sent as it is must be written with this, so a cache hit sends the same bytes as a miss
+    """
+    return orjson.dumps(obj, default=DefaultJSONProvider.default, option=COMPACT_OPTIONS).decode()
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Same output as Flask's default provider (sorted keys, compact unless debug, HTTP dates for datetimes,
+    the same fallbacks for Decimal, dataclasses and other types), encoded by orjson
+    Non-ASCII text is written as UTF-8 instead of \\u escapes
+    """
+    def get_options(self, indent=False):
+        """
+        Get the orjson options of the provider settings
+        Datetimes and dataclasses go to self.default, so they are written like the default provider writes them
+        """
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        # Arguments only the json module understands (indent, separators...) go to the default provider
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.get_options()).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        # The body stays bytes (no str round trip)
+        body = orjson.dumps(obj, default=self.default, option=self.get_options(indent)) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
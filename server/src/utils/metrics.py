@@ -0,0 +1,48 @@
+# FinBrain Project - metrics.py - MIT License (c) 2025 Nadav Eshed
+
+
+import threading
+
+
+# In-process metrics of this worker (exposed by the /metrics route in app.py)
+_lock = threading.Lock()
+_counters = {}
+_observations = {}
+
+
+def increment(name, amount=1):
+    """
+    Add to a counter (e.g. number of skipped session refreshes)
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name, value):
+    """
+    Record one measurement (e.g. a duration in seconds), keeping count, sum and max
+    """
+    with _lock:
+        stats = _observations.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0})
+        stats['count'] += 1
+        stats['sum'] += value
+        stats['max'] = max(stats['max'], value)
+
+
+def get_counter(name):
+    """
+    Get the current value of a counter (0 if it was never incremented)
+    """
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot():
+    """
+    Get a copy of all counters and observations
+    """
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'observations': {name: dict(stats) for name, stats in _observations.items()}
+        }
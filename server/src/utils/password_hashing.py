@@ -4,53 +4,183 @@
 # type: ignore
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import multiprocessing
+import threading
 import logging
+import time
+import os
+from utils import metrics
 
 
 # Create a logger for this module
 logger = logging.getLogger(__name__)
 
+# Hashing cost settings - defaults can be overridden with the values printed by utils/calibrate_argon2.py
+# Stored hashes remember their own settings, so changing these never breaks existing logins
+# (hashes made with old settings are upgraded on the next successful login)
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', '3'))
+ARGON2_MEMORY_COST = int(os.getenv('ARGON2_MEMORY_COST', '65536'))
+ARGON2_PARALLELISM = int(os.getenv('ARGON2_PARALLELISM', '4'))
+
 # Set up the password hasher with security settings
 # This creates a tool that will turn passwords into scrambled text
 password_hasher = PasswordHasher(
-    time_cost=3, # How many times to repeat the scrambling (more = safer but slower)
-    memory_cost=65536, # How much computer memory to use (64MB - more = safer but slower)
-    parallelism=4, # How many computer cores to use at the same time
+    time_cost=ARGON2_TIME_COST, # How many times to repeat the scrambling (more = safer but slower)
+    memory_cost=ARGON2_MEMORY_COST, # How much computer memory to use (in KiB, default 64MB - more = safer but slower)
+    parallelism=ARGON2_PARALLELISM, # How many computer cores to use at the same time
     hash_len=32, # How long the scrambled password should be (32 characters)
     salt_len=16 # How long the random salt (= unique identifier) should be (16 characters)
 )
 
+# Run hashing in a dedicated, bounded process pool instead of inside the Flask worker
+# POOL_SIZE processes hash at the same time, up to MAX_QUEUE more requests may wait - everything beyond is rejected
+PASSWORD_HASH_POOL_ENABLED = os.getenv('PASSWORD_HASH_POOL_ENABLED', 'false').lower() == 'true'
+PASSWORD_HASH_POOL_SIZE = int(os.getenv('PASSWORD_HASH_POOL_SIZE', '2'))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', '8'))
+PASSWORD_HASH_TIMEOUT_SECONDS = float(os.getenv('PASSWORD_HASH_TIMEOUT_SECONDS', '10'))
+# Seconds the client is told to wait (Retry-After header) when the pool is full
+PASSWORD_HASH_RETRY_AFTER_SECONDS = 1
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when the password hashing pool is full (or too slow), so the request can be rejected quickly
+    """
+
+
+# The pool is created lazily inside each worker process (gunicorn --preload forks after import)
+_pool_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_admission = None
+
+
+def _get_pool():
+    """
+    Get (or create) this process's hashing pool and its admission semaphore
+    """
+    global _pool, _pool_pid, _admission
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn = fresh interpreter, safe even though the Flask worker already runs background threads
+            _pool = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_POOL_SIZE,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _admission = threading.BoundedSemaphore(PASSWORD_HASH_POOL_SIZE + PASSWORD_HASH_MAX_QUEUE)
+            _pool_pid = os.getpid()
+            logger.info(f"Password hashing pool started | pool_size={PASSWORD_HASH_POOL_SIZE} | max_queue={PASSWORD_HASH_MAX_QUEUE}")
+        return _pool, _admission
+
+
+def _hash_job(password):
+    """
+    Hash a password (runs inside the pool), returning (hashed, started_at, duration)
+    """
+    started_at = time.time()
+    hashed = password_hasher.hash(password)
+    return hashed, started_at, time.time() - started_at
+
+
+def _verify_job(password, hashed_password):
+    """
+    Verify a password (runs inside the pool), returning (matches, started_at, duration)
+    """
+    started_at = time.time()
+    try:
+        matches = password_hasher.verify(hashed_password, password)
+    except VerifyMismatchError:
+        matches = False
+    return matches, started_at, time.time() - started_at
+
+
+def _run_job(job, *args):
+    """
+    Run a hashing job in the pool (or inline if the pool is disabled) and record queue wait and hash time
+    Raises PasswordHasherBusy if the pool queue is full or the job takes too long
+    """
+    if not PASSWORD_HASH_POOL_ENABLED:
+        result, _, duration = job(*args)
+        metrics.observe('password_hash_seconds', duration)
+        return result
+
+    pool, admission = _get_pool()
+    # Admission control - reject right away instead of waiting behind a long queue
+    if not admission.acquire(blocking=False):
+        metrics.increment('password_hash_rejected')
+        logger.warning("Password hashing pool is full - rejecting request")
+        raise PasswordHasherBusy()
+
+    submitted_at = time.time()
+    try:
+        future = pool.submit(job, *args)
+    except Exception:
+        admission.release()
+        raise
+    # The slot is freed when the job really finishes (even if we stop waiting for it)
+    future.add_done_callback(lambda _: admission.release())
+
+    try:
+        result, started_at, duration = future.result(timeout=PASSWORD_HASH_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        metrics.increment('password_hash_timeouts')
+        logger.warning(f"Password hashing timed out | timeout={PASSWORD_HASH_TIMEOUT_SECONDS}")
+        raise PasswordHasherBusy()
+
+    metrics.observe('password_hash_queue_wait_seconds', max(0.0, started_at - submitted_at))
+    metrics.observe('password_hash_seconds', duration)
+    return result
+
+
 def hash_password(password):
     """
     Turn a plain text password into a scrambled version that can be safely stored
     """
     try:
         # Use the hasher to turn the plain password into scrambled text
-        hashed = password_hasher.hash(password)
+        hashed = _run_job(_hash_job, password)
         logger.debug("Password hashed successfully")
         # Return the scrambled password
         return hashed
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
         logger.error(f"Failed to hash password | error={str(e)}")
         # Stop the program and show the error
         raise
 
 
+def needs_rehash(hashed_password):
+    """
+    Check if a stored hash was made with different settings than the current ones (and should be upgraded)
+    """
+    try:
+        return password_hasher.check_needs_rehash(hashed_password)
+    except Exception as e:
+        logger.error(f"Failed to check if password needs rehash | error={str(e)}")
+        return False
+
+
 def verify_password(password, hashed_password):
     """
     Check if a plain text password matches a scrambled password from the database
+    Raises PasswordHasherBusy if the hashing pool is full
     """
     try:
         # Check if the plain password matches the scrambled password
-        password_hasher.verify(hashed_password, password)
+        matches = _run_job(_verify_job, password, hashed_password)
+    except PasswordHasherBusy:
+        raise
+    # Something else went wrong
+    except Exception as e:
+        logger.error(f"Password verification failed with error | error={str(e)}")
+        return False
+
+    if matches:
         logger.debug("Password verification successful")
         # Passwords match
         return True
     # Passwords don't match
-    except VerifyMismatchError:
-        logger.debug("Password verification failed - password mismatch")
-        return False
-    # Something else went wrong
-    except Exception as e:
-        logger.error(f"Password verification failed with error | error={str(e)}")
-        return False
\ No newline at end of file
+    logger.debug("Password verification failed - password mismatch")
+    return False
\ No newline at end of file
@@ -0,0 +1,100 @@
+# FinBrain Project - session_tokens.py - MIT License (c) 2025 Nadav Eshed
+
+
+import os
+import hmac
+import json
+import time
+import uuid
+import base64
+import hashlib
+import logging
+
+
+# Create a logger for this module
+logger = logging.getLogger(__name__)
+
+# Session mode: 'opaque' = random session ID looked up in Redis (default), 'signed' = HMAC-signed token
+SESSION_TOKEN_MODE = os.getenv('SESSION_TOKEN_MODE', 'opaque').lower()
+
+# Signed tokens look like "v1.<payload>.<signature>" (opaque session IDs are UUIDs and never start with this)
+TOKEN_PREFIX = 'v1.'
+
+# Get the signing secret from environment (can be a string or path to file, e.g. from AWS Secrets Manager)
+raw_token_secret = os.getenv('SESSION_TOKEN_SECRET')
+if raw_token_secret and os.path.isfile(raw_token_secret):
+    try:
+        with open(raw_token_secret, 'r') as f:
+            SESSION_TOKEN_SECRET = f.read().strip()
+    except Exception as e:
+        raise RuntimeError(f"Failed to read SESSION_TOKEN_SECRET from file: {raw_token_secret}") from e
+else:
+    SESSION_TOKEN_SECRET = raw_token_secret
+
+if SESSION_TOKEN_MODE == 'signed' and not SESSION_TOKEN_SECRET:
+    raise RuntimeError("SESSION_TOKEN_SECRET is not defined. It is required when SESSION_TOKEN_MODE=signed.")
+
+
+def signed_tokens_enabled():
+    """
+    Check if login should issue signed tokens instead of opaque session IDs
+    """
+    return SESSION_TOKEN_MODE == 'signed'
+
+
+def is_signed_token(session_id):
+    """
+    Check if a session ID is a signed token (and not an opaque Redis session ID)
+    """
+    return isinstance(session_id, str) and session_id.startswith(TOKEN_PREFIX)
+
+
+def _b64encode(raw_bytes):
+    return base64.urlsafe_b64encode(raw_bytes).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload_part):
+    digest = hmac.new(SESSION_TOKEN_SECRET.encode('utf-8'), payload_part.encode('ascii'), hashlib.sha256).digest()
+    return _b64encode(digest)
+
+
+def issue_session_token(email, user_id, ttl_seconds, token_id=None, first_name=None):
+    """
+    Create a signed session token for the user that expires after ttl_seconds
+    The token ID (jti) stays the same when a token is renewed, so revoking it revokes every renewal
+    """
+    payload = {
+        'email': email,
+        'uid': str(user_id) if user_id is not None else None,
+        'name': first_name,
+        'exp': int(time.time()) + int(ttl_seconds),
+        'jti': token_id or uuid.uuid4().hex
+    }
+    payload_part = _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    return f"{TOKEN_PREFIX}{payload_part}.{_sign(payload_part)}"
+
+
+def verify_session_token(token, allow_expired=False):
+    """
+    Check the signature (and expiry) of a session token - CPU only, no Redis
+    Returns the payload dict, or None if the token is invalid or expired
+    """
+    if not SESSION_TOKEN_SECRET or not is_signed_token(token):
+        return None
+    try:
+        payload_part, signature = token[len(TOKEN_PREFIX):].split('.')
+        if not hmac.compare_digest(signature, _sign(payload_part)):
+            logger.warning("Session token with invalid signature")
+            return None
+        payload = json.loads(_b64decode(payload_part))
+    except Exception:
+        logger.warning("Malformed session token")
+        return None
+
+    if not allow_expired and payload.get('exp', 0) <= time.time():
+        return None
+    return payload
@@ -5,9 +5,14 @@
 import pytest
 from datetime import timedelta
 import services.logicconnection as lc
+from db import cache
 import time
 
 
+# Tests that count Redis round trips or use Lua scripts / pub-sub only run against Redis
+requires_redis = pytest.mark.skipif(cache.CACHE_BACKEND != 'redis', reason="Needs the Redis cache backend")
+
+
 # Clean Redis sessions before each test
 @pytest.fixture(autouse=True)
 def clean_sessions():
@@ -252,6 +257,27 @@ def test_get_email_from_session_id_session_with_empty_email():
     assert lc.r.exists(f"session:{session_id}")
 
 
+@requires_redis
+def test_get_email_from_session_id_single_redis_call():
+    """
+    Test that resolving a session and sliding its TTL takes exactly one Redis round trip
+    """
+    # Create session ID and email and store it in Redis with a short TTL
+    session_id = "one_round_trip"
+    email = "fast@test.com"
+    lc.r.hset(f"session:{session_id}", "email", email)
+    lc.r.expire(f"session:{session_id}", 10)
+
+    # Resolve the session and count the Redis commands
+    cache.reset_redis_call_count()
+    assert lc.get_email_from_session_id(session_id) == email
+    assert cache.get_redis_call_count() == 1
+
+    # Check if the TTL and timestamp were refreshed
+    assert lc.r.ttl(f"session:{session_id}") == lc.SESSION_TTL_SECONDS
+    assert lc.r.hget(f"session:{session_id}", "last_seen") is not None
+
+
 def test_pass():
     """
     Test that the test passes (to clean up the test database)
@@ -6,9 +6,14 @@ import pytest
 from datetime import timedelta
 import services.logicconnection as lc
 from app import app
+from db import cache
 import time
 
 
+# Tests that count Redis round trips or use Lua scripts / pub-sub only run against Redis
+requires_redis = pytest.mark.skipif(cache.CACHE_BACKEND != 'redis', reason="Needs the Redis cache backend")
+
+
 # Clean Redis sessions before each test
 @pytest.fixture(autouse=True)
 def clean_sessions():
@@ -268,6 +273,27 @@ def test_heartbeat_session_ttl_is_refreshed():
     assert new_ttl > initial_ttl
 
 
+@requires_redis
+def test_heartbeat_reports_redis_calls():
+    """
+    Test that heartbeat makes a single Redis round trip and reports it in the X-Redis-Calls header
+    """
+    # Create session ID and email and store it in Redis
+    session_id = "redis_calls_test"
+    lc.r.hset(f"session:{session_id}", "email", "test@user.com")
+    lc.r.expire(f"session:{session_id}", lc.SESSION_TTL_SECONDS)
+
+    # Create a test client
+    client = app.test_client()
+
+    # Send a POST request to the heartbeat route and get the response
+    response = client.post('/heartbeat', headers={'Session-ID': session_id})
+
+    # Check if the response is successful and only one Redis call was made
+    assert response.status_code == 200
+    assert response.headers['X-Redis-Calls'] == '1'
+
+
 def test_pass():
     """
     Test that the test passes (to clean up the test database)
@@ -5,7 +5,10 @@
 from app import app
 from db import users_collection, db
 import pytest
-from utils.password_hashing import hash_password
+from utils.password_hashing import hash_password, verify_password
+from argon2 import PasswordHasher
+import services.logicconnection as lc
+from unittest.mock import patch
 
 
 # Clean the users collection before each test
@@ -341,6 +344,68 @@ def test_login_handles_database_error():
     users_collection.find_one = original_find_one
 
 
+def test_login_stores_user_in_session():
+    """
+    Test that login stores the user_id and first name in the session
+    so later requests do not need to look up the user again
+    """
+    # Create a test client
+    client = app.test_client()
+
+    # Insert a test user into the database
+    insert_test_user()
+    user = users_collection.find_one({"email": "user@login.com"})
+
+    # Send a POST request to the login route and get the response
+    response = client.post('/login', json={"email": "user@login.com", "password": "Secret123"})
+    session_id = response.get_json()['session_id']
+
+    # Check if the session holds the user identity
+    session_data = lc.r.hgetall(f"session:{session_id}")
+    assert session_data['email'] == "user@login.com"
+    assert session_data['user_id'] == str(user['_id'])
+    assert session_data['first_name'] == "User"
+
+    # Check if the session user is resolved without querying the users collection
+    with patch('services.logicconnection.users_collection.find_one') as mock_find_one:
+        session_user = lc.get_user_from_session_id(session_id)
+    mock_find_one.assert_not_called()
+    assert session_user['user_id'] == user['_id']
+    assert session_user['first_name'] == "User"
+
+
+def test_login_upgrades_old_password_hash():
+    """
+    Test that logging in with a hash made with old settings upgrades the stored hash in the background
+    """
+    # Insert a user whose password was hashed with weaker settings
+    old_hash = PasswordHasher(time_cost=1, memory_cost=8192, parallelism=1).hash("Secret123")
+    users_collection.insert_one({
+        "firstName": "Old",
+        "lastName": "Hash",
+        "email": "old@hash.com",
+        "password": old_hash,
+    })
+
+    # Log in and wait for the background rehash to finish
+    rehash_threads = []
+    def track_rehash(*args):
+        rehash_threads.append(original_schedule(*args))
+        return rehash_threads[-1]
+    original_schedule = lc.schedule_password_rehash
+    with patch('services.logicconnection.schedule_password_rehash', side_effect=track_rehash):
+        client = app.test_client()
+        response = client.post('/login', json={"email": "old@hash.com", "password": "Secret123"})
+    assert response.status_code == 200
+    assert len(rehash_threads) == 1
+    rehash_threads[0].join(timeout=10)
+
+    # Check if the stored hash was upgraded and still verifies
+    new_hash = users_collection.find_one({"email": "old@hash.com"})["password"]
+    assert new_hash != old_hash
+    assert verify_password("Secret123", new_hash) is True
+
+
 def test_pass():
     """
     Test that the test passes (to clean up the test database)
@@ -0,0 +1,188 @@
+# FinBrain Project - test_login_throttle.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+import pytest
+from unittest.mock import patch
+from app import app
+from db import users_collection, db
+from db import ratelimit
+import services.logicconnection as lc
+from utils.password_hashing import hash_password
+
+
+# Clean the users collection and the throttle state, and enable the login throttle before each test
+@pytest.fixture(autouse=True)
+def login_throttle(monkeypatch):
+    # Check if the database is FINBRAIN or FINBRAINTEST to make sure we are using the correct database for the test
+    if db.name == 'FinBrainTest':
+        users_collection.delete_many({})
+    for key in lc.r.keys("login_throttle:*"):
+        lc.r.delete(key)
+    monkeypatch.setattr(ratelimit, "LOGIN_THROTTLE_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "LOGIN_EMAIL_BUCKET_CAPACITY", 3)
+    monkeypatch.setattr(ratelimit, "LOGIN_IP_BUCKET_CAPACITY", 5)
+    yield
+    for key in lc.r.keys("login_throttle:*"):
+        lc.r.delete(key)
+
+
+def insert_test_user():
+    """
+    Insert a test user into the database
+    """
+    users_collection.insert_one({
+        "firstName": "User",
+        "lastName": "Throttle",
+        "email": "user@throttle.com",
+        "password": hash_password("Secret123"),
+    })
+
+
+def login(client, email="user@throttle.com", password="Secret123", ip="10.0.0.1"):
+    """
+    Send a login request from the given IP address
+    """
+    return client.post('/login', json={"email": email, "password": password}, environ_base={'REMOTE_ADDR': ip})
+
+
+def test_email_bucket_limits_attempts():
+    """
+    Test that an email is throttled after its bucket is empty
+    """
+    insert_test_user()
+    client = app.test_client()
+
+    # Check if the first attempts go through (wrong password) and the next one is throttled
+    for _ in range(3):
+        assert login(client, password="Wrong123").status_code == 401
+    response = login(client)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_ip_bucket_limits_attempts():
+    """
+    Test that an IP is throttled even when it tries different emails
+    """
+    client = app.test_client()
+
+    for i in range(5):
+        assert login(client, email=f"user{i}@throttle.com").status_code == 401
+    assert login(client, email="user9@throttle.com").status_code == 429
+
+    # Check if another IP is not affected
+    assert login(client, email="user9@throttle.com", ip="10.0.0.2").status_code == 401
+
+
+def test_throttled_login_skips_mongo_and_argon2():
+    """
+    Test that a throttled login does not look up the user or verify the password
+    """
+    insert_test_user()
+    client = app.test_client()
+    for _ in range(3):
+        login(client, password="Wrong123")
+
+    with patch.object(lc.users_collection, "find_one") as find_one, patch.object(lc, "verify_password") as verify:
+        response = login(client)
+
+    # Check if the request was rejected before the database and argon2
+    assert response.status_code == 429
+    find_one.assert_not_called()
+    verify.assert_not_called()
+
+
+def test_inflight_cap_rejects_logins(monkeypatch):
+    """
+    Test that logins are rejected while the global verification slots are taken
+    """
+    insert_test_user()
+    monkeypatch.setattr(ratelimit, "LOGIN_MAX_INFLIGHT_VERIFICATIONS", 1)
+
+    # Take the only slot, as if another worker was verifying a password
+    allowed, slot_id, _ = ratelimit.acquire_login_attempt("other@throttle.com", "10.0.0.9")
+    assert allowed
+
+    client = app.test_client()
+    assert login(client).status_code == 429
+
+    # Check if the login works again after the slot is released
+    ratelimit.release_login_attempt(slot_id)
+    assert login(client).status_code == 200
+
+
+def test_slots_released_after_login():
+    """
+    Test that the verification slot is freed after both successful and failed logins
+    """
+    insert_test_user()
+    client = app.test_client()
+
+    assert login(client).status_code == 200
+    assert login(client, password="Wrong123").status_code == 401
+    assert lc.r.zcard(ratelimit.LOGIN_INFLIGHT_KEY) == 0
+
+
+def test_expired_slot_lease_is_reclaimed(monkeypatch):
+    """
+    Test that a slot that was never released (crashed worker) stops counting after its lease
+    """
+    monkeypatch.setattr(ratelimit, "LOGIN_MAX_INFLIGHT_VERIFICATIONS", 1)
+    lc.r.zadd(ratelimit.LOGIN_INFLIGHT_KEY, {"stale_slot": 1})
+
+    allowed, slot_id, _ = ratelimit.acquire_login_attempt("user@throttle.com", "10.0.0.1")
+    assert allowed
+    ratelimit.release_login_attempt(slot_id)
+
+
+def test_demo_login_not_throttled():
+    """
+    Test that the shared demo user is not throttled by the email bucket
+    """
+    client = app.test_client()
+    for _ in range(4):
+        response = client.post('/login', json={"email": "demo", "password": "", "demo": True}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        assert response.status_code == 200
+
+
+def test_throttle_disabled(monkeypatch):
+    """
+    Test that nothing is throttled when the feature is off
+    """
+    monkeypatch.setattr(ratelimit, "LOGIN_THROTTLE_ENABLED", False)
+    client = app.test_client()
+    for _ in range(6):
+        assert login(client, password="Wrong123").status_code == 401
+
+
+def test_forwarded_ip_used_behind_trusted_proxy(monkeypatch):
+    """
+    Test that behind a trusted proxy the IP bucket is keyed on the X-Forwarded-For address,
+    and that the header is ignored when no proxy is trusted
+    """
+    insert_test_user()
+    client = app.test_client()
+
+    def login_forwarded(forwarded_ip):
+        return client.post('/login', json={"email": "user@throttle.com", "password": "Wrong123"},
+                           headers={'X-Forwarded-For': forwarded_ip}, environ_base={'REMOTE_ADDR': '10.9.9.9'})
+
+    # Check if the header is ignored by default (every attempt uses the ingress address)
+    monkeypatch.setattr(ratelimit, "LOGIN_EMAIL_BUCKET_CAPACITY", 100)
+    for i in range(5):
+        login_forwarded(f"203.0.113.{i}")
+    assert login_forwarded("203.0.113.50").status_code == 429
+
+    # Check if with one trusted hop each forwarded client gets its own bucket
+    monkeypatch.setattr(app.wsgi_app, "x_for", 1)
+    for i in range(6):
+        assert login_forwarded(f"198.51.100.{i}").status_code == 401
+    assert lc.r.hgetall("login_throttle:ip:198.51.100.0")
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
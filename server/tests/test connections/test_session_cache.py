@@ -0,0 +1,149 @@
+# FinBrain Project - test_session_cache.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+import pytest
+import time
+import services.logicconnection as lc
+from db import cache
+from db import sessioncache
+from app import app
+
+
+# Tests that count Redis round trips or use Lua scripts / pub-sub only run against Redis
+requires_redis = pytest.mark.skipif(cache.CACHE_BACKEND != 'redis', reason="Needs the Redis cache backend")
+
+
+# Clean Redis sessions and enable the in-process session cache before each test
+@pytest.fixture(autouse=True)
+def enable_session_cache(monkeypatch):
+    # Clean up any existing test sessions
+    keys = lc.r.keys("session:*")
+    if keys:
+        lc.r.delete(*keys)
+    monkeypatch.setattr(sessioncache, "SESSION_L1_CACHE_ENABLED", True)
+    sessioncache.session_cache.clear()
+    yield
+    sessioncache.session_cache.clear()
+
+
+def create_session(session_id, email):
+    """
+    Store a session in Redis
+    """
+    lc.r.hset(f"session:{session_id}", "email", email)
+    lc.r.expire(f"session:{session_id}", lc.SESSION_TTL_SECONDS)
+
+
+@requires_redis
+def test_second_lookup_served_from_memory():
+    """
+    Test that a repeated session lookup does not go to Redis
+    """
+    create_session("l1_hit", "hit@test.com")
+
+    # First lookup goes to Redis
+    cache.reset_redis_call_count()
+    assert lc.get_email_from_session_id("l1_hit") == "hit@test.com"
+    assert cache.get_redis_call_count() == 1
+
+    # Second lookup is served from the in-process cache
+    cache.reset_redis_call_count()
+    assert lc.get_email_from_session_id("l1_hit") == "hit@test.com"
+    assert cache.get_redis_call_count() == 0
+
+
+@requires_redis
+def test_cache_disabled_always_goes_to_redis(monkeypatch):
+    """
+    Test that nothing is cached when the in-process cache is disabled
+    """
+    monkeypatch.setattr(sessioncache, "SESSION_L1_CACHE_ENABLED", False)
+    create_session("l1_off", "off@test.com")
+
+    # Both lookups go to Redis
+    assert lc.get_email_from_session_id("l1_off") == "off@test.com"
+    cache.reset_redis_call_count()
+    assert lc.get_email_from_session_id("l1_off") == "off@test.com"
+    assert cache.get_redis_call_count() == 1
+    assert len(sessioncache.session_cache) == 0
+
+
+@requires_redis
+def test_entry_expires_after_ttl(monkeypatch):
+    """
+    Test that an expired cache entry falls back to Redis (which slides the session TTL again)
+    """
+    monkeypatch.setattr(sessioncache.session_cache, "ttl_seconds", 0.1)
+    create_session("l1_ttl", "ttl@test.com")
+    assert lc.get_email_from_session_id("l1_ttl") == "ttl@test.com"
+
+    # Shorten the Redis TTL and wait for the cache entry to expire
+    lc.r.expire("session:l1_ttl", 10)
+    time.sleep(0.2)
+
+    # Lookup goes back to Redis and refreshes the TTL
+    cache.reset_redis_call_count()
+    assert lc.get_email_from_session_id("l1_ttl") == "ttl@test.com"
+    assert cache.get_redis_call_count() == 1
+    assert lc.r.ttl("session:l1_ttl") == lc.SESSION_TTL_SECONDS
+
+
+def test_cache_is_bounded(monkeypatch):
+    """
+    Test that the least recently used session is dropped when the cache is full
+    """
+    monkeypatch.setattr(sessioncache.session_cache, "max_entries", 2)
+    sessioncache.session_cache.put("a", {"email": "a@test.com"})
+    sessioncache.session_cache.put("b", {"email": "b@test.com"})
+
+    # Touch "a" so "b" becomes the least recently used
+    assert sessioncache.session_cache.get("a") == {"email": "a@test.com"}
+    sessioncache.session_cache.put("c", {"email": "c@test.com"})
+
+    assert len(sessioncache.session_cache) == 2
+    assert sessioncache.session_cache.get("b") is None
+    assert sessioncache.session_cache.get("a") is not None
+    assert sessioncache.session_cache.get("c") is not None
+
+
+def test_logout_invalidates_cached_session():
+    """
+    Test that logout removes the session from the in-process cache
+    """
+    create_session("l1_logout", "logout@test.com")
+    assert lc.get_email_from_session_id("l1_logout") == "logout@test.com"
+    assert sessioncache.session_cache.get("l1_logout") is not None
+
+    # Logout and check that the session is gone everywhere
+    client = app.test_client()
+    response = client.post('/logout', headers={'Session-ID': 'l1_logout'})
+    assert response.status_code == 200
+    assert sessioncache.session_cache.get("l1_logout") is None
+    assert lc.get_email_from_session_id("l1_logout") is None
+
+
+@requires_redis
+def test_invalidation_from_another_worker():
+    """
+    Test that an invalidation published by another worker evicts the local entry
+    """
+    sessioncache.ensure_invalidation_listener()
+    sessioncache.session_cache.put("l1_remote", {"email": "remote@test.com"})
+
+    # Publish the invalidation the same way another worker's logout would
+    lc.r.publish(sessioncache.SESSION_INVALIDATION_CHANNEL, "l1_remote")
+
+    # Wait for the listener thread to evict the entry
+    for _ in range(50):
+        if sessioncache.session_cache.get("l1_remote") is None:
+            break
+        time.sleep(0.05)
+    assert sessioncache.session_cache.get("l1_remote") is None
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
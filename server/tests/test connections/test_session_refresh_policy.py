@@ -0,0 +1,114 @@
+# FinBrain Project - test_session_refresh_policy.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+import pytest
+import services.logicconnection as lc
+from db import sessioncache
+from utils import metrics
+
+
+# Clean Redis sessions and enable the refresh policy before each test
+@pytest.fixture(autouse=True)
+def enable_refresh_policy(monkeypatch):
+    # Clean up any existing test sessions
+    keys = lc.r.keys("session:*")
+    if keys:
+        lc.r.delete(*keys)
+    monkeypatch.setattr(sessioncache, "SESSION_REFRESH_POLICY_ENABLED", True)
+    monkeypatch.setattr(sessioncache, "SESSION_REFRESH_FRACTION", 0.25)
+    sessioncache.refresh_tracker.clear()
+    yield
+    sessioncache.refresh_tracker.clear()
+
+
+def create_session(session_id, email, ttl):
+    """
+    Store a session in Redis with the given TTL
+    """
+    lc.r.hset(f"session:{session_id}", "email", email)
+    lc.r.expire(f"session:{session_id}", ttl)
+
+
+def test_first_access_refreshes_session():
+    """
+    Test that the first access of a session slides its TTL
+    """
+    create_session("policy_first", "first@test.com", 10)
+    performed_before = metrics.get_counter('session_refreshes_performed')
+
+    assert lc.get_email_from_session_id("policy_first") == "first@test.com"
+
+    # Check if the TTL was refreshed and counted
+    assert lc.r.ttl("session:policy_first") == lc.SESSION_TTL_SECONDS
+    assert metrics.get_counter('session_refreshes_performed') == performed_before + 1
+
+
+def test_recent_refresh_is_skipped():
+    """
+    Test that a session refreshed moments ago is only read, not rewritten
+    """
+    create_session("policy_skip", "skip@test.com", 10)
+    assert lc.get_email_from_session_id("policy_skip") == "skip@test.com"
+
+    # Shorten the TTL again - a skipped refresh must leave it untouched
+    lc.r.expire("session:policy_skip", 10)
+    skipped_before = metrics.get_counter('session_refreshes_skipped')
+
+    assert lc.get_email_from_session_id("policy_skip") == "skip@test.com"
+    assert lc.r.ttl("session:policy_skip") <= 10
+    assert metrics.get_counter('session_refreshes_skipped') == skipped_before + 1
+
+
+def test_refresh_after_fraction_elapsed(monkeypatch):
+    """
+    Test that the TTL is slid again once the configured fraction of the TTL has passed
+    """
+    create_session("policy_due", "due@test.com", 10)
+    assert lc.get_email_from_session_id("policy_due") == "due@test.com"
+
+    # A fraction of 0 means every access is due
+    monkeypatch.setattr(sessioncache, "SESSION_REFRESH_FRACTION", 0)
+    lc.r.expire("session:policy_due", 10)
+
+    assert lc.get_email_from_session_id("policy_due") == "due@test.com"
+    assert lc.r.ttl("session:policy_due") == lc.SESSION_TTL_SECONDS
+
+
+def test_login_counts_as_refresh():
+    """
+    Test that a session created at login is not refreshed again by the next request
+    """
+    sessioncache.mark_session_refreshed("policy_login")
+    assert sessioncache.claim_session_refresh("policy_login", lc.SESSION_TTL_SECONDS) is False
+
+
+def test_concurrent_refreshes_are_coalesced():
+    """
+    Test that only one of several concurrent refreshes of the same session goes to Redis
+    """
+    # First caller claims the refresh, second caller is coalesced into it
+    assert sessioncache.claim_session_refresh("policy_coalesce", lc.SESSION_TTL_SECONDS) is True
+    assert sessioncache.claim_session_refresh("policy_coalesce", lc.SESSION_TTL_SECONDS) is False
+
+    # A failed refresh does not block the next one
+    sessioncache.finish_session_refresh("policy_coalesce", False)
+    assert sessioncache.claim_session_refresh("policy_coalesce", lc.SESSION_TTL_SECONDS) is True
+
+
+def test_expired_session_with_skipped_refresh():
+    """
+    Test that a session deleted from Redis is not found even when its refresh is skipped
+    """
+    create_session("policy_gone", "gone@test.com", 10)
+    assert lc.get_email_from_session_id("policy_gone") == "gone@test.com"
+
+    lc.r.delete("session:policy_gone")
+    assert lc.get_email_from_session_id("policy_gone") is None
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
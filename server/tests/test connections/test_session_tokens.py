@@ -0,0 +1,170 @@
+# FinBrain Project - test_session_tokens.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+import pytest
+import time
+from app import app
+from db import users_collection, db
+from db import cache
+from db import sessioncache
+import services.logicconnection as lc
+from utils import session_tokens
+from utils.password_hashing import hash_password
+
+
+# Clean the users collection and switch to signed session tokens before each test
+@pytest.fixture(autouse=True)
+def signed_token_mode(monkeypatch):
+    # Check if the database is FINBRAIN or FINBRAINTEST to make sure we are using the correct database for the test
+    if db.name == 'FinBrainTest':
+        users_collection.delete_many({})
+    lc.r.delete(sessioncache.REVOKED_TOKENS_KEY)
+    monkeypatch.setattr(session_tokens, "SESSION_TOKEN_MODE", "signed")
+    monkeypatch.setattr(session_tokens, "SESSION_TOKEN_SECRET", "test-secret")
+    sessioncache.sync_revoked_tokens()
+
+
+def login():
+    """
+    Insert a test user and log in, returning the session token
+    """
+    users_collection.insert_one({
+        "firstName": "User",
+        "lastName": "Token",
+        "email": "user@token.com",
+        "password": hash_password("Secret123"),
+    })
+    client = app.test_client()
+    response = client.post('/login', json={"email": "user@token.com", "password": "Secret123"})
+    assert response.status_code == 200
+    return response.get_json()['session_id']
+
+
+def test_login_issues_signed_token():
+    """
+    Test that login returns a signed token and stores no session in Redis
+    """
+    token = login()
+
+    # Check if the token is signed and carries the user identity
+    assert session_tokens.is_signed_token(token)
+    payload = session_tokens.verify_session_token(token)
+    assert payload['email'] == "user@token.com"
+    assert payload['uid'] == str(users_collection.find_one({"email": "user@token.com"})['_id'])
+    assert not lc.r.keys("session:*")
+
+
+def test_token_resolves_without_redis():
+    """
+    Test that a signed token is resolved on the CPU without any Redis call
+    """
+    token = login()
+
+    cache.reset_redis_call_count()
+    assert lc.get_email_from_session_id(token) == "user@token.com"
+    assert cache.get_redis_call_count() == 0
+
+
+def test_tampered_token_rejected():
+    """
+    Test that a token with a modified payload is rejected
+    """
+    token = login()
+    forged = session_tokens.issue_session_token("attacker@evil.com", None, 60)
+
+    # Combine the forged payload with the real signature
+    forged_payload = forged.split('.')[1]
+    real_signature = token.split('.')[2]
+    assert lc.get_email_from_session_id(f"v1.{forged_payload}.{real_signature}") is None
+
+
+def test_token_signed_with_other_secret_rejected(monkeypatch):
+    """
+    Test that a token signed with a different secret is rejected
+    """
+    monkeypatch.setattr(session_tokens, "SESSION_TOKEN_SECRET", "other-secret")
+    token = session_tokens.issue_session_token("user@token.com", None, 60)
+    monkeypatch.setattr(session_tokens, "SESSION_TOKEN_SECRET", "test-secret")
+
+    assert lc.get_email_from_session_id(token) is None
+
+
+def test_expired_token_rejected():
+    """
+    Test that an expired token is rejected
+    """
+    token = session_tokens.issue_session_token("user@token.com", None, 1)
+    time.sleep(1.1)
+
+    assert lc.get_email_from_session_id(token) is None
+
+
+def test_logout_revokes_token():
+    """
+    Test that a token cannot be used after logout
+    """
+    token = login()
+    assert lc.get_email_from_session_id(token) == "user@token.com"
+
+    client = app.test_client()
+    response = client.post('/logout', headers={'Session-ID': token})
+    assert response.status_code == 200
+
+    # Check if the token is revoked locally and in Redis
+    assert lc.get_email_from_session_id(token) is None
+    token_id = session_tokens.verify_session_token(token)['jti']
+    assert sessioncache.is_session_token_revoked_in_redis(token_id)
+
+
+def test_heartbeat_renews_token():
+    """
+    Test that heartbeat returns a renewed token with the same token ID
+    """
+    token = login()
+
+    client = app.test_client()
+    response = client.post('/heartbeat', headers={'Session-ID': token})
+    data = response.get_json()
+
+    # Check if the response is successful and contains a renewed token
+    assert response.status_code == 200
+    assert data['active'] is True
+    renewed = data['session_id']
+    assert session_tokens.verify_session_token(renewed)['jti'] == session_tokens.verify_session_token(token)['jti']
+    assert lc.get_email_from_session_id(renewed) == "user@token.com"
+
+
+def test_heartbeat_for_revoked_token():
+    """
+    Test that a revoked token is not renewed
+    """
+    token = login()
+    client = app.test_client()
+    client.post('/logout', headers={'Session-ID': token})
+
+    response = client.post('/heartbeat', headers={'Session-ID': token})
+    data = response.get_json()
+
+    # Check if the session is reported as not active
+    assert response.status_code == 200
+    assert data['active'] is False
+    assert 'session_id' not in data
+
+
+def test_opaque_session_still_works():
+    """
+    Test that opaque Redis session IDs keep working while signed tokens are enabled
+    """
+    lc.r.hset("session:opaque_s1", "email", "opaque@test.com")
+    lc.r.expire("session:opaque_s1", lc.SESSION_TTL_SECONDS)
+
+    assert lc.get_email_from_session_id("opaque_s1") == "opaque@test.com"
+    lc.r.delete("session:opaque_s1")
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
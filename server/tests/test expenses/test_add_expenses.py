@@ -0,0 +1,206 @@
+# FinBrain Project - test_add_expenses.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+from db import users_collection, expenses_collection, counters_collection, db
+import pytest
+from app import app
+import services.logicconnection as lc
+from unittest.mock import patch
+
+
+# Clean the users, expenses and counters collections before each test
+@pytest.fixture(autouse=True)
+def clean_collections():
+    # Check if the database is FINBRAIN or FINBRAINTEST to make sure we are using the correct database for the test
+    if db.name == 'FinBrainTest':
+        users_collection.delete_many({})
+        expenses_collection.delete_many({})
+        counters_collection.delete_many({})
+
+
+# Clean Redis sessions before each test
+@pytest.fixture(autouse=True)
+def clean_sessions():
+    keys = lc.r.keys("session:*")
+    if keys:
+        lc.r.delete(*keys)
+
+
+def insert_test_user(email="user@batch.com"):
+    """
+    Insert a test user into the database and create a valid session
+    """
+    users_collection.insert_one({
+        "firstName": "User",
+        "lastName": "Batch",
+        "email": email,
+        "password": "Secret123",
+    })
+    session_id = "batch_s1"
+    lc.r.hset(f"session:{session_id}", mapping={"email": email, "last_seen": lc.get_now_utc().isoformat()})
+    lc.r.expire(f"session:{session_id}", lc.SESSION_TTL_SECONDS)
+    return session_id
+
+
+def add_expenses(session_id, rows):
+    """
+    Send a batch of expenses to /add_expenses
+    """
+    client = app.test_client()
+    return client.post('/add_expenses', json={"expenses": rows}, headers={'Session-ID': session_id})
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate')
+@patch('services.logicexpenses.classify_expenses')
+def test_add_expenses(mock_classify_expenses, mock_get_usd_to_ils_rate):
+    """
+    Test that a batch is inserted with consecutive serial numbers, converted amounts and categories
+    """
+    mock_get_usd_to_ils_rate.return_value = 4.0
+    mock_classify_expenses.side_effect = lambda titles: ["Food & Drinks"] * len(titles)
+    session_id = insert_test_user()
+
+    response = add_expenses(session_id, [
+        {"title": "Pizza", "amount": 40, "currency": "ILS", "date": "2025-01-15"},
+        {"title": "Taxi", "amount": 10, "currency": "USD", "date": "2025-01-16"},
+    ])
+
+    # Check if both rows were added
+    assert response.status_code == 200
+    assert response.json['added'] == 2
+    assert [row['serial_number'] for row in response.json['results']] == [1, 2]
+
+    # Check if the amounts were converted
+    expenses = sorted(expenses_collection.find({}), key=lambda e: e['serial_number'])
+    assert expenses[0]['amount_usd'] == 10.0 and expenses[0]['amount_ils'] == 40
+    assert expenses[1]['amount_usd'] == 10 and expenses[1]['amount_ils'] == 40.0
+    assert all(e['category'] == "Food & Drinks" for e in expenses)
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate')
+@patch('services.logicexpenses.classify_expenses')
+def test_add_expenses_batches_lookups(mock_classify_expenses, mock_get_usd_to_ils_rate):
+    """
+    Test that each date's rate is fetched once, titles are classified in one call and rows are inserted once
+    """
+    mock_get_usd_to_ils_rate.return_value = 3.7
+    mock_classify_expenses.side_effect = lambda titles: ["Other"] * len(titles)
+    session_id = insert_test_user()
+    rows = [{"title": f"Row {i}", "amount": 5, "currency": "ILS", "date": f"2025-02-0{1 + i % 2}"} for i in range(10)]
+
+    with patch.object(expenses_collection, "insert_many", wraps=expenses_collection.insert_many) as insert_many, \
+         patch.object(expenses_collection, "insert_one") as insert_one:
+        response = add_expenses(session_id, rows)
+
+    # Check if there were 2 rate lookups (2 dates), 1 classification call and 1 insert
+    assert response.status_code == 200
+    assert mock_get_usd_to_ils_rate.call_count == 2
+    assert mock_classify_expenses.call_count == 1
+    assert len(mock_classify_expenses.call_args[0][0]) == 10
+    assert insert_many.call_count == 1
+    insert_one.assert_not_called()
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate')
+@patch('services.logicexpenses.classify_expenses')
+def test_add_expenses_updates_each_month_once(mock_classify_expenses, mock_get_usd_to_ils_rate):
+    """
+    Test that the cache of each affected month is updated exactly once with its new expenses
+    """
+    mock_get_usd_to_ils_rate.return_value = 3.7
+    mock_classify_expenses.side_effect = lambda titles: ["Other"] * len(titles)
+    session_id = insert_test_user()
+    rows = [
+        {"title": "A", "amount": 5, "currency": "ILS", "date": "2025-01-10"},
+        {"title": "B", "amount": 5, "currency": "ILS", "date": "2025-01-20"},
+        {"title": "C", "amount": 5, "currency": "ILS", "date": "2025-03-05"},
+    ]
+
+    with patch('services.logicexpenses.cache.append_to_cached_user_expenses') as append_cache:
+        add_expenses(session_id, rows)
+
+    # Check if January and March were updated once each with their own expenses
+    calls = sorted(((call.args[:3]), [e['title'] for e in call.args[3]]) for call in append_cache.call_args_list)
+    assert calls == [(("user@batch.com", 1, 2025), ["A", "B"]), (("user@batch.com", 3, 2025), ["C"])]
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate')
+@patch('services.logicexpenses.classify_expenses')
+def test_add_expenses_per_row_errors(mock_classify_expenses, mock_get_usd_to_ils_rate):
+    """
+    Test that invalid rows are reported and the valid rows are still added
+    """
+    mock_get_usd_to_ils_rate.return_value = 3.7
+    mock_classify_expenses.side_effect = lambda titles: ["Other"] * len(titles)
+    session_id = insert_test_user()
+
+    response = add_expenses(session_id, [
+        {"title": "Valid", "amount": 5, "currency": "ILS", "date": "2025-01-10"},
+        {"title": "Bad currency", "amount": 5, "currency": "EUR", "date": "2025-01-10"},
+        {"title": "Missing amount", "currency": "ILS", "date": "2025-01-10"},
+        "not an expense",
+    ])
+    results = response.json['results']
+
+    # Check if only the first row was added and the others carry their error
+    assert response.status_code == 200
+    assert response.json['added'] == 1
+    assert response.json['failed'] == 3
+    assert results[0]['status'] == 'added'
+    assert results[1] == {'index': 1, 'status': 'error', 'message': 'Invalid currency'}
+    assert results[2]['message'] == 'Missing required fields'
+    assert results[3]['message'] == 'Invalid expense'
+    assert expenses_collection.count_documents({}) == 1
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate')
+def test_add_expenses_rate_failure(mock_get_usd_to_ils_rate):
+    """
+    Test that rows whose rate cannot be fetched fail and nothing is inserted if no row is left
+    """
+    mock_get_usd_to_ils_rate.return_value = None
+    session_id = insert_test_user()
+
+    response = add_expenses(session_id, [{"title": "A", "amount": 5, "currency": "ILS", "date": "2025-01-10"}])
+
+    # Check if the request failed with the rate error
+    assert response.status_code == 500
+    assert response.json['results'][0]['message'] == 'Failed to get exchange rate'
+    assert expenses_collection.count_documents({}) == 0
+
+
+def test_add_expenses_invalid_body():
+    """
+    Test that a missing, empty or too large list is rejected
+    """
+    session_id = insert_test_user()
+
+    # Check if each bad body returns 400
+    assert add_expenses(session_id, []).status_code == 400
+    assert add_expenses(session_id, "nope").status_code == 400
+    too_many = [{"title": "A", "amount": 1, "currency": "ILS", "date": "2025-01-10"}] * 501
+    assert add_expenses(session_id, too_many).status_code == 400
+
+
+def test_add_expenses_unauthorized_and_demo():
+    """
+    Test that an unknown session and the demo user cannot add expenses
+    """
+    rows = [{"title": "A", "amount": 5, "currency": "ILS", "date": "2025-01-10"}]
+
+    # Check if an unknown session is rejected
+    assert add_expenses("unknown_session", rows).status_code == 401
+
+    # Check if the demo user is rejected
+    session_id = insert_test_user(email="demo")
+    response = add_expenses(session_id, rows)
+    assert response.status_code == 400
+    assert response.json['message'] == 'Demo user cannot add expenses'
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
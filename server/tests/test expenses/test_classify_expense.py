@@ -93,6 +93,18 @@ def test_classify_expense_consistency():
     assert result1 == result2, "Function should return consistent results for the same input"
 
 
+def test_classify_expenses_matches_single_classification():
+    """
+    Test that classifying many titles at once gives the same categories as one by one
+    """
+    titles = ["Bought medicine", "Pizza with friends", "Taxi to work", "", None]
+    results = le.classify_expenses(titles)
+
+    # Check if every title gets the same category and invalid titles get "Other"
+    assert results == [le.classify_expense(title) for title in titles]
+    assert results[3:] == ["Other", "Other"]
+
+
 def test_pass():
     """
     Test that the test passes (to clean up the test database)
@@ -0,0 +1,170 @@
+# FinBrain Project - test_deferred_classification.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+from db import users_collection, expenses_collection, counters_collection, monthly_rollups_collection, db
+from db import cache
+import pytest
+from app import app
+import services.logicconnection as lc
+from services import classificationworker as cw
+from unittest.mock import patch
+
+
+# Every test here needs Redis (the queue is a Redis Stream)
+pytestmark = pytest.mark.skipif(cache.CACHE_BACKEND != 'redis', reason="Needs the Redis cache backend")
+
+
+# Clean the collections, sessions and the stream, and turn on deferred classification before each test
+@pytest.fixture(autouse=True)
+def deferred_mode(monkeypatch):
+    # Check if the database is FINBRAIN or FINBRAINTEST to make sure we are using the correct database for the test
+    if db.name == 'FinBrainTest':
+        users_collection.delete_many({})
+        expenses_collection.delete_many({})
+        counters_collection.delete_many({})
+        monthly_rollups_collection.delete_many({})
+    keys = lc.r.keys("session:*")
+    if keys:
+        lc.r.delete(*keys)
+    lc.r.delete(cw.CLASSIFICATION_STREAM_KEY)
+    cw.ensure_consumer_group()
+    monkeypatch.setattr(cw, "DEFERRED_CLASSIFICATION_ENABLED", True)
+    yield
+    lc.r.delete(cw.CLASSIFICATION_STREAM_KEY)
+
+
+def insert_test_user():
+    """
+    Insert a test user into the database and create a valid session
+    """
+    users_collection.insert_one({"firstName": "User", "lastName": "Deferred", "email": "user@deferred.com", "password": "Secret123"})
+    lc.r.hset("session:deferred_s1", mapping={"email": "user@deferred.com", "last_seen": lc.get_now_utc().isoformat()})
+    lc.r.expire("session:deferred_s1", lc.SESSION_TTL_SECONDS)
+    return "deferred_s1"
+
+
+def add_expense(title="Pizza", date="2025-01-15"):
+    """
+    Add an expense through /add_expense
+    """
+    client = app.test_client()
+    data = {"title": title, "amount": 40, "currency": "ILS", "date": date}
+    return client.post('/add_expense', json=data, headers={'Session-ID': 'deferred_s1'})
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=3.7)
+@patch('services.logicexpenses.classify_expense')
+def test_add_expense_does_not_classify(mock_classify_expense, _):
+    """
+    Test that add_expense inserts a provisional category and queues the expense without running the model
+    """
+    insert_test_user()
+
+    response = add_expense()
+
+    # Check if the expense was added as pending and queued
+    assert response.status_code == 200
+    mock_classify_expense.assert_not_called()
+    expense = expenses_collection.find_one({})
+    assert expense['category'] == cw.PROVISIONAL_CATEGORY
+    assert expense['category_pending'] is True
+    entries = lc.r.xrange(cw.CLASSIFICATION_STREAM_KEY)
+    assert entries[0][1] == {'expense_id': str(expense['_id']), 'email': 'user@deferred.com', 'title': 'Pizza', 'date': '2025-01-15'}
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=3.7)
+@patch('services.logicexpenses.classify_expenses')
+def test_worker_classifies_batch(mock_classify_expenses, _):
+    """
+    Test that the worker classifies queued expenses in one call, writes the categories and deletes the month cache
+    """
+    mock_classify_expenses.side_effect = lambda titles: ["Food & Drinks"] * len(titles)
+    insert_test_user()
+    for title in ("Pizza", "Burger", "Salad"):
+        add_expense(title)
+
+    with patch('services.classificationworker.cache.delete_user_expenses_cache') as delete_cache:
+        handled = cw.classify_pending_expenses("test-worker", block_ms=10)
+
+    # Check if all three were classified with one model call and the month cache was deleted once
+    assert handled == 3
+    assert mock_classify_expenses.call_count == 1
+    assert all(e['category'] == "Food & Drinks" and 'category_pending' not in e for e in expenses_collection.find({}))
+    delete_cache.assert_called_once_with("user@deferred.com", 1, 2025)
+
+    # Check if the monthly rollups moved from the provisional category
+    rollup_categories = {r['category']: r['count'] for r in monthly_rollups_collection.find({})}
+    assert rollup_categories == {"Food & Drinks": 3}
+
+    # Check if the entries were acknowledged
+    assert lc.r.xpending(cw.CLASSIFICATION_STREAM_KEY, cw.CLASSIFICATION_GROUP)['pending'] == 0
+    assert cw.classify_pending_expenses("test-worker", block_ms=10) == 0
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=3.7)
+@patch('services.logicexpenses.classify_expenses')
+def test_worker_keeps_user_category(mock_classify_expenses, _):
+    """
+    Test that a category the user chose before the worker ran is not overwritten
+    """
+    mock_classify_expenses.side_effect = lambda titles: ["Food & Drinks"] * len(titles)
+    insert_test_user()
+    add_expense()
+
+    # The user changes the provisional category first
+    client = app.test_client()
+    response = client.post('/update_expense_category', json={
+        "serial_number": 1, "current_category": cw.PROVISIONAL_CATEGORY, "new_category": "Transportation"
+    }, headers={'Session-ID': 'deferred_s1'})
+    assert response.status_code == 200
+
+    cw.classify_pending_expenses("test-worker", block_ms=10)
+
+    # Check if the user's category is kept
+    assert expenses_collection.find_one({})['category'] == "Transportation"
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=3.7)
+@patch('services.logicexpenses.classify_expense', return_value="Transportation")
+def test_add_expense_classifies_when_queue_fails(mock_classify_expense, _):
+    """
+    Test that the expense is classified right away if it cannot be queued
+    """
+    insert_test_user()
+
+    with patch.object(cw.r, "xadd", side_effect=Exception("Redis down")):
+        response = add_expense("Taxi")
+
+    # Check if the expense got its real category and is not pending
+    assert response.status_code == 200
+    expense = expenses_collection.find_one({})
+    assert expense['category'] == "Transportation"
+    assert 'category_pending' not in expense
+
+
+def test_worker_block_is_shorter_than_socket_timeout():
+    """
+    Test that the blocking read of an idle worker returns before the Redis client socket times out
+    """
+    # Check if the block time is below the configured socket timeout
+    assert cw.CLASSIFICATION_BLOCK_MS < cache.REDIS_SOCKET_TIMEOUT_SECONDS * 1000
+
+    # Check if it is also below the socket timeout of the client the worker uses
+    connection_pool = getattr(cw.r, 'connection_pool', None)
+    if connection_pool is not None:
+        socket_timeout = connection_pool.connection_kwargs.get('socket_timeout')
+        assert socket_timeout is None or cw.CLASSIFICATION_BLOCK_MS < socket_timeout * 1000
+
+    # Check if an idle read returns without an error
+    with patch.object(cw.logger, 'exception') as log_exception, patch.object(cw.logger, 'error') as log_error:
+        assert cw.classify_pending_expenses("idle-worker", block_ms=100) == 0
+        log_exception.assert_not_called()
+        log_error.assert_not_called()
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
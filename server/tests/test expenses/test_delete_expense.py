@@ -355,7 +355,7 @@ def test_delete_expense_database_error():
     client = app.test_client()
     
     # Mock the database to raise an exception
-    with patch('db.expenses_collection.delete_one') as mock_delete:
+    with patch('db.expenses_collection.find_one_and_delete') as mock_delete:
         mock_delete.side_effect = Exception("Database connection error")
         
         # Send a POST request to delete expense
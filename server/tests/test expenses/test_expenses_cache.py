@@ -8,6 +8,8 @@ from datetime import datetime
 from app import app
 from db import users_collection, expenses_collection, db
 from db import cache
+from db import cachecodec
+from utils import jsonprovider
 import services.logicconnection as lc
 
 
@@ -284,6 +286,227 @@ def test_cache_delete_scenarios():
     assert cached_data_after is None
 
 
+def test_patch_cached_user_expenses():
+    """
+    Test that a cached month can be appended to, have a category updated and have an expense removed
+    """
+    user_id = 'test_user_patch'
+    month = 3
+    year = 2025
+    cache.add_to_cache_user_expenses(user_id, month, year, [{'serial_number': 1, 'title': 'Pizza', 'category': 'Other', 'category_pending': True}])
+
+    # Check if a new expense is added at the end
+    cache.append_to_cached_user_expenses(user_id, month, year, [{'serial_number': 2, 'title': 'Taxi', 'category': 'Transportation'}])
+    assert [e['serial_number'] for e in cache.get_cached_user_expenses(user_id, month, year)] == [1, 2]
+
+    # Check if the category is updated (and the pending flag dropped)
+    cache.update_cached_expense_category(user_id, month, year, 1, 'Food & Drinks')
+    assert cache.get_cached_user_expenses(user_id, month, year)[0] == {'serial_number': 1, 'title': 'Pizza', 'category': 'Food & Drinks'}
+
+    # Check if the expense is removed
+    cache.remove_from_cached_user_expenses(user_id, month, year, 1)
+    assert [e['serial_number'] for e in cache.get_cached_user_expenses(user_id, month, year)] == [2]
+
+
+def test_patch_does_not_create_missing_month():
+    """
+    Test that patching a month that is not cached leaves it uncached
+    """
+    cache.append_to_cached_user_expenses('test_user_patch', 4, 2025, [{'serial_number': 1}])
+    assert cache.get_cached_user_expenses('test_user_patch', 4, 2025) is None
+
+
+def test_patch_failure_deletes_month():
+    """
+    Test that the cached month is deleted when patching it fails
+    """
+    user_id = 'test_user_patch'
+    cache.add_to_cache_user_expenses(user_id, 5, 2025, [{'serial_number': 1}])
+
+    with patch('db.cache.r.update_value', side_effect=Exception("Redis error")):
+        cache.remove_from_cached_user_expenses(user_id, 5, 2025, 1)
+
+    # Check if the month is gone instead of stale
+    assert cache.get_cached_user_expenses(user_id, 5, 2025) is None
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=3.7)
+@patch('services.logicexpenses.classify_expense', return_value='Food & Drinks')
+def test_writes_keep_cached_month_current(_, __):
+    """
+    Test that after adding, updating and deleting expenses the cached month matches MongoDB without a cache miss
+    """
+    users_collection.insert_one({"firstName": "User", "lastName": "Patch", "email": "user@patch.com", "password": "Secret123"})
+    lc.r.hset("session:patch_s1", mapping={"email": "user@patch.com", "last_seen": lc.get_now_utc().isoformat()})
+    client = app.test_client()
+    headers = {'Session-ID': 'patch_s1'}
+    client.post('/add_expense', json={"title": "Pizza", "amount": 40, "currency": "ILS", "date": "2025-01-15"}, headers=headers)
+    # Fill the cache
+    client.get('/get_expenses?month=1&year=2025', headers=headers)
+
+    client.post('/add_expense', json={"title": "Burger", "amount": 30, "currency": "ILS", "date": "2025-01-16"}, headers=headers)
+    client.post('/update_expense_category', json={"serial_number": 1, "current_category": "Food & Drinks", "new_category": "Other"}, headers=headers)
+    client.post('/add_expense', json={"title": "Salad", "amount": 20, "currency": "ILS", "date": "2025-01-17"}, headers=headers)
+    client.post('/delete_expense', json={"serial_number": 2}, headers=headers)
+
+    # Check if the month is still cached and has the same expenses as MongoDB
+    with patch('services.logicexpenses.expenses_collection.find') as find:
+        response = client.get('/get_expenses?month=1&year=2025', headers=headers)
+        find.assert_not_called()
+    cached = response.get_json()['expenses']
+    cache.delete_user_expenses_cache("user@patch.com", 1, 2025)
+    from_db = client.get('/get_expenses?month=1&year=2025', headers=headers).get_json()['expenses']
+    assert cached == from_db
+    assert [(e['serial_number'], e['category']) for e in cached] == [(1, 'Other'), (3, 'Food & Drinks')]
+
+
+@pytest.mark.skipif(cache.CACHE_BACKEND != 'redis', reason="Needs the Redis cache backend")
+def test_update_value_counts_pipeline_commands():
+    """
+    Test that the commands of the update_value pipeline (WATCH, GET, MULTI, SET, EXEC) are counted like plain commands
+    """
+    cache.r.set("test_user_expenses:count_pipeline", "[]")
+
+    # Check if the five commands of one check-and-set are counted
+    cache.reset_redis_call_count()
+    assert cache.r.update_value("test_user_expenses:count_pipeline", lambda value: "[1]") is True
+    assert cache.get_redis_call_count() == 5
+    assert cache.r.get("test_user_expenses:count_pipeline") == "[1]"
+
+    # Check if a key that does not exist costs WATCH, GET and UNWATCH
+    cache.reset_redis_call_count()
+    assert cache.r.update_value("test_user_expenses:count_pipeline_missing", lambda value: value) is False
+    assert cache.get_redis_call_count() == 3
+
+
+@pytest.mark.skipif(cache.CACHE_BACKEND != 'redis', reason="Needs the Redis cache backend")
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=3.7)
+@patch('services.logicexpenses.classify_expense', return_value='Food & Drinks')
+def test_add_expense_reports_pipeline_redis_calls(_, __):
+    """
+    Test that X-Redis-Calls of /add_expense includes the commands of the cached month patch (a pipeline)
+    """
+    users_collection.insert_one({"firstName": "User", "lastName": "Count", "email": "user@count.com", "password": "Secret123"})
+    lc.r.hset("session:count_s1", mapping={"email": "user@count.com", "last_seen": lc.get_now_utc().isoformat()})
+    client = app.test_client()
+    headers = {'Session-ID': 'count_s1'}
+    client.post('/add_expense', json={"title": "Pizza", "amount": 40, "currency": "ILS", "date": "2025-01-15"}, headers=headers)
+    client.get('/get_expenses?month=1&year=2025', headers=headers)
+
+    # Check if the header counts the patch of the cached month on top of the other commands
+    with patch('db.cache.r.update_value', return_value=True):
+        without_pipeline = client.post('/add_expense', json={"title": "Burger", "amount": 30, "currency": "ILS", "date": "2025-01-16"}, headers=headers)
+    response = client.post('/add_expense', json={"title": "Salad", "amount": 20, "currency": "ILS", "date": "2025-01-17"}, headers=headers)
+    assert response.status_code == 200
+    assert int(response.headers['X-Redis-Calls']) > 0
+    assert int(response.headers['X-Redis-Calls']) >= int(without_pipeline.headers['X-Redis-Calls']) + 5
+
+
+def test_zstd_encoding_without_package_warns(monkeypatch):
+    """
+    Test that EXPENSES_CACHE_ENCODING=zstd without the zstandard package logs a warning and writes zlib
+    """
+    monkeypatch.setattr(cachecodec, 'zstandard', None)
+
+    # Check if the setting falls back to zlib with a warning
+    with patch.object(cachecodec.logger, 'warning') as warning:
+        assert cachecodec.get_cache_encoding('zstd') == 'zlib'
+    warning.assert_called_once()
+    assert 'zstandard' in warning.call_args.args[0]
+
+    # Check if the supported settings are kept without a warning and unknown ones become json
+    with patch.object(cachecodec.logger, 'warning') as warning:
+        assert cachecodec.get_cache_encoding('ZLIB') == 'zlib'
+        assert cachecodec.get_cache_encoding('json') == 'json'
+        warning.assert_not_called()
+        assert cachecodec.get_cache_encoding('brotli') == 'json'
+        warning.assert_called_once()
+
+
+def get_month_cache_key(email, month, year):
+    """
+    Get the Redis key of a cached month
+    """
+    return f"{cache.get_user_expenses_cache_key_prefix()}user:{email}:month:{year}-{month:02d}"
+
+
+def test_compressed_cache_round_trip(monkeypatch):
+    """
+    Test that a month cached with EXPENSES_CACHE_ENCODING=zlib is stored smaller and read back as the same JSON
+    """
+    monkeypatch.setattr(cachecodec, 'EXPENSES_CACHE_ENCODING', 'zlib')
+    expenses = [{"title": f"Expense {i}", "category": "Food & Drinks", "amount_ils": 10.5, "serial_number": i} for i in range(100)]
+    cache.add_to_cache_user_expenses('user@login.com', 1, 2025, expenses)
+
+    # Check if the stored value starts with the format version and is smaller than the JSON
+    stored = cache.r.get(get_month_cache_key('user@login.com', 1, 2025))
+    assert ord(stored[0]) == cachecodec.FORMAT_ZLIB
+    assert len(stored) < len(jsonprovider.dumps_compact(expenses)) / 4
+
+    # Check if both readers return the month as before
+    assert cache.get_cached_user_expenses('user@login.com', 1, 2025) == expenses
+    assert cache.get_cached_user_expenses_json('user@login.com', 1, 2025) == jsonprovider.dumps_compact(expenses)
+
+
+def test_compressed_cache_reads_legacy_entries(monkeypatch):
+    """
+    Test that plain JSON entries written before the setting changed are still read and patched
+    """
+    monkeypatch.setattr(cachecodec, 'EXPENSES_CACHE_ENCODING', 'json')
+    cache.add_to_cache_user_expenses('user@login.com', 1, 2025, [{"title": "Pizza", "serial_number": 1}])
+    monkeypatch.setattr(cachecodec, 'EXPENSES_CACHE_ENCODING', 'zlib')
+
+    # Check if the legacy entry is read as it is
+    assert cache.r.get(get_month_cache_key('user@login.com', 1, 2025)).startswith('[')
+    assert cache.get_cached_user_expenses('user@login.com', 1, 2025) == [{"title": "Pizza", "serial_number": 1}]
+
+    # Check if a patch rewrites it in the new format
+    cache.append_to_cached_user_expenses('user@login.com', 1, 2025, [{"title": "Sushi", "serial_number": 2}])
+    assert ord(cache.r.get(get_month_cache_key('user@login.com', 1, 2025))[0]) == cachecodec.FORMAT_ZLIB
+    assert [e['title'] for e in cache.get_cached_user_expenses('user@login.com', 1, 2025)] == ["Pizza", "Sushi"]
+
+    # Check if switching back to json still reads the compressed entry
+    monkeypatch.setattr(cachecodec, 'EXPENSES_CACHE_ENCODING', 'json')
+    assert [e['title'] for e in cache.get_cached_user_expenses('user@login.com', 1, 2025)] == ["Pizza", "Sushi"]
+
+
+def test_compressed_cache_unknown_format_is_a_miss():
+    """
+    Test that a value with an unknown format version counts as a cache miss
+    """
+    cache.r.setex(get_month_cache_key('user@login.com', 1, 2025), 60, chr(9) + "data")
+
+    # Check if the month is read as not cached
+    assert cache.get_cached_user_expenses_json('user@login.com', 1, 2025) is None
+    assert cache.get_cached_user_expenses('user@login.com', 1, 2025) is None
+
+
+def test_cache_encoding_report(monkeypatch):
+    """
+    Test that the report lists the format and the bytes saved of every cached month, and the encodings benchmark round trips
+    """
+    from utils.benchmark_json import benchmark_cache_encodings
+
+    expenses = [{"title": f"Expense {i}", "category": "Transportation", "serial_number": i} for i in range(50)]
+    monkeypatch.setattr(cachecodec, 'EXPENSES_CACHE_ENCODING', 'json')
+    cache.add_to_cache_user_expenses('user@login.com', 1, 2025, expenses)
+    monkeypatch.setattr(cachecodec, 'EXPENSES_CACHE_ENCODING', 'zlib')
+    cache.add_to_cache_user_expenses('user@login.com', 2, 2025, expenses)
+    cache.add_to_cache_user_expenses_page('user@login.com', 2, 2025, '10:', {"expenses": [], "next_cursor": None})
+
+    rows = cachecodec.report_cached_months(cache.r, f"{cache.get_user_expenses_cache_key_prefix()}user:*:month:????-??")
+
+    # Check if both months (and not the cached pages) are reported with their format and savings
+    by_format = {row['format']: row for row in rows}
+    assert sorted(by_format) == ['json', 'zlib']
+    assert by_format['json']['saved_bytes'] == 0
+    assert by_format['zlib']['saved_bytes'] > 0
+    assert by_format['zlib']['json_bytes'] == by_format['json']['json_bytes']
+
+    # Check if every encoding returns the same JSON
+    assert all(row['identical'] for row in benchmark_cache_encodings(sizes=[50], rounds=1))
+
+
 def test_pass():
     """
     Test that the test passes (to clean up the test database)
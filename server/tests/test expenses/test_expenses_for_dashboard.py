@@ -998,6 +998,196 @@ def test_expenses_for_dashboard_comprehensive_multiple_months_categories():
     assert mar_data['amount'] == 75.0  
 
 
+def test_expenses_for_dashboard_aggregation_matches_python_loop():
+    """
+    Test that the MongoDB aggregation returns exactly the JSON of the previous Python loop
+    """
+    from utils.benchmark_dashboard import benchmark_dashboard
+
+    results = benchmark_dashboard(expense_count=500, rounds=1)
+
+    # Check if every chart returned the same JSON on both paths (and the seeded expenses were removed)
+    assert all(row['identical'] for row in results)
+    assert expenses_collection.count_documents({}) == 0
+
+
+def test_expenses_for_dashboard_cached():
+    """
+    Test that a chart is cached for any order of the months and categories, and returned in the requested order
+    """
+    session_id = insert_test_user()
+    user_id = get_user_id_from_email("user@login.com")
+    expenses_collection.insert_many([
+        {"user_id": user_id, "title": "A", "date": "2025-01-05", "amount_ils": 100, "amount_usd": 27, "category": "Food & Drinks", "serial_number": 1},
+        {"user_id": user_id, "title": "B", "date": "2025-02-05", "amount_ils": 50, "amount_usd": 13.5, "category": "Transportation", "serial_number": 2},
+    ])
+    client = app.test_client()
+    first = client.get('/expenses_for_dashboard?chart=monthly_comparison&currency=ILS&months=2025-01&months=2025-02&categories=Food %26 Drinks&categories=Transportation', headers={'Session-ID': session_id})
+
+    # Check if the same chart with another order is served from the cache, in the requested order
+    with patch('services.logicexpenses.expenses_collection.aggregate') as aggregate:
+        second = client.get('/expenses_for_dashboard?chart=monthly_comparison&currency=ILS&months=2025-02&months=2025-01&categories=Transportation&categories=Food %26 Drinks', headers={'Session-ID': session_id})
+        aggregate.assert_not_called()
+    assert [row['month'] for row in second.json['data']] == ['2025-02', '2025-01']
+    assert second.json['months'] == ['2025-02', '2025-01']
+    assert {row['month']: row for row in second.json['data']} == {row['month']: row for row in first.json['data']}
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=4.0)
+@patch('services.logicexpenses.classify_expense', return_value="Food & Drinks")
+def test_expenses_for_dashboard_cache_invalidated_by_write(_, __):
+    """
+    Test that adding an expense makes the cached charts of the user stale with one generation bump
+    """
+    session_id = insert_test_user()
+    client = app.test_client()
+    url = '/expenses_for_dashboard?chart=category_breakdown&currency=ILS&months=2025-01&categories=All'
+    before = client.get(url, headers={'Session-ID': session_id})
+    generation_before = cache.r.get(cache.get_user_data_generation_key("user@login.com"))
+
+    client.post('/add_expense', json={"title": "Pizza", "amount": 40, "currency": "ILS", "date": "2025-01-15"}, headers={'Session-ID': session_id})
+
+    # Check if the generation moved and the chart includes the new expense
+    assert cache.r.get(cache.get_user_data_generation_key("user@login.com")) != generation_before
+    after = client.get(url, headers={'Session-ID': session_id})
+    food_before = next(row for row in before.json['data'] if row['category'] == "Food & Drinks")
+    food_after = next(row for row in after.json['data'] if row['category'] == "Food & Drinks")
+    assert (food_before['amount'], food_after['amount']) == (0, 40)
+
+
+def test_expenses_for_dashboard_combined_matches_separate_charts():
+    """
+    Test that the combined mode returns, from one aggregation, exactly the responses of the separate chart requests
+    """
+    from utils.benchmark_dashboard import seed_expenses
+    import services.logicexpenses as logic_expenses
+
+    session_id = insert_test_user()
+    user_id = get_user_id_from_email("user@login.com")
+    seed_expenses(user_id, 300, ["2025-01", "2025-02", "2025-03"])
+    client = app.test_client()
+    headers = {'Session-ID': session_id}
+    months = 'months=2025-03&months=2025-01&months=2025-02'
+
+    with patch('services.logicexpenses.expenses_collection.aggregate', wraps=logic_expenses.expenses_collection.aggregate) as aggregate:
+        combined = client.get(f'/expenses_for_dashboard?chart=combined&currency=ILS&currency=USD&{months}&compare=All&compare=Food %26 Drinks,Transportation', headers=headers)
+        # Check if both charts of both currencies and both selections came from one aggregation
+        assert aggregate.call_count == 1
+    assert combined.status_code == 200
+    cache.clear_test_cache()
+
+    # Check if every chart is exactly its own separate response
+    for currency in ['ILS', 'USD']:
+        breakdown = client.get(f'/expenses_for_dashboard?chart=category_breakdown&currency={currency}&{months}&categories=All', headers=headers)
+        assert combined.json['category_breakdown'][currency] == breakdown.json
+        for index, categories in enumerate(['categories=All', 'categories=Food %26 Drinks&categories=Transportation']):
+            comparison = client.get(f'/expenses_for_dashboard?chart=monthly_comparison&currency={currency}&{months}&{categories}', headers=headers)
+            assert combined.json['monthly_comparison'][currency][index] == comparison.json
+
+
+def test_expenses_for_dashboard_combined_cached():
+    """
+    Test that the combined mode reuses the cached month and category sums until the user's expenses change
+    """
+    session_id = insert_test_user()
+    user_id = get_user_id_from_email("user@login.com")
+    insert_test_expense(user_id, "Lunch", date="2025-01-05", amount_ils=100, amount_usd=27)
+    client = app.test_client()
+    url = '/expenses_for_dashboard?chart=combined&currency=ILS&months=2025-01&compare=Transportation'
+    first = client.get(url, headers={'Session-ID': session_id})
+
+    # Check if the second request (any currency or selection) does not aggregate again
+    with patch('services.logicexpenses.expenses_collection.aggregate') as aggregate:
+        second = client.get('/expenses_for_dashboard?chart=combined&currency=USD&months=2025-01&compare=All', headers={'Session-ID': session_id})
+        aggregate.assert_not_called()
+    assert first.json['monthly_comparison']['ILS'][0]['data'][0]['amount'] == 0
+    assert second.json['monthly_comparison']['USD'][0]['data'][0]['amount'] == 27
+    assert second.json['category_breakdown']['USD']['data'][0] == {'category': 'Food & Drinks', 'amount': 27, 'percentage': 100.0}
+
+
+def test_expenses_for_dashboard_combined_invalid_requests():
+    """
+    Test that the combined mode checks the currencies, category selections and their number
+    """
+    session_id = insert_test_user()
+    client = app.test_client()
+    base = '/expenses_for_dashboard?chart=combined&months=2025-01'
+
+    # Check if a missing or invalid currency, an invalid selection and too many selections are rejected
+    assert client.get(f'{base}&compare=All', headers={'Session-ID': session_id}).json == {'message': 'Invalid currency'}
+    assert client.get(f'{base}&currency=ILS&currency=EUR', headers={'Session-ID': session_id}).json == {'message': 'Invalid currency'}
+    assert client.get(f'{base}&currency=ILS&compare=Food,Nope', headers={'Session-ID': session_id}).json == {'message': 'Invalid category'}
+    too_many = '&'.join(['compare=All'] * 9)
+    response = client.get(f'{base}&currency=ILS&{too_many}', headers={'Session-ID': session_id})
+    assert response.status_code == 400
+    assert response.json == {'message': 'Too many category selections. Maximum is 8.'}
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=4.0)
+@patch('services.logicexpenses.classify_expense', return_value="Food & Drinks")
+def test_expenses_for_dashboard_etag(_, __):
+    """
+    Test that a chart the client already has is answered with 304 without reading MongoDB, until one of its months changes
+    """
+    session_id = insert_test_user()
+    client = app.test_client()
+    url = '/expenses_for_dashboard?chart=category_breakdown&currency=ILS&months=2025-01&months=2025-02&categories=All'
+    first = client.get(url, headers={'Session-ID': session_id})
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    # Check if the same ETag is answered with 304 before the cache or MongoDB is read
+    with patch('services.logicexpenses.expenses_collection.aggregate') as aggregate, patch('services.logicexpenses.cache.get_cached_dashboard') as get_cached:
+        response = client.get(url, headers={'Session-ID': session_id, 'If-None-Match': f'"other", {etag}'})
+        aggregate.assert_not_called()
+        get_cached.assert_not_called()
+    assert response.status_code == 304
+
+    # Check if another chart or order of the same months has its own ETag
+    other = client.get(url.replace('ILS', 'USD'), headers={'Session-ID': session_id, 'If-None-Match': etag})
+    assert other.status_code == 200
+
+    # Check if a write to a month outside the chart keeps the ETag, and a write to one of its months changes it
+    client.post('/add_expense', json={"title": "Pizza", "amount": 40, "currency": "ILS", "date": "2025-03-15"}, headers={'Session-ID': session_id})
+    assert client.get(url, headers={'Session-ID': session_id, 'If-None-Match': etag}).status_code == 304
+    client.post('/add_expense', json={"title": "Pizza", "amount": 40, "currency": "ILS", "date": "2025-02-15"}, headers={'Session-ID': session_id})
+    response = client.get(url, headers={'Session-ID': session_id, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['data'][0]['amount'] == 40
+
+    # Check if the combined mode answers with 304 too
+    combined_url = '/expenses_for_dashboard?chart=combined&currency=ILS&months=2025-02&compare=All'
+    combined = client.get(combined_url, headers={'Session-ID': session_id})
+    assert client.get(combined_url, headers={'Session-ID': session_id, 'If-None-Match': combined.headers['ETag']}).status_code == 304
+
+
+def test_expenses_for_dashboard_single_chart_groups_only_its_key():
+    """
+    Test that a single chart request groups only by its own key (category or month) and filters the
+    categories in $match, instead of the month and category sums of the combined mode
+    """
+    import services.logicexpenses as logic_expenses
+
+    session_id = insert_test_user()
+    client = app.test_client()
+    headers = {'Session-ID': session_id}
+
+    with patch('services.logicexpenses.expenses_collection.aggregate', wraps=logic_expenses.expenses_collection.aggregate) as aggregate, \
+         patch('services.logicexpenses.get_dashboard_totals') as get_dashboard_totals:
+        client.get('/expenses_for_dashboard?chart=category_breakdown&currency=ILS&months=2025-01&categories=All', headers=headers)
+        client.get('/expenses_for_dashboard?chart=monthly_comparison&currency=USD&months=2025-01&categories=Transportation', headers=headers)
+        get_dashboard_totals.assert_not_called()
+
+    # Check if the breakdown groups by category and sums only its currency
+    breakdown_pipeline = aggregate.call_args_list[0].args[0]
+    assert breakdown_pipeline[1]['$group'] == {'_id': '$category', 'amount': {'$sum': '$amount_ils'}}
+
+    # Check if the comparison filters the categories in MongoDB and groups by month
+    comparison_pipeline = aggregate.call_args_list[1].args[0]
+    assert comparison_pipeline[0]['$match']['category'] == {'$in': ['Transportation']}
+    assert comparison_pipeline[1]['$group']['_id'] == {'$substr': ['$date', 0, 7]}
+
+
 def test_pass():
     """
     Test that the test passes (to clean up the test database)
@@ -853,6 +853,188 @@ def test_get_expenses_multiple_months_years():
     assert len(january_expenses) == 2
 
 
+def test_get_expenses_pages():
+    """
+    Test that walking the pages with limit and after returns every expense once, in (date, serial_number) order
+    """
+    session_id = insert_test_user()
+    user_id = get_user_id_from_email("user@login.com")
+    # Two expenses share each date so the serial number breaks the ties
+    for serial_number in range(1, 8):
+        insert_test_expense(user_id, f"Expense {serial_number}", date=f"2025-01-{10 - serial_number // 2:02d}", serial_number=serial_number)
+    insert_test_expense(user_id, "February", date="2025-02-01", serial_number=8)
+    client = app.test_client()
+
+    # Walk the pages
+    seen = []
+    after = ''
+    while True:
+        response = client.get(f'/get_expenses?month=1&year=2025&limit=3&after={after}', headers={'Session-ID': session_id})
+        assert response.status_code == 200
+        assert len(response.json['expenses']) <= 3
+        seen.extend((e['date'], e['serial_number']) for e in response.json['expenses'])
+        after = response.json['next_cursor']
+        if after is None:
+            break
+
+    # Check if every January expense was returned once, in order, without the user_id field
+    assert len(seen) == 7
+    assert seen == sorted(seen)
+    assert 'user_id' not in response.json['expenses'][0]
+
+
+def test_get_expenses_page_invalid_limit_and_cursor():
+    """
+    Test that a limit out of range or a broken cursor is rejected
+    """
+    session_id = insert_test_user()
+    client = app.test_client()
+
+    # Check if the limit must be between 1 and the maximum page size
+    response = client.get('/get_expenses?month=1&year=2025&limit=0', headers={'Session-ID': session_id})
+    assert response.status_code == 400
+    response = client.get('/get_expenses?month=1&year=2025&limit=100000', headers={'Session-ID': session_id})
+    assert response.status_code == 400
+
+    # Check if a cursor that was not made by the server is rejected
+    response = client.get('/get_expenses?month=1&year=2025&limit=5&after=not-a-cursor', headers={'Session-ID': session_id})
+    assert response.status_code == 400
+    assert response.json['message'] == "Invalid cursor"
+
+
+def test_get_expenses_page_cache():
+    """
+    Test that a page is served from the cache and deleted when the month changes
+    """
+    session_id = insert_test_user()
+    user_id = get_user_id_from_email("user@login.com")
+    insert_test_expense(user_id, "Pizza", date="2025-01-05", serial_number=1)
+    client = app.test_client()
+    client.get('/get_expenses?month=1&year=2025&limit=10', headers={'Session-ID': session_id})
+
+    # Check if the second request does not read MongoDB
+    with patch('services.logicexpenses.expenses_collection.find') as find:
+        response = client.get('/get_expenses?month=1&year=2025&limit=10', headers={'Session-ID': session_id})
+        find.assert_not_called()
+    assert [e['title'] for e in response.json['expenses']] == ["Pizza"]
+
+    # Check if deleting an expense of the month drops the cached pages
+    client.post('/delete_expense', json={"serial_number": 1}, headers={'Session-ID': session_id})
+    response = client.get('/get_expenses?month=1&year=2025&limit=10', headers={'Session-ID': session_id})
+    assert response.json == {"expenses": [], "next_cursor": None}
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=4.0)
+@patch('services.logicexpenses.classify_expense', return_value="Food & Drinks")
+def test_get_expenses_etag(_, __):
+    """
+    Test that a month the client already has is answered with 304 without reading MongoDB, until the month changes
+    """
+    session_id = insert_test_user()
+    user_id = get_user_id_from_email("user@login.com")
+    insert_test_expense(user_id, "Pizza", date="2025-01-05", serial_number=1)
+    insert_test_expense(user_id, "Bus", date="2025-02-05", serial_number=2)
+    client = app.test_client()
+    january = client.get('/get_expenses?month=1&year=2025', headers={'Session-ID': session_id})
+    february = client.get('/get_expenses?month=2&year=2025', headers={'Session-ID': session_id})
+    etag = january.headers['ETag']
+
+    # Check if the ETag is strong, and a closed month may only be kept by the browser
+    assert etag.startswith('"') and etag != february.headers['ETag']
+    assert january.headers['Cache-Control'] == 'private, no-cache'
+    assert january.headers['Vary'] == 'Session-ID'
+
+    # Check if the same ETag is answered with 304 before the cache or MongoDB is read
+    with patch('services.logicexpenses.expenses_collection.find') as find, patch('services.logicexpenses.cache.get_cached_user_expenses_json') as get_cached:
+        response = client.get('/get_expenses?month=1&year=2025', headers={'Session-ID': session_id, 'If-None-Match': etag})
+        find.assert_not_called()
+        get_cached.assert_not_called()
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+    # Check if a page of the same month has its own ETag
+    page = client.get('/get_expenses?month=1&year=2025&limit=10', headers={'Session-ID': session_id, 'If-None-Match': etag})
+    assert page.status_code == 200
+    assert page.headers['ETag'] != etag
+
+    # Check if adding an expense to January changes its ETag, but not the ETag of February
+    client.post('/add_expense', json={"title": "Sushi", "amount": 40, "currency": "ILS", "date": "2025-01-20"}, headers={'Session-ID': session_id})
+    response = client.get('/get_expenses?month=1&year=2025', headers={'Session-ID': session_id, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [e['title'] for e in response.json['expenses']] == ["Pizza", "Sushi"]
+    response = client.get('/get_expenses?month=2&year=2025', headers={'Session-ID': session_id, 'If-None-Match': february.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_get_expenses_etag_current_month_and_lost_versions():
+    """
+    Test that the current month is always revalidated, and that lost month versions never match an old ETag
+    """
+    session_id = insert_test_user()
+    now = lc.get_now_utc()
+    client = app.test_client()
+    url = f'/get_expenses?month={now.month}&year={now.year}'
+    response = client.get(url, headers={'Session-ID': session_id})
+
+    # Check if the current month is not marked private (it changes often)
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    # Check if the ETag does not come back after the month versions are lost (e.g. Redis restarted)
+    cache.r.delete(cache.get_user_month_versions_key("user@login.com"))
+    again = client.get(url, headers={'Session-ID': session_id, 'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 200
+    assert again.headers['ETag'] != response.headers['ETag']
+
+
+def test_get_expenses_cache_hit_sends_cached_json():
+    """
+    Test that a cache hit sends the cached JSON inside the response as it is, without decoding it
+    """
+    session_id = insert_test_user()
+    user_id = get_user_id_from_email("user@login.com")
+    insert_test_expense(user_id, "Pizza", date="2025-01-05", serial_number=1)
+    client = app.test_client()
+    first = client.get('/get_expenses?month=1&year=2025', headers={'Session-ID': session_id})
+    cached_json = cache.get_cached_user_expenses_json("user@login.com", 1, 2025)
+
+    # Check if the second response body is the cached text in the envelope, and json.loads is never called
+    with patch('db.cache.json.loads') as loads:
+        second = client.get('/get_expenses?month=1&year=2025', headers={'Session-ID': session_id})
+        loads.assert_not_called()
+    assert second.data == f'{{"expenses":{cached_json}}}\n'.encode()
+    assert second.mimetype == 'application/json'
+    assert second.json == first.json
+
+
+def test_get_expenses_cache_hit_same_bytes_as_miss():
+    """
+    Test that a cache hit sends exactly the bytes of the miss that filled the cache (one ETag, one body),
+    for the whole month and for a page, with non-ASCII titles and keys that need sorting
+    """
+    session_id = insert_test_user()
+    user_id = get_user_id_from_email("user@login.com")
+    insert_test_expense(user_id, "Pizza", date="2025-01-05", serial_number=1)
+    insert_test_expense(user_id, "קפה", date="2025-01-06", serial_number=2)
+    client = app.test_client()
+
+    # Check if the month miss and hit bodies are identical
+    miss = client.get('/get_expenses?month=1&year=2025', headers={'Session-ID': session_id})
+    hit = client.get('/get_expenses?month=1&year=2025', headers={'Session-ID': session_id})
+    assert cache.get_cached_user_expenses_json("user@login.com", 1, 2025) is not None
+    assert hit.data == miss.data
+    assert hit.headers['ETag'] == miss.headers['ETag']
+
+    # Check if the cached month is what the app's JSON provider writes
+    with app.app_context():
+        assert miss.data == app.json.response({"expenses": miss.json["expenses"]}).get_data()
+
+    # Check if the page miss and hit bodies are identical
+    page_miss = client.get('/get_expenses?month=1&year=2025&limit=1', headers={'Session-ID': session_id})
+    page_hit = client.get('/get_expenses?month=1&year=2025&limit=1', headers={'Session-ID': session_id})
+    assert page_hit.data == page_miss.data
+
+
 def test_pass():
     """
     Test that the test passes (to clean up the test database)
@@ -0,0 +1,346 @@
+# FinBrain Project - test_import_expenses.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+from db import users_collection, expenses_collection, counters_collection, db
+import io
+import os
+import time
+import tempfile
+import threading
+import tracemalloc
+import pytest
+from app import app
+import services.logicconnection as lc
+import services.logicimport as li
+from unittest.mock import patch
+
+
+# Clean the users, expenses and counters collections before each test
+@pytest.fixture(autouse=True)
+def clean_collections():
+    # Check if the database is FINBRAIN or FINBRAINTEST to make sure we are using the correct database for the test
+    if db.name == 'FinBrainTest':
+        users_collection.delete_many({})
+        expenses_collection.delete_many({})
+        counters_collection.delete_many({})
+
+
+# Clean Redis sessions and import jobs before each test
+@pytest.fixture(autouse=True)
+def clean_sessions():
+    keys = lc.r.keys("session:*") + lc.r.keys("import_job:*")
+    if keys:
+        lc.r.delete(*keys)
+
+
+# Use a fixed exchange rate and category so no API or model is needed
+@pytest.fixture(autouse=True)
+def fixed_rate_and_category():
+    with patch('services.logicexpenses.get_usd_to_ils_rate', return_value=4.0) as rate, \
+         patch('services.logicexpenses.classify_expenses', side_effect=lambda titles: ["Other"] * len(titles)) as classify:
+        yield rate, classify
+
+
+def insert_test_user(email="user@import.com", session_id="import_s1"):
+    """
+    Insert a test user into the database and create a valid session
+    """
+    users_collection.insert_one({"firstName": "User", "lastName": "Import", "email": email, "password": "Secret123"})
+    lc.r.hset(f"session:{session_id}", mapping={"email": email, "last_seen": lc.get_now_utc().isoformat()})
+    lc.r.expire(f"session:{session_id}", lc.SESSION_TTL_SECONDS)
+    return session_id
+
+
+def write_csv(text):
+    """
+    Write CSV text to a temporary file and return its path
+    """
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    return path
+
+
+def upload(client, session_id, text, currency=None):
+    """
+    Upload CSV text to /import_expenses
+    """
+    data = {'file': (io.BytesIO(text.encode('utf-8')), 'statement.csv')}
+    if currency:
+        data['currency'] = currency
+    return client.post('/import_expenses', data=data, content_type='multipart/form-data', headers={'Session-ID': session_id})
+
+
+def wait_for_job(client, session_id, job_id, timeout=5):
+    """
+    Poll /import_status until the job is no longer running
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = client.get(f'/import_status?job_id={job_id}', headers={'Session-ID': session_id})
+        if response.json['status'] != 'running':
+            return response.json
+        time.sleep(0.05)
+    raise AssertionError("Import did not finish")
+
+
+def test_import_expenses():
+    """
+    Test that an uploaded CSV is imported in the background and the status ends with a summary
+    """
+    session_id = insert_test_user()
+    client = app.test_client()
+    text = "Title,Date,Amount,Currency\nPizza,2025-01-15,40,ILS\nTaxi,2025-02-01,10,usd\n"
+
+    response = upload(client, session_id, text)
+    assert response.status_code == 202
+
+    # Check if both rows were imported with converted amounts and serial numbers
+    status = wait_for_job(client, session_id, response.json['job_id'])
+    assert status['status'] == 'done'
+    assert status['rows_read'] == 2 and status['added'] == 2 and status['failed'] == 0
+    expenses = sorted(expenses_collection.find({}), key=lambda e: e['serial_number'])
+    assert [e['serial_number'] for e in expenses] == [1, 2]
+    assert expenses[0]['amount_usd'] == 10.0
+    assert expenses[1]['amount_ils'] == 40.0
+
+
+def test_import_reports_invalid_rows():
+    """
+    Test that rows failing the add_expense rules are counted and reported with their line
+    """
+    session_id = insert_test_user()
+    text = "title,date,amount\nGood,2025-01-15,40\nBad title!,2025-01-15,40\nNo amount,2025-01-15,\n\nFuture,2999-01-01,5\n"
+    path = write_csv(text)
+
+    li.run_import_job("job1", path, {'email': "user@import.com", 'user_id': users_collection.find_one()['_id']})
+
+    # Check if the good row was added and the errors point at their lines (the blank line is skipped)
+    job = lc.r.hgetall(li.get_import_job_key("job1"))
+    assert job['status'] == 'done'
+    assert job['added'] == '1' and job['failed'] == '3'
+    assert '"line": 3, "message": "Invalid title"' in job['errors']
+    assert '"line": 6' in job['errors']
+    assert not os.path.exists(path)
+
+
+def test_import_uses_chunks(monkeypatch, fixed_rate_and_category):
+    """
+    Test that the file is classified and inserted chunk by chunk with unordered bulk inserts
+    """
+    monkeypatch.setattr(li, "IMPORT_CHUNK_SIZE", 3)
+    rate, classify = fixed_rate_and_category
+    insert_test_user()
+    rows = "".join(f"Row {i},2025-01-{1 + i % 2:02d},5,ILS\n" for i in range(10))
+    path = write_csv("title,date,amount,currency\n" + rows)
+
+    with patch.object(li.expenses_collection, "insert_many", wraps=li.expenses_collection.insert_many) as insert_many:
+        li.run_import_job("job2", path, {'email': "user@import.com", 'user_id': users_collection.find_one()['_id']})
+
+    # Check if 10 rows made 4 chunks, each classified and inserted once, and each date's rate was fetched once
+    assert classify.call_count == 4
+    assert insert_many.call_count == 4
+    assert all(call.kwargs['ordered'] is False for call in insert_many.call_args_list)
+    assert rate.call_count == 2
+    assert expenses_collection.count_documents({}) == 10
+
+
+def test_import_invalidates_each_month_once():
+    """
+    Test that the cache of each imported month is deleted once at the end
+    """
+    insert_test_user()
+    path = write_csv("title,date,amount,currency\nA,2025-01-10,5,ILS\nB,2025-01-11,5,ILS\nC,2025-03-01,5,ILS\n")
+
+    with patch('services.logicimport.cache.delete_user_expenses_cache') as delete_cache:
+        li.run_import_job("job3", path, {'email': "user@import.com", 'user_id': users_collection.find_one()['_id']})
+
+    # Check if January and March were invalidated once each
+    assert sorted(call.args for call in delete_cache.call_args_list) == [("user@import.com", 1, 2025), ("user@import.com", 3, 2025)]
+
+
+def test_import_missing_columns():
+    """
+    Test that a file without the required columns fails with an error
+    """
+    insert_test_user()
+    path = write_csv("name,price\nPizza,40\n")
+
+    li.run_import_job("job4", path, {'email': "user@import.com", 'user_id': users_collection.find_one()['_id']})
+
+    # Check if the job failed and explains why
+    job = lc.r.hgetall(li.get_import_job_key("job4"))
+    assert job['status'] == 'failed'
+    assert 'Missing columns: title, date, amount' in job['errors']
+
+
+def test_read_chunks_memory_is_flat(monkeypatch):
+    """
+    Test that reading a large file keeps memory bounded by the chunk size, not the file size
+    """
+    monkeypatch.setattr(li, "IMPORT_CHUNK_SIZE", 100)
+    path = write_csv("title,date,amount,currency\n" + "Some expense title,2025-01-15,123.45,ILS\n" * 50000)
+
+    tracemalloc.start()
+    chunks = 0
+    for chunk in li.read_chunks(path, 'ILS'):
+        chunks += 1
+        assert len(chunk) <= 100
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    os.remove(path)
+
+    # Check if every row was read and the peak stayed far below the size of the file (about 2 MB)
+    assert chunks == 500
+    assert peak < 512 * 1024
+
+
+def test_import_status_of_other_user():
+    """
+    Test that a user cannot see another user's import
+    """
+    session_id = insert_test_user()
+    other_session_id = insert_test_user(email="other@import.com", session_id="import_s2")
+    client = app.test_client()
+    job_id = upload(client, session_id, "title,date,amount\nA,2025-01-10,5\n").json['job_id']
+    wait_for_job(client, session_id, job_id)
+
+    # Check if the other user gets 404
+    response = client.get(f'/import_status?job_id={job_id}', headers={'Session-ID': other_session_id})
+    assert response.status_code == 404
+
+
+def test_import_rejected_requests():
+    """
+    Test that a missing file, a bad currency and the demo user are rejected
+    """
+    session_id = insert_test_user()
+    client = app.test_client()
+
+    # Check if a request without a file is rejected
+    response = client.post('/import_expenses', data={}, content_type='multipart/form-data', headers={'Session-ID': session_id})
+    assert response.status_code == 400
+
+    # Check if an unknown default currency is rejected
+    assert upload(client, session_id, "title,date,amount\n", currency="EUR").status_code == 400
+
+    # Check if the demo user is rejected
+    demo_session_id = insert_test_user(email="demo", session_id="import_demo")
+    assert upload(client, demo_session_id, "title,date,amount\n").status_code == 400
+
+
+def test_import_file_too_large(monkeypatch):
+    """
+    Test that a file larger than the limit is rejected
+    """
+    monkeypatch.setattr(li, "IMPORT_MAX_FILE_BYTES", 10)
+    session_id = insert_test_user()
+    client = app.test_client()
+
+    assert upload(client, session_id, "title,date,amount\nA,2025-01-10,5\n").status_code == 413
+
+
+def test_import_invalidates_months_after_each_chunk(monkeypatch):
+    """
+    Test that the cache of each month is deleted as soon as the chunk that added to it is inserted,
+    not only when the whole import ends
+    """
+    monkeypatch.setattr(li, "IMPORT_CHUNK_SIZE", 2)
+    insert_test_user()
+    text = "title,date,amount\nA,2025-01-10,5\nB,2025-01-11,5\nC,2025-02-10,5\nD,2025-03-10,5\n"
+    path = write_csv(text)
+    events = []
+
+    import_chunk = li.import_chunk
+    def recorded_import_chunk(chunk, *args):
+        events.append(('chunk', len(chunk)))
+        return import_chunk(chunk, *args)
+
+    with patch('services.logicimport.import_chunk', side_effect=recorded_import_chunk), \
+         patch('db.cache.delete_user_expenses_cache', side_effect=lambda email, month, year: events.append(('delete', year, month))):
+        li.run_import_job("job_chunks", path, {'email': "user@import.com", 'user_id': users_collection.find_one()['_id']})
+
+    # Check if each chunk's months were invalidated before the next chunk started
+    assert events == [('chunk', 2), ('delete', 2025, 1), ('chunk', 2), ('delete', 2025, 2), ('delete', 2025, 3)]
+
+
+def test_request_body_over_limit_rejected(monkeypatch):
+    """
+    Test that a request body larger than MAX_CONTENT_LENGTH is rejected before the upload is saved
+    """
+    # Check if the configured limit leaves room for a file of the import size
+    assert app.config['MAX_CONTENT_LENGTH'] > li.IMPORT_MAX_FILE_BYTES
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 100)
+    session_id = insert_test_user()
+    client = app.test_client()
+
+    # Check if the upload gets a JSON 413 and no temporary file is written
+    with patch('services.logicimport.save_upload') as save_upload:
+        response = upload(client, session_id, "title,date,amount\n" + "A,2025-01-10,5\n" * 20)
+    assert response.status_code == 413
+    assert 'message' in response.json
+    save_upload.assert_not_called()
+
+
+def test_import_status_stale_heartbeat_reported_failed():
+    """
+    Test that a running job whose heartbeat stopped (its worker died) is reported as failed,
+    and a running job with a fresh heartbeat is still running
+    """
+    session_id = insert_test_user()
+    client = app.test_client()
+    li.save_import_progress("job_dead", status='running', email="user@import.com", rows_read=500, added=500, failed=0,
+                            heartbeat_at=time.time() - li.IMPORT_HEARTBEAT_TIMEOUT_SECONDS - 1)
+    li.save_import_progress("job_alive", status='running', email="user@import.com", rows_read=0, added=0, failed=0,
+                            heartbeat_at=time.time())
+
+    # Check if the dead job is failed with an error and keeps its counts
+    dead = client.get('/import_status?job_id=job_dead', headers={'Session-ID': session_id})
+    assert dead.status_code == 200
+    assert dead.json['status'] == 'failed'
+    assert dead.json['added'] == 500
+    assert len(dead.json['errors']) == 1
+
+    # Check if the live job is still running
+    alive = client.get('/import_status?job_id=job_alive', headers={'Session-ID': session_id})
+    assert alive.json['status'] == 'running'
+
+
+def test_import_heartbeat_written_while_running(monkeypatch):
+    """
+    Test that the heartbeat thread keeps writing heartbeat_at until it is stopped
+    """
+    monkeypatch.setattr(li, "IMPORT_HEARTBEAT_SECONDS", 0.01)
+    li.save_import_progress("job_beat", status='running', heartbeat_at=0)
+    stop_event = threading.Event()
+    heartbeat = threading.Thread(target=li.run_import_heartbeat, args=("job_beat", stop_event))
+    heartbeat.start()
+    time.sleep(0.1)
+    stop_event.set()
+    heartbeat.join(timeout=1)
+
+    # Check if the heartbeat was refreshed and the thread stopped
+    assert float(lc.r.hgetall(li.get_import_job_key("job_beat"))['heartbeat_at']) > time.time() - 5
+    assert not heartbeat.is_alive()
+
+
+def test_import_status_redis_error():
+    """
+    Test that the import status answers 503 with Retry-After when Redis cannot be read
+    """
+    session_id = insert_test_user()
+    client = app.test_client()
+
+    # Check if the Redis error becomes a 503 instead of a 500
+    with patch('services.logicimport.r.hgetall', side_effect=Exception("Redis down")):
+        response = client.get('/import_status?job_id=job1', headers={'Session-ID': session_id})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(li.IMPORT_STATUS_RETRY_AFTER_SECONDS)
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
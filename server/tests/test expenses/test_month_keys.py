@@ -0,0 +1,146 @@
+# FinBrain Project - test_month_keys.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+from db import users_collection, expenses_collection, counters_collection, db
+import pytest
+from datetime import date
+from app import app
+import services.logicconnection as lc
+from db import cache
+from db import monthkeys
+import services.logicexpenses as le
+from unittest.mock import patch
+
+
+# Clean the collections, sessions and test cache before each test
+@pytest.fixture(autouse=True)
+def clean_collections():
+    # Check if the database is FINBRAIN or FINBRAINTEST to make sure we are using the correct database for the test
+    if db.name == 'FinBrainTest':
+        users_collection.delete_many({})
+        expenses_collection.delete_many({})
+        counters_collection.delete_many({})
+    keys = lc.r.keys("session:*")
+    if keys:
+        lc.r.delete(*keys)
+    cache.clear_test_cache()
+
+
+def insert_test_user():
+    """
+    Insert a test user into the database and create a valid session
+    """
+    user_id = users_collection.insert_one({"firstName": "User", "lastName": "Month", "email": "user@month.com", "password": "Secret123"}).inserted_id
+    lc.r.hset("session:month_s1", mapping={"email": "user@month.com", "last_seen": lc.get_now_utc().isoformat()})
+    lc.r.expire("session:month_s1", lc.SESSION_TTL_SECONDS)
+    return user_id
+
+
+def test_get_month_key():
+    """
+    Test that dates, ISO date strings and month strings give the same month_key
+    """
+    assert monthkeys.get_month_key(date(2025, 9, 10)) == 202509
+    assert monthkeys.get_month_key("2025-09-10") == 202509
+    assert monthkeys.get_month_key("2025-09-10T00:00:00") == 202509
+    assert monthkeys.get_month_key("2025-09") == 202509
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=3.7)
+@patch('services.logicexpenses.classify_expense', return_value="Food & Drinks")
+def test_add_expense_writes_month_key(_, __):
+    """
+    Test that a new expense gets its month_key
+    """
+    insert_test_user()
+    client = app.test_client()
+
+    client.post('/add_expense', json={"title": "Pizza", "amount": 40, "currency": "ILS", "date": "2025-03-15"}, headers={'Session-ID': 'month_s1'})
+
+    # Check if the month_key matches the date
+    assert expenses_collection.find_one({})['month_key'] == 202503
+
+
+def test_backfill_month_keys():
+    """
+    Test that the backfill sets month_key in batches, skips expenses that have it and can be repeated
+    """
+    expenses_collection.insert_many(
+        [{"user_id": "u1", "date": f"2025-{month:02d}-05"} for month in range(1, 6)] +
+        [{"user_id": "u1", "date": "2025-06-01", "month_key": 202506}, {"user_id": "u1", "date": "broken"}]
+    )
+
+    # Check if every expense without month_key was updated (two per batch)
+    assert monthkeys.backfill_month_keys(batch_size=2) == 6
+    assert sorted(e['month_key'] or 0 for e in expenses_collection.find({})) == [0, 202501, 202502, 202503, 202504, 202505, 202506]
+
+    # Check if running it again updates nothing
+    assert monthkeys.backfill_month_keys(batch_size=2) == 0
+
+
+def test_dashboard_uses_month_key_and_old_expenses():
+    """
+    Test that the dashboard counts expenses with month_key and older expenses without it
+    """
+    user_id = insert_test_user()
+    expenses_collection.insert_many([
+        {"user_id": user_id, "title": "New", "date": "2025-02-10", "month_key": 202502, "amount_ils": 100, "amount_usd": 27, "category": "Food & Drinks", "serial_number": 1},
+        {"user_id": user_id, "title": "Old", "date": "2025-02-11", "amount_ils": 50, "amount_usd": 13.5, "category": "Food & Drinks", "serial_number": 2},
+        {"user_id": user_id, "title": "Other month", "date": "2025-03-01", "month_key": 202503, "amount_ils": 999, "amount_usd": 270, "category": "Food & Drinks", "serial_number": 3},
+    ])
+    client = app.test_client()
+
+    response = client.get('/expenses_for_dashboard?chart=category_breakdown&currency=ILS&months=2025-02&categories=All', headers={'Session-ID': 'month_s1'})
+
+    # Check if both February expenses are counted and March is not
+    food = next(row for row in response.json['data'] if row['category'] == "Food & Drinks")
+    assert food['amount'] == 150
+
+    # Check if the result is the same after the backfill
+    monthkeys.backfill_month_keys()
+    response_after = client.get('/expenses_for_dashboard?chart=category_breakdown&currency=ILS&months=2025-02&categories=All', headers={'Session-ID': 'month_s1'})
+    assert response_after.json == response.json
+
+
+def test_demo_expenses_have_month_key():
+    """
+    Test that the seeded demo expenses get their month_key
+    """
+    with patch('services.logicconnection.hash_password', return_value='hash'):
+        lc.create_demo_user()
+
+    # Check if every demo expense has the month_key of its date
+    demo_expenses = list(expenses_collection.find({}))
+    assert demo_expenses
+    assert all(e['month_key'] == monthkeys.get_month_key(e['date']) for e in demo_expenses)
+
+
+def test_months_filter_without_fallback(monkeypatch):
+    """
+    Test that with MONTH_KEY_FALLBACK_ENABLED off the months filter is only the month_key lookup
+    and the dashboard still counts every expense after the backfill
+    """
+    user_id = insert_test_user()
+    expenses_collection.insert_many([
+        {"user_id": user_id, "title": "New", "date": "2025-02-10", "month_key": 202502, "amount_ils": 100, "amount_usd": 27, "category": "Food & Drinks", "serial_number": 1},
+        {"user_id": user_id, "title": "Old", "date": "2025-02-11", "amount_ils": 50, "amount_usd": 13.5, "category": "Food & Drinks", "serial_number": 2},
+    ])
+    monthkeys.backfill_month_keys()
+    monkeypatch.setattr(monthkeys, "MONTH_KEY_FALLBACK_ENABLED", False)
+
+    # Check if the filter has no $or and no date regex
+    assert le.get_months_filter(["2025-02", "2025-03"]) == {'month_key': {'$in': [202502, 202503]}}
+
+    # Check if both backfilled February expenses are counted
+    client = app.test_client()
+    response = client.get('/expenses_for_dashboard?chart=category_breakdown&currency=ILS&months=2025-02&categories=All', headers={'Session-ID': 'month_s1'})
+    food = next(row for row in response.json['data'] if row['category'] == "Food & Drinks")
+    assert food['amount'] == 150
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
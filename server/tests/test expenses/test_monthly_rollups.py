@@ -0,0 +1,220 @@
+# FinBrain Project - test_monthly_rollups.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+from db import users_collection, expenses_collection, counters_collection, monthly_rollups_collection, db
+import pytest
+from app import app
+import services.logicconnection as lc
+from db import cache
+from db import rollups
+from unittest.mock import patch
+
+
+# Clean the collections, sessions and test cache before each test
+@pytest.fixture(autouse=True)
+def clean_collections():
+    # Check if the database is FINBRAIN or FINBRAINTEST to make sure we are using the correct database for the test
+    if db.name == 'FinBrainTest':
+        users_collection.delete_many({})
+        expenses_collection.delete_many({})
+        counters_collection.delete_many({})
+        monthly_rollups_collection.delete_many({})
+    keys = lc.r.keys("session:*")
+    if keys:
+        lc.r.delete(*keys)
+    cache.clear_test_cache()
+
+
+def insert_test_user():
+    """
+    Insert a test user into the database and create a valid session
+    """
+    user_id = users_collection.insert_one({"firstName": "User", "lastName": "Rollup", "email": "user@rollup.com", "password": "Secret123"}).inserted_id
+    lc.r.hset("session:rollup_s1", mapping={"email": "user@rollup.com", "last_seen": lc.get_now_utc().isoformat()})
+    lc.r.expire("session:rollup_s1", lc.SESSION_TTL_SECONDS)
+    return user_id
+
+
+def add_expense(client, title, amount, date):
+    """
+    Add an expense through /add_expense
+    """
+    return client.post('/add_expense', json={"title": title, "amount": amount, "currency": "ILS", "date": date}, headers={'Session-ID': 'rollup_s1'})
+
+
+def get_rollup(user_id, month, category):
+    """
+    Get one rollup document
+    """
+    return monthly_rollups_collection.find_one({'user_id': user_id, 'month': month, 'category': category})
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=4.0)
+@patch('services.logicexpenses.classify_expense', return_value="Food & Drinks")
+def test_writes_keep_rollups_in_sync(_, __):
+    """
+    Test that add, category update and delete keep the rollups equal to the expenses
+    """
+    user_id = insert_test_user()
+    client = app.test_client()
+    add_expense(client, "Pizza", 40, "2025-01-15")
+    add_expense(client, "Burger", 60, "2025-01-16")
+    add_expense(client, "Salad", 20, "2025-02-01")
+
+    # Check if the January rollup has both expenses in both currencies
+    january = get_rollup(user_id, "2025-01", "Food & Drinks")
+    assert (january['count'], january['amount_ils'], january['amount_usd']) == (2, 100, 25)
+
+    # Move one expense to another category and delete another
+    client.post('/update_expense_category', json={"serial_number": 1, "current_category": "Food & Drinks", "new_category": "Other"}, headers={'Session-ID': 'rollup_s1'})
+    client.post('/delete_expense', json={"serial_number": 3}, headers={'Session-ID': 'rollup_s1'})
+
+    # Check if the rollups moved and the emptied February rollup was deleted
+    assert get_rollup(user_id, "2025-01", "Food & Drinks")['count'] == 1
+    assert get_rollup(user_id, "2025-01", "Other")['amount_ils'] == 40
+    assert get_rollup(user_id, "2025-02", "Food & Drinks") is None
+
+    # Check if the reconcile job finds nothing to repair
+    assert rollups.reconcile_rollups(user_id, fix=False) == {'checked': 2, 'missing': 0, 'extra': 0, 'mismatched': 0}
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=4.0)
+@patch('services.logicexpenses.classify_expenses')
+def test_add_expenses_updates_rollups_once_per_group(mock_classify_expenses, _):
+    """
+    Test that a batch add updates each (month, category) rollup with one update
+    """
+    mock_classify_expenses.side_effect = lambda titles: ["Transportation"] * len(titles)
+    user_id = insert_test_user()
+    client = app.test_client()
+    rows = [{"title": f"Taxi {i}", "amount": 10, "currency": "ILS", "date": "2025-03-05"} for i in range(5)]
+
+    with patch('db.rollups.increment_rollup', wraps=rollups.increment_rollup) as increment:
+        client.post('/add_expenses', json={"expenses": rows}, headers={'Session-ID': 'rollup_s1'})
+
+    # Check if the five expenses were added with one update
+    assert increment.call_count == 1
+    assert get_rollup(user_id, "2025-03", "Transportation")['count'] == 5
+
+
+def test_reconcile_repairs_rollups():
+    """
+    Test that the reconcile job adds missing, fixes wrong and deletes extra rollups
+    """
+    user_id = insert_test_user()
+    expenses_collection.insert_many([
+        {"user_id": user_id, "date": "2025-04-01", "amount_ils": 10, "amount_usd": 2.5, "category": "Other", "serial_number": 1},
+        {"user_id": user_id, "date": "2025-04-02", "amount_ils": 30, "amount_usd": 7.5, "category": "Other", "serial_number": 2},
+        {"user_id": user_id, "date": "2025-05-01", "amount_ils": 8, "amount_usd": 2, "category": "Transportation", "serial_number": 3},
+    ])
+    monthly_rollups_collection.insert_many([
+        {"user_id": user_id, "month": "2025-04", "category": "Other", "amount_ils": 10, "amount_usd": 2.5, "count": 1},
+        {"user_id": user_id, "month": "2025-06", "category": "Other", "amount_ils": 99, "amount_usd": 25, "count": 3},
+    ])
+
+    # Check if the differences are reported without changing anything on a dry run
+    assert rollups.reconcile_rollups(user_id, fix=False) == {'checked': 2, 'missing': 1, 'extra': 1, 'mismatched': 1}
+    assert monthly_rollups_collection.count_documents({}) == 2
+
+    # Check if the repair makes the rollups match the expenses
+    rollups.reconcile_rollups(user_id)
+    assert get_rollup(user_id, "2025-04", "Other")['amount_ils'] == 40
+    assert get_rollup(user_id, "2025-05", "Transportation")['count'] == 1
+    assert get_rollup(user_id, "2025-06", "Other") is None
+    assert rollups.reconcile_rollups(user_id, fix=False) == {'checked': 2, 'missing': 0, 'extra': 0, 'mismatched': 0}
+
+
+def test_dashboard_from_rollups_matches_expenses(monkeypatch):
+    """
+    Test that both charts read from the rollups return the same JSON as from the expenses, without reading the expenses
+    """
+    user_id = insert_test_user()
+    expenses_collection.insert_many([
+        {"user_id": user_id, "date": "2025-01-05", "amount_ils": 120.5, "amount_usd": 32.57, "category": "Food & Drinks", "serial_number": 1},
+        {"user_id": user_id, "date": "2025-01-20", "amount_ils": 300, "amount_usd": 81.08, "category": "Housing & Bills", "serial_number": 2},
+        {"user_id": user_id, "date": "2025-02-11", "amount_ils": 45.25, "amount_usd": 12.23, "category": "Food & Drinks", "serial_number": 3},
+        {"user_id": user_id, "date": "2025-03-01", "amount_ils": 80, "amount_usd": 21.62, "category": "Unknown", "serial_number": 4},
+    ])
+    rollups.reconcile_rollups(user_id)
+    client = app.test_client()
+    urls = [
+        '/expenses_for_dashboard?chart=category_breakdown&currency=ILS&months=2025-01&months=2025-03&categories=All',
+        '/expenses_for_dashboard?chart=monthly_comparison&currency=USD&months=2025-01&months=2025-02&months=2025-03&categories=All',
+        '/expenses_for_dashboard?chart=monthly_comparison&currency=ILS&months=2025-01&months=2025-02&categories=Food %26 Drinks',
+    ]
+    from_expenses = [client.get(url, headers={'Session-ID': 'rollup_s1'}).get_data() for url in urls]
+
+    monkeypatch.setattr(rollups, "DASHBOARD_ROLLUPS_ENABLED", True)
+    cache.clear_test_cache()
+    with patch('services.logicexpenses.expenses_collection.aggregate') as aggregate:
+        from_rollups = [client.get(url, headers={'Session-ID': 'rollup_s1'}).get_data() for url in urls]
+        aggregate.assert_not_called()
+
+    # Check if the responses are byte for byte the same
+    assert from_rollups == from_expenses
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=4.0)
+@patch('services.logicexpenses.classify_expense', return_value="Food & Drinks")
+def test_category_update_uses_current_category(_, __):
+    """
+    Test that a category update whose first read is stale (the category changed in between)
+    is rejected and does not move the rollups from the wrong category
+    """
+    user_id = insert_test_user()
+    client = app.test_client()
+    add_expense(client, "Pizza", 40, "2025-01-15")
+    stale_expense = expenses_collection.find_one({'user_id': user_id, 'serial_number': 1})
+
+    # Another writer (like the background classifier) moves the expense after the first read
+    expenses_collection.update_one({'_id': stale_expense['_id']}, {'$set': {'category': 'Transportation'}})
+    rollups.move_expense_category(stale_expense, 'Transportation')
+
+    # Only the first read (by user and serial number) sees the old expense
+    find_one = expenses_collection.find_one
+    stale_find_one = lambda filter, *args, **kwargs: stale_expense if 'category' not in filter else find_one(filter, *args, **kwargs)
+    with patch.object(expenses_collection, 'find_one', side_effect=stale_find_one):
+        response = client.post('/update_expense_category', json={"serial_number": 1, "current_category": "Food & Drinks", "new_category": "Other"}, headers={'Session-ID': 'rollup_s1'})
+
+    # Check if the update was rejected and the rollups still match the expense
+    assert response.status_code == 400
+    assert expenses_collection.find_one({'_id': stale_expense['_id']})['category'] == 'Transportation'
+    assert get_rollup(user_id, "2025-01", "Other") is None
+    assert rollups.reconcile_rollups(user_id, fix=False)['mismatched'] == 0
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate', return_value=4.0)
+@patch('services.logicexpenses.classify_expense', return_value="Food & Drinks")
+def test_delete_removes_rollup_of_current_category(_, __):
+    """
+    Test that deleting an expense whose category changed after it was read removes it from the rollup
+    of the category it had when it was deleted (no phantom amount is left)
+    """
+    user_id = insert_test_user()
+    client = app.test_client()
+    add_expense(client, "Pizza", 40, "2025-01-15")
+    stale_expense = expenses_collection.find_one({'user_id': user_id, 'serial_number': 1})
+
+    # Another writer (like the background classifier) moves the expense after the first read
+    expenses_collection.update_one({'_id': stale_expense['_id']}, {'$set': {'category': 'Transportation'}})
+    rollups.move_expense_category(stale_expense, 'Transportation')
+
+    # A plain read of the expense (no projection) sees the old category
+    find_one = expenses_collection.find_one
+    stale_find_one = lambda filter, *args, **kwargs: stale_expense if not args and not kwargs else find_one(filter, *args, **kwargs)
+    with patch.object(expenses_collection, 'find_one', side_effect=stale_find_one):
+        response = client.post('/delete_expense', json={"serial_number": 1}, headers={'Session-ID': 'rollup_s1'})
+
+    # Check if the expense is gone and no rollup is left for it
+    assert response.status_code == 200
+    assert expenses_collection.count_documents({'user_id': user_id}) == 0
+    assert get_rollup(user_id, "2025-01", "Transportation") is None
+    assert get_rollup(user_id, "2025-01", "Food & Drinks") is None
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
@@ -0,0 +1,147 @@
+# FinBrain Project - test_serial_numbers.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+from db import users_collection, expenses_collection, counters_collection, db
+import pytest
+import threading
+from bson import ObjectId
+from db import counters
+from app import app
+import services.logicconnection as lc
+from unittest.mock import patch
+
+
+# Clean the users, expenses and counters collections before each test
+@pytest.fixture(autouse=True)
+def clean_collections():
+    # Check if the database is FINBRAIN or FINBRAINTEST to make sure we are using the correct database for the test
+    if db.name == 'FinBrainTest':
+        users_collection.delete_many({})
+        expenses_collection.delete_many({})
+        counters_collection.delete_many({})
+
+
+def insert_test_user():
+    """
+    Insert a test user into the database and create a valid session
+    """
+    user_id = users_collection.insert_one({
+        "firstName": "User",
+        "lastName": "Serial",
+        "email": "user@serial.com",
+        "password": "Secret123",
+    }).inserted_id
+    lc.r.hset("session:serial_s1", mapping={"email": "user@serial.com", "last_seen": lc.get_now_utc().isoformat()})
+    lc.r.expire("session:serial_s1", lc.SESSION_TTL_SECONDS)
+    return user_id
+
+
+def test_serial_numbers_start_at_one():
+    """
+    Test that a new user's serial numbers start at 1 and increase by 1
+    """
+    user_id = ObjectId()
+    assert counters.next_serial_number(user_id) == 1
+    assert counters.next_serial_number(user_id) == 2
+
+
+def test_counter_seeded_from_existing_expenses():
+    """
+    Test that a user without a counter continues after their highest existing serial number
+    """
+    user_id = ObjectId()
+    expenses_collection.insert_many([
+        {"user_id": user_id, "title": "Old", "serial_number": 1},
+        {"user_id": user_id, "title": "Old", "serial_number": 7},
+    ])
+    assert counters.next_serial_number(user_id) == 8
+
+
+def test_reserve_block():
+    """
+    Test that reserving a block returns its first number and the next allocation follows the block
+    """
+    user_id = ObjectId()
+    assert counters.reserve_serial_numbers(user_id, 5) == 1
+    assert counters.reserve_serial_numbers(user_id, 3) == 6
+    assert counters.next_serial_number(user_id) == 9
+
+    # Check if an empty block is rejected
+    with pytest.raises(ValueError):
+        counters.reserve_serial_numbers(user_id, 0)
+
+
+def test_concurrent_allocations_are_unique():
+    """
+    Test that concurrent allocations for the same user never hand out the same number
+    """
+    user_id = ObjectId()
+    results = []
+    lock = threading.Lock()
+
+    def allocate():
+        for _ in range(20):
+            serial_number = counters.next_serial_number(user_id)
+            with lock:
+                results.append(serial_number)
+
+    threads = [threading.Thread(target=allocate) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Check if all 100 numbers are different and consecutive
+    assert sorted(results) == list(range(1, 101))
+
+
+def test_backfill_seeds_counters():
+    """
+    Test that the backfill seeds every user's counter from their highest serial number
+    """
+    first_user, second_user = ObjectId(), ObjectId()
+    expenses_collection.insert_many([
+        {"user_id": first_user, "serial_number": 3},
+        {"user_id": first_user, "serial_number": 12},
+        {"user_id": second_user, "serial_number": 4},
+    ])
+
+    # Check if both counters are written and allocation continues after them
+    assert counters.backfill_serial_counters() == 2
+    assert counters.next_serial_number(first_user) == 13
+    assert counters.next_serial_number(second_user) == 5
+
+    # Check if running the backfill again does not move a counter back
+    counters.backfill_serial_counters()
+    assert counters.next_serial_number(first_user) == 14
+
+
+@patch('services.logicexpenses.get_usd_to_ils_rate')
+@patch('services.logicexpenses.classify_expense')
+def test_add_expense_uses_counter(mock_classify_expense, mock_get_usd_to_ils_rate):
+    """
+    Test that add_expense takes its serial numbers from the counter without sorting the expenses
+    """
+    mock_get_usd_to_ils_rate.return_value = 3.7
+    mock_classify_expense.return_value = "Food & Drinks"
+    user_id = insert_test_user()
+    client = app.test_client()
+    data = {"title": "Pizza", "amount": 50, "currency": "ILS", "date": "2025-01-15"}
+
+    with patch.object(expenses_collection, "find_one", wraps=expenses_collection.find_one) as find_one:
+        client.post('/add_expense', json=data, headers={'Session-ID': 'serial_s1'})
+        client.post('/add_expense', json=data, headers={'Session-ID': 'serial_s1'})
+
+    # Check if the expenses got 1 and 2 and no last-serial lookup was made after the counter existed
+    serial_numbers = sorted(e['serial_number'] for e in expenses_collection.find({"user_id": user_id}))
+    assert serial_numbers == [1, 2]
+    assert find_one.call_count == 1
+    lc.r.delete("session:serial_s1")
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
@@ -98,7 +98,7 @@ def test_add_expense_invalid_json():
 def test_get_expenses_ok(monkeypatch):
     """GET /get_expenses returns 200 and forwards params to handler."""
 
-    def fake_get(month, year, session_id):
+    def fake_get(month, year, session_id, limit=None, after=None, if_none_match=None):
         """Fake get expenses handler."""
         return jsonify({"month": month, "year": year, "sid": session_id, "items": []}), 200
 
@@ -120,7 +120,7 @@ def test_get_expenses_ok(monkeypatch):
 def test_expenses_for_dashboard_ok(monkeypatch):
     """GET /expenses_for_dashboard returns 200 with parsed lists and params."""
 
-    def fake_dashboard(chart, currency, months, categories, session_id):
+    def fake_dashboard(chart, currency, months, categories, session_id, if_none_match=None):
         """Fake get expenses for dashboard handler."""
         return (
             jsonify({
@@ -155,6 +155,20 @@ def test_expenses_for_dashboard_ok(monkeypatch):
     assert data["sid"] == "sid2"
 
 
+def test_metrics_ok():
+    """GET /metrics returns the worker's counters and observations."""
+    # Create a test client
+    client = flask_app.app.test_client()
+
+    # Send a GET request to the metrics route
+    resp = client.get("/metrics")
+
+    # Check if the response is successful
+    assert resp.status_code == 200
+    assert "counters" in resp.get_json()
+    assert "observations" in resp.get_json()
+
+
 def test_pass():
     """
     Test that the test passes (to clean up the test database)
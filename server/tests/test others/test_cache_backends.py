@@ -0,0 +1,170 @@
+# FinBrain Project - test_cache_backends.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+import pytest
+import time
+import threading
+from db import cache
+from db.backends import InMemoryBackend
+
+
+# Run every test against the in-process backend, and against Redis when it is the configured backend
+BACKENDS = ['memory', 'redis'] if cache.CACHE_BACKEND == 'redis' else ['memory']
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    if request.param == 'memory':
+        yield InMemoryBackend()
+        return
+    yield cache.r
+    for key in cache.r.keys("test_backend:*"):
+        cache.r.delete(key)
+
+
+def test_setex_and_get(backend):
+    """
+    Test that a value stored with setex can be read back and deleted
+    """
+    backend.setex("test_backend:value", 60, "hello")
+
+    # Check if the value is returned as a string and can be deleted
+    assert backend.get("test_backend:value") == "hello"
+    assert backend.delete("test_backend:value") == 1
+    assert backend.get("test_backend:value") is None
+
+
+def test_value_expires(backend):
+    """
+    Test that a value is gone after its TTL
+    """
+    backend.setex("test_backend:short", 1, 5)
+    assert backend.get("test_backend:short") == "5"
+    time.sleep(1.1)
+    assert backend.get("test_backend:short") is None
+
+
+def test_hash_set_get_and_expire(backend):
+    """
+    Test that hash fields are stored as strings and the hash expires
+    """
+    backend.hset("test_backend:hash", mapping={"email": "a@b.com", "count": 3})
+    backend.expire("test_backend:hash", 1)
+
+    # Check if all fields are returned as strings
+    assert backend.hgetall("test_backend:hash") == {"email": "a@b.com", "count": "3"}
+    time.sleep(1.1)
+    assert backend.hgetall("test_backend:hash") == {}
+
+
+def test_touch_hash(backend):
+    """
+    Test that touch_hash returns the hash, updates one field and resets the TTL
+    """
+    backend.hset("test_backend:session", mapping={"email": "a@b.com", "last_seen": "old"})
+    backend.expire("test_backend:session", 5)
+
+    # Check if the old data is returned and the field and TTL are updated
+    assert backend.touch_hash("test_backend:session", "last_seen", "new", 100) == {"email": "a@b.com", "last_seen": "old"}
+    assert backend.hgetall("test_backend:session")["last_seen"] == "new"
+    assert backend.ttl("test_backend:session") > 5
+
+
+def test_touch_hash_missing_key(backend):
+    """
+    Test that touch_hash does not create a missing hash
+    """
+    assert backend.touch_hash("test_backend:missing", "last_seen", "now", 100) == {}
+    assert backend.exists("test_backend:missing") == 0
+
+
+def test_scan_and_keys(backend):
+    """
+    Test that scan_iter and keys find keys by pattern
+    """
+    backend.setex("test_backend:user:a:month:2025-01", 60, "[]")
+    backend.setex("test_backend:user:a:month:2025-02", 60, "[]")
+    backend.setex("test_backend:user:b:month:2025-01", 60, "[]")
+
+    # Check if only the keys of user a are found
+    expected = {"test_backend:user:a:month:2025-01", "test_backend:user:a:month:2025-02"}
+    assert set(backend.scan_iter(match="test_backend:user:a:*")) == expected
+    assert set(backend.keys("test_backend:user:a:*")) == expected
+
+
+def test_memory_backend_is_thread_safe():
+    """
+    Test that concurrent writers do not lose hash fields
+    """
+    backend = InMemoryBackend()
+
+    def write(thread_index):
+        for i in range(200):
+            backend.hset("test_backend:shared", f"{thread_index}:{i}", i)
+
+    threads = [threading.Thread(target=write, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Check if every field written by every thread is there
+    assert len(backend.hgetall("test_backend:shared")) == 8 * 200
+
+
+def test_memory_backend_rejects_lua_scripts():
+    """
+    Test that Lua scripts fail when called on the in-process backend (callers fall back)
+    """
+    script = InMemoryBackend().register_script("return 1")
+    with pytest.raises(NotImplementedError):
+        script(keys=[], args=[])
+
+
+def test_update_value_keeps_ttl(backend):
+    """
+    Test that update_value replaces a value without touching its TTL, and does not create missing keys
+    """
+    backend.setex("test_backend:list", 100, "a")
+
+    # Check if the value is updated and the TTL kept
+    assert backend.update_value("test_backend:list", lambda value: value + "b") is True
+    assert backend.get("test_backend:list") == "ab"
+    assert 0 < backend.ttl("test_backend:list") <= 100
+
+    # Check if a missing key is not created
+    assert backend.update_value("test_backend:missing", lambda value: "new") is False
+    assert backend.get("test_backend:missing") is None
+
+
+def test_mget_and_incr(backend):
+    """
+    Test that mget returns the values in order (None for missing keys) and incr counts from 0
+    """
+    backend.setex("test_backend:a", 60, "1")
+
+    # Check if the values come back in the order of the keys
+    assert backend.mget(["test_backend:a", "test_backend:missing"]) == ["1", None]
+
+    # Check if incr starts a missing counter at 0
+    assert backend.incr("test_backend:counter") == 1
+    assert backend.incr("test_backend:counter") == 2
+    assert backend.get("test_backend:counter") == "2"
+
+
+def test_hsetnx(backend):
+    """
+    Test that hsetnx sets a hash field only if it does not exist yet
+    """
+    # Check if the first value is kept
+    assert backend.hsetnx("test_backend:versions", "2025-01", "a")
+    assert not backend.hsetnx("test_backend:versions", "2025-01", "b")
+    assert backend.hgetall("test_backend:versions") == {"2025-01": "a"}
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
@@ -0,0 +1,114 @@
+# FinBrain Project - test_indexes.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+import pytest
+from unittest.mock import patch
+from app import app
+from db import expenses_collection, user_feedback_collection, db
+from db import indexes
+
+
+# Drop the manifest indexes after each test (other tests insert duplicate serial numbers on purpose)
+@pytest.fixture(autouse=True)
+def clean_indexes():
+    # Check if the database is FINBRAIN or FINBRAINTEST to make sure we are using the correct database for the test
+    if db.name == 'FinBrainTest':
+        expenses_collection.delete_many({})
+    indexes.reset_index_check()
+    yield
+    for spec in indexes.INDEX_MANIFEST:
+        if spec['collection'] != 'users' and spec['name'] in db[spec['collection']].index_information():
+            db[spec['collection']].drop_index(spec['name'])
+    indexes.reset_index_check()
+
+
+def test_apply_indexes_is_idempotent():
+    """
+    Test that apply_indexes creates the missing indexes once and does nothing the second time
+    """
+    created, failed = indexes.apply_indexes()
+
+    # Check if every missing index was created (users.email already exists)
+    assert failed == []
+    assert set(created) == {
+        'expenses.user_id_1_date_1_serial_number_1',
+        'expenses.user_id_1_month_key_1_category_1',
+        'expenses.user_id_1_serial_number_1',
+        'monthly_rollups.user_id_1_month_1_category_1',
+        'user_feedback.email_1_date_1'
+    }
+    assert indexes.find_missing_indexes() == []
+
+    # Check if running it again creates nothing
+    assert indexes.apply_indexes() == ([], [])
+
+
+def test_find_missing_indexes():
+    """
+    Test that the indexes that were not created are reported as missing
+    """
+    missing = indexes.find_missing_indexes()
+
+    # Check if the expenses and feedback indexes are missing and users.email is not
+    assert 'users.email_1' not in missing
+    assert 'expenses.user_id_1_serial_number_1' in missing
+    assert 'user_feedback.email_1_date_1' in missing
+
+
+def test_unique_index_fails_on_duplicates():
+    """
+    Test that a unique index is reported as failed when the data has duplicates, and the others are still created
+    """
+    expenses_collection.insert_many([
+        {"user_id": "u1", "date": "2025-01-01", "serial_number": 1},
+        {"user_id": "u1", "date": "2025-01-02", "serial_number": 1},
+    ])
+
+    created, failed = indexes.apply_indexes()
+
+    # Check if only the unique serial number index failed
+    assert failed == ['expenses.user_id_1_serial_number_1']
+    assert 'expenses.user_id_1_date_1_serial_number_1' in created
+    assert indexes.find_missing_indexes() == ['expenses.user_id_1_serial_number_1']
+
+
+def test_check_indexes_reports_undeclared():
+    """
+    Test that an index that is not in the manifest is logged
+    """
+    user_feedback_collection.create_index([('category', 1)], name='category_1')
+    try:
+        with patch.object(indexes.logger, 'warning') as warning:
+            indexes.check_indexes()
+        # Check if the extra index was reported
+        assert any('user_feedback.category_1' in call.args[0] for call in warning.call_args_list)
+    finally:
+        user_feedback_collection.drop_index('category_1')
+
+
+def test_health_requires_indexes():
+    """
+    Test that /health is not healthy while a required index is missing
+    """
+    client = app.test_client()
+
+    # Check if the missing indexes are reported
+    response = client.get('/health')
+    assert response.json['status'] == 'degraded'
+    assert response.json['indexes'] is False
+    assert 'expenses.user_id_1_serial_number_1' in response.json['missing_indexes']
+
+    # Check if the indexes are reported once created
+    indexes.apply_indexes()
+    indexes.reset_index_check()
+    response = client.get('/health')
+    assert response.json['indexes'] is True
+    assert response.json['missing_indexes'] == []
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True
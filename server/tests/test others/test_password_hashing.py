@@ -2,7 +2,15 @@
 
 
 # type: ignore
-from utils.password_hashing import hash_password, verify_password
+import pytest
+import threading
+from app import app
+from db import users_collection
+from utils import metrics
+from utils import password_hashing
+from argon2 import PasswordHasher
+from utils.password_hashing import hash_password, verify_password, needs_rehash
+from utils.calibrate_argon2 import calibrate_argon2
 
 
 def test_verify_ok():
@@ -44,6 +52,93 @@ def test_hash_outputs_are_unique():
     assert verify_password(plain_password, hash_two) is True
 
 
+def test_pool_hash_and_verify(monkeypatch):
+    """
+    Test that hashing and verification work through the process pool and record the queue wait and hash time
+    """
+    # Use a fresh pool with one worker process
+    monkeypatch.setattr(password_hashing, "PASSWORD_HASH_POOL_ENABLED", True)
+    monkeypatch.setattr(password_hashing, "PASSWORD_HASH_POOL_SIZE", 1)
+    monkeypatch.setattr(password_hashing, "_pool", None)
+    try:
+        # Hash the password in the pool
+        hashed_password = hash_password("pooled-password")
+
+        # Check if the pool verifies the right password and rejects the wrong one
+        assert verify_password("pooled-password", hashed_password) is True
+        assert verify_password("wrong-password", hashed_password) is False
+
+        # Check if the queue wait and hash time were recorded
+        observations = metrics.snapshot()["observations"]
+        assert observations["password_hash_queue_wait_seconds"]["count"] >= 3
+        assert observations["password_hash_seconds"]["count"] >= 3
+    finally:
+        password_hashing._pool.shutdown()
+
+
+def test_pool_full_rejects_quickly(monkeypatch):
+    """
+    Test that when the pool queue is full, hashing is rejected right away instead of waiting
+    """
+    monkeypatch.setattr(password_hashing, "PASSWORD_HASH_POOL_ENABLED", True)
+    # Use an admission semaphore with no free slots
+    full_semaphore = threading.BoundedSemaphore(1)
+    full_semaphore.acquire()
+    monkeypatch.setattr(password_hashing, "_get_pool", lambda: (None, full_semaphore))
+
+    # Check if the verification is rejected as busy
+    with pytest.raises(password_hashing.PasswordHasherBusy):
+        verify_password("password", "hash")
+
+
+def test_login_returns_503_when_pool_full(monkeypatch):
+    """
+    Test that POST /login returns 503 with Retry-After when the hashing pool is full
+    """
+    def busy_verify(password, hashed_password):
+        raise password_hashing.PasswordHasherBusy()
+
+    # Insert a user and make password verification report a full pool
+    users_collection.delete_many({"email": "busy@test.com"})
+    users_collection.insert_one({"firstName": "Busy", "lastName": "User", "email": "busy@test.com", "password": "hash"})
+    monkeypatch.setattr("services.logicconnection.verify_password", busy_verify)
+
+    # Send a POST request to the login route
+    client = app.test_client()
+    response = client.post('/login', json={"email": "busy@test.com", "password": "Secret123"})
+    users_collection.delete_many({"email": "busy@test.com"})
+
+    # Check if the request was rejected with a retry hint
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(password_hashing.PASSWORD_HASH_RETRY_AFTER_SECONDS)
+
+
+def test_needs_rehash_detects_old_settings():
+    """
+    Test that hashes made with other settings need a rehash and hashes made with the current settings do not
+    """
+    # Check if a hash made with weaker settings needs a rehash
+    old_hasher = PasswordHasher(time_cost=1, memory_cost=8192, parallelism=1)
+    assert needs_rehash(old_hasher.hash("old-settings")) is True
+
+    # Check if a hash made with the current settings does not
+    assert needs_rehash(hash_password("current-settings")) is False
+
+
+def test_calibrate_argon2_meets_target():
+    """
+    Test that the calibration picks settings from the candidates that verify within the target time
+    """
+    # Calibrate with one small memory cost and at most two passes
+    result = calibrate_argon2(target_ms=1000, parallelism=1, memory_costs=[8192], max_time_cost=2, rounds=1)
+
+    # Check if the chosen settings are among the candidates and were measured
+    assert result["memory_cost"] == 8192
+    assert 1 <= result["time_cost"] <= 2
+    assert result["parallelism"] == 1
+    assert result["verify_ms"] > 0
+
+
 def test_pass():
     """
     Test that the test passes (to clean up the test database)
@@ -0,0 +1,126 @@
+# FinBrain Project - test_redis_pool.py - MIT License (c) 2025 Nadav Eshed
+
+
+# type: ignore
+import pytest
+import redis
+from app import app
+from db import cache
+from utils import metrics
+
+
+# Every test here needs Redis (they test its connection pool)
+pytestmark = pytest.mark.skipif(cache.CACHE_BACKEND != 'redis', reason="Needs the Redis cache backend")
+
+
+def test_client_uses_instrumented_pool():
+    """
+    Test that the Redis client is built on the bounded, instrumented pool with the configured settings
+    """
+    assert isinstance(cache.r.connection_pool, cache.InstrumentedConnectionPool)
+    kwargs = cache.r.connection_pool.connection_kwargs
+
+    # Check if the timeouts, keepalive, health check and retry policy are applied
+    assert cache.r.connection_pool.max_connections == cache.REDIS_MAX_CONNECTIONS
+    assert kwargs['socket_timeout'] == cache.REDIS_SOCKET_TIMEOUT_SECONDS
+    assert kwargs['socket_connect_timeout'] == cache.REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS
+    assert kwargs['socket_keepalive'] is True
+    assert kwargs['health_check_interval'] == cache.REDIS_HEALTH_CHECK_INTERVAL_SECONDS
+    assert kwargs['retry'].get_retries() == cache.REDIS_RETRY_ATTEMPTS
+
+
+def test_pool_stats_count_connections():
+    """
+    Test that the pool reports in-use and idle connections
+    """
+    pool = cache.create_connection_pool(cache.REDIS_URL)
+    connection = pool.get_connection()
+
+    # Check if the checked out connection is counted as in use
+    stats = pool.get_stats()
+    assert stats['created'] == 1
+    assert stats['in_use'] == 1
+    assert stats['idle'] == 0
+
+    # Check if it is counted as idle after it is released
+    pool.release(connection)
+    stats = pool.get_stats()
+    assert stats['in_use'] == 0
+    assert stats['idle'] == 1
+    pool.disconnect()
+
+
+def test_pool_records_wait_time():
+    """
+    Test that getting a connection records the wait time
+    """
+    before = metrics.snapshot()['observations'].get('redis_pool_wait_seconds', {}).get('count', 0)
+    cache.r.ping()
+    after = metrics.snapshot()['observations']['redis_pool_wait_seconds']['count']
+    assert after > before
+
+
+def test_exhausted_pool_times_out(monkeypatch):
+    """
+    Test that a full pool raises a connection error after the pool timeout instead of opening more connections
+    """
+    monkeypatch.setattr(cache, "REDIS_MAX_CONNECTIONS", 1)
+    monkeypatch.setattr(cache, "REDIS_POOL_TIMEOUT_SECONDS", 0.1)
+    pool = cache.create_connection_pool(cache.REDIS_URL)
+    connection = pool.get_connection()
+    errors_before = metrics.get_counter('redis_pool_errors')
+
+    # Check if the second caller gives up and the error is counted
+    with pytest.raises(redis.ConnectionError):
+        pool.get_connection()
+    assert metrics.get_counter('redis_pool_errors') == errors_before + 1
+
+    pool.release(connection)
+    pool.disconnect()
+
+
+def test_transient_error_is_retried():
+    """
+    Test that a command is retried after a transient connection error
+    """
+    pool = cache.create_connection_pool(cache.REDIS_URL)
+    client = redis.Redis(connection_pool=pool)
+    connection = pool.get_connection()
+    pool.release(connection)
+
+    # Make the next send fail once, as if the connection was reset
+    original_send = connection.send_command
+    calls = {'count': 0}
+
+    def flaky_send(*args, **kwargs):
+        if args[0] == 'PING':
+            calls['count'] += 1
+        if calls['count'] == 1 and args[0] == 'PING':
+            raise redis.ConnectionError("Connection reset by peer")
+        return original_send(*args, **kwargs)
+
+    connection.send_command = flaky_send
+    assert client.ping() is True
+    assert calls['count'] == 2
+    pool.disconnect()
+
+
+def test_metrics_route_reports_pool_stats():
+    """
+    Test that /metrics exposes the pool statistics
+    """
+    client = app.test_client()
+    response = client.get('/metrics')
+    data = response.get_json()
+
+    # Check if the pool statistics are included
+    assert response.status_code == 200
+    assert set(data['redis_pool']) == {'max_connections', 'created', 'in_use', 'idle'}
+    assert data['redis_pool']['max_connections'] == cache.REDIS_MAX_CONNECTIONS
+
+
+def test_pass():
+    """
+    Test that the test passes (to clean up the test database)
+    """
+    assert True